@@ -0,0 +1,113 @@
+"""Read-only JSON API for finance tooling, served by the health endpoint's aiohttp app.
+
+    GET /payments?since=&until=&category=&method=&cursor=&limit=   approved payments, keyset pages
+    GET /payments/{id}                                             one payment
+    GET /totals?since=&until=                                      approved total in BASE_CURRENCY
+
+Dates are YYYY-MM-DD (local time, `until` inclusive) or epoch seconds. All reads use the
+single read-only connection from generators.reader(). Every response carries an ETag built
+from PRAGMA data_version and the request's path and query: a client that polls a URL with
+If-None-Match gets 304 (no query at all) until something has been committed. With API_TOKEN set, requests must send
+"Authorization: Bearer <token>"."""
+
+import asyncio
+import hashlib
+import hmac
+import os
+
+from aiohttp import web
+
+from generators import reader, list_payments, sum_approved_base, LIST_PAGE
+
+MAX_LIMIT = 1000
+
+
+def _token() -> str:
+    return os.getenv("API_TOKEN", "")
+
+
+def _authorized(request: web.Request) -> bool:
+    token = _token()
+    if not token:
+        return True
+    header = request.headers.get("Authorization", "")
+    return header.startswith("Bearer ") and hmac.compare_digest(header[7:], token)
+
+
+def _arg(request: web.Request, name: str):
+    value = request.query.get(name, "").strip()
+    if not value:
+        return None
+    return int(value) if value.isdigit() else value
+
+
+async def _respond(request: web.Request, read) -> web.Response:
+    """Run read(con) on the reader connection unless the client's ETag is still current."""
+    if not _authorized(request):
+        return web.json_response({"error": "unauthorized"}, status=401)
+    match = request.headers.get("If-None-Match", "")
+    resource = hashlib.sha1(request.path_qs.encode("utf-8")).hexdigest()[:12]
+
+    def work():
+        with reader() as (con, version):
+            etag = f'"{version}-{resource}"'
+            if etag in match:
+                return etag, None
+            return etag, read(con)
+
+    try:
+        etag, body = await asyncio.to_thread(work)
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=400)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if body is None:
+        return web.Response(status=304, headers=headers)
+    if isinstance(body, web.Response):
+        return body
+    return web.json_response(body, headers=headers)
+
+
+def _limit(request: web.Request) -> int:
+    value = request.query.get("limit", "").strip() or LIST_PAGE
+    try:
+        return max(1, min(int(value), MAX_LIMIT))
+    except ValueError:
+        raise ValueError(f"Bad limit: {value!r}")
+
+
+async def payments(request: web.Request) -> web.Response:
+    def read(con):
+        limit = _limit(request)  # inside read: a bad value is a 400, after the auth check
+        rows, cursor = list_payments(
+            _arg(request, "since"), _arg(request, "until"),
+            category=_arg(request, "category"), method=_arg(request, "method"),
+            cursor=request.query.get("cursor") or None, limit=limit, con=con,
+        )
+        return {"items": [p.as_dict() for p in rows], "next_cursor": cursor}
+
+    return await _respond(request, read)
+
+
+async def payment(request: web.Request) -> web.Response:
+    try:
+        pid = int(request.match_info["id"])
+    except ValueError:
+        return web.json_response({"error": "bad id"}, status=400)
+
+    def read(con):
+        row = con.execute("SELECT * FROM payments WHERE id=?", (pid,)).fetchone()
+        if row is None:
+            return web.json_response({"error": "not found"}, status=404)
+        return dict(row)
+
+    return await _respond(request, read)
+
+
+async def totals(request: web.Request) -> web.Response:
+    return await _respond(request, lambda con: sum_approved_base(_arg(request, "since"), _arg(request, "until"), con=con))
+
+
+def setup(app: web.Application) -> None:
+    app.router.add_get("/payments", payments)
+    app.router.add_get("/payments/{id}", payment)
+    app.router.add_get("/totals", totals)
@@ -0,0 +1,134 @@
+"""Group commit for staged approvals.
+
+Approve taps are queued; the committer takes everything that is waiting (plus whatever
+arrives within GROUP_COMMIT_MS) and writes the batch with create_approved_payments_bulk:
+one BEGIN IMMEDIATE transaction, one timestamp, one commit for all of them. Without a
+running committer (tests, CLI) approve() falls back to a single-row transaction.
+
+The window is only waited for when other approvals were already queued. A lone tap is
+committed at once: PerChatOrderingMiddleware runs one approver's taps one after another,
+so they never share a batch, and only taps of different approvers (or chats) that arrive
+together are grouped."""
+
+import asyncio
+import logging
+import os
+
+from generators import create_approved_payment, create_approved_payments_bulk
+
+GROUP_COMMIT_MS = float(os.getenv("GROUP_COMMIT_MS", "5"))
+MAX_BATCH = 200
+
+
+class ApprovalCommitter:
+    def __init__(self, window_ms: float = GROUP_COMMIT_MS, max_batch: int = MAX_BATCH):
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._queue: asyncio.Queue | None = None
+        self.batches = 0
+        self.approvals = 0
+        self.immediate = 0  # batches committed without waiting for the window
+
+    @property
+    def running(self) -> bool:
+        return self._queue is not None
+
+    async def approve(self, staged_id: int, staged: dict, approver_id: int) -> int | None:
+        """Insert the staged payment (claim, payment, audit rows, receipt, group message
+        location). Returns the payment id, or None if the staged id was already claimed."""
+        if self._queue is None:
+            return await asyncio.to_thread(_approve_one, staged_id, staged, approver_id)
+        fut = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((int(staged_id), dict(staged, approver_id=approver_id), fut))
+        return await fut
+
+    async def _fill(self, batch: list) -> None:
+        """Add what is queued to `batch` (in place); if that was anything, also what
+        arrives within the window."""
+        while len(batch) < self.max_batch and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        if len(batch) == 1:
+            self.immediate += 1
+            return  # nothing else is waiting: do not delay this approval for a window
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.window
+        while len(batch) < self.max_batch:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+    async def _commit(self, batch: list) -> None:
+        items, seen = [], set()
+        for sid, st, _fut in batch:
+            if sid not in seen:
+                seen.add(sid)
+                items.append((sid, st))
+        try:
+            done = await asyncio.to_thread(create_approved_payments_bulk, items)
+        except Exception as e:
+            for _sid, _st, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        self.batches += 1
+        self.approvals += len(done)
+        for sid, _st, fut in batch:
+            if not fut.done():
+                fut.set_result(done.pop(sid, None))  # a duplicate in the batch gets None
+
+    async def run(self) -> None:
+        """Background loop; approve() queues only while this is running."""
+        self._queue = asyncio.Queue()
+        batch = []
+        try:
+            while True:
+                batch = [await self._queue.get()]
+                await self._fill(batch)
+                pending, batch = batch, []
+                # shielded: a cancelled loop still finishes the commit and answers the callers
+                await asyncio.shield(self._commit(pending))
+        finally:
+            queue, self._queue = self._queue, None
+            while not queue.empty():
+                batch.append(queue.get_nowait())
+            if batch:
+                logging.info(f"Committer stopping: writing {len(batch)} queued approvals")
+                await self._commit(batch)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "approvals": self.approvals,
+            "avg_batch": round(self.approvals / self.batches, 2) if self.batches else 0.0,
+            "immediate": self.immediate,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+        }
+
+
+def _approve_one(staged_id: int, st: dict, approver_id: int) -> int | None:
+    return create_approved_payment(
+        initiator_id=st["initiator_id"],
+        approver_id=approver_id,
+        amount=st["amount"],
+        currency=st["currency"],
+        method=st["method"],
+        description=st["description"],
+        category=st["category"],
+        staged_id=staged_id,
+        receipt_file=st.get("receipt_file"),
+        receipt_kind=st.get("receipt_kind"),
+        receipt_unique_id=st.get("receipt_unique_id"),
+        receipt_name=st.get("receipt_name"),
+        group_chat_id=st.get("group_chat_id"),
+        group_msg_id=st.get("group_msg_id"),
+    )
+
+
+committer = ApprovalCommitter()
@@ -0,0 +1,143 @@
+"""Graceful shutdown: drain in-flight work and hand state over to the next process.
+
+On SIGTERM aiogram stops polling (no new updates are fetched). shutdown() then:
+  1. waits for handlers still running, up to DRAIN_TIMEOUT_S;
+  2. stops the group committer, which commits whatever is queued;
+  3. flushes the Sheets writer queue (rows that do not make it go into the snapshot);
+  4. writes staged requests, FSM states and unwritten sheet rows to <data_dir>/state_snapshot.json.
+restore() loads and removes that file at startup, so a deploy (stop old container, start
+new one) loses neither pending approvals nor half-filled /newpay dialogs."""
+
+import asyncio
+import dataclasses
+import json
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.types import Update
+
+import generators
+import memory_store
+import sheet_logger
+
+DRAIN_TIMEOUT_S = float(os.getenv("DRAIN_TIMEOUT_S", "20"))
+SNAPSHOT_NAME = "state_snapshot.json"
+
+
+def snapshot_path() -> str:
+    return os.path.join(generators.data_dir(), SNAPSHOT_NAME)
+
+
+class InFlightTracker(BaseMiddleware):
+    """Outer update middleware counting updates that are queued or being handled."""
+
+    def __init__(self):
+        self.active = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        self.active += 1
+        self._idle.clear()
+        try:
+            return await handler(event, data)
+        finally:
+            self.active -= 1
+            if self.active == 0:
+                self._idle.set()
+
+    async def wait(self, timeout: float) -> bool:
+        """True once nothing is in flight, False if `timeout` ran out first."""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+def _fsm_records(storage) -> list:
+    """[{key, state, data}] from aiogram's MemoryStorage (other storages persist themselves)."""
+    records = getattr(storage, "storage", None)
+    if not isinstance(records, dict):
+        return []
+    out = []
+    for key, record in records.items():
+        if record.state is None and not record.data:
+            continue
+        out.append({"key": dataclasses.asdict(key), "state": record.state, "data": record.data})
+    return out
+
+
+def write_snapshot(storage, sheet_rows: list, path: str | None = None) -> dict:
+    path = path or snapshot_path()
+    snapshot = {
+        "saved_at": time.time(),
+        "staged": memory_store.dump_staged(),
+        "fsm": _fsm_records(storage),
+        "sheet_rows": sheet_rows,
+    }
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f, ensure_ascii=False, default=str)
+    os.replace(tmp, path)
+    return {k: len(v) for k, v in snapshot.items() if k != "saved_at"}
+
+
+async def restore(storage, path: str | None = None) -> dict:
+    """Load the snapshot of the previous process (if any) and remove the file."""
+    path = path or snapshot_path()
+    try:
+        with open(path, encoding="utf-8") as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logging.warning(f"Cannot read state snapshot {path}: {e}")
+        return {}
+    staged = memory_store.restore_staged(snapshot.get("staged") or {})
+    fsm = 0
+    for rec in snapshot.get("fsm") or []:
+        key = StorageKey(**rec["key"])
+        await storage.set_state(key, rec.get("state"))
+        await storage.set_data(key, rec.get("data") or {})
+        fsm += 1
+    rows = snapshot.get("sheet_rows") or []
+    if rows:
+        sheet_logger.requeue(rows)
+    os.remove(path)
+    restored = {"staged": staged, "fsm": fsm, "sheet_rows": len(rows)}
+    logging.info(f"Restored state snapshot: {restored}")
+    return restored
+
+
+async def shutdown(tracker: InFlightTracker, storage, committer_task: asyncio.Task | None = None,
+                   timeout: float = DRAIN_TIMEOUT_S) -> dict:
+    """Steps 1-4 from the module docstring; call after polling has stopped."""
+    deadline = time.monotonic() + timeout
+    started = time.perf_counter()
+    if not await tracker.wait(timeout):
+        logging.warning(f"Shutdown: {tracker.active} update(s) still running after {timeout:.0f}s")
+    if committer_task is not None:
+        committer_task.cancel()  # its finally commits what is queued
+        try:
+            await committer_task
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logging.warning(f"Shutdown: committer stopped with an error: {e}")
+    flushed = await asyncio.to_thread(sheet_logger.flush, max(1.0, deadline - time.monotonic()))
+    rows = sheet_logger.take_unwritten()
+    if not flushed:
+        logging.warning(f"Shutdown: Sheets writer not done; {len(rows)} queued row(s) go into the snapshot")
+    saved = await asyncio.to_thread(write_snapshot, storage, rows)
+    logging.info(f"Shutdown drained in {(time.perf_counter() - started) * 1000:.0f} ms; snapshot {saved}")
+    return saved
@@ -1,18 +1,103 @@
 import os
+import re
+import json
+import uuid
+import hashlib
 import sqlite3
+import unicodedata
+import tempfile
+import threading
+from contextlib import contextmanager, nullcontext
 from pathlib import Path
-from datetime import datetime
+from datetime import date, datetime, timedelta
+
+import payment_cache
+from models import payment_row
 
 # --- CONFIG (SQLite only) ---
 DEFAULT_DB_PATH = os.path.join(os.path.dirname(__file__), "botdata.db")
 DB_PATH = os.getenv("DB_PATH", DEFAULT_DB_PATH)
 Path(DB_PATH).parent.mkdir(parents=True, exist_ok=True)
+_DB_URI = False   # DB_PATH is a sqlite "file:" URI
+_anchor = None    # connection that keeps a shared-cache in-memory DB alive
+
+
+def configure(db_path: str) -> None:
+    """Point all DB access at `db_path`: a file path, a "file:" URI, or ":memory:"
+    (a private in-memory DB with shared cache, alive until the next configure())."""
+    global _anchor
+    if _anchor is not None:
+        _anchor.close()
+        _anchor = None
+    _set_db(*_open_target(db_path))
+
+
+def _open_target(db_path: str):
+    """(path, is_uri, anchor connection or None) for configure()/database()."""
+    if db_path == ":memory:":
+        uri = f"file:botdata-{uuid.uuid4().hex}?mode=memory&cache=shared"
+        return uri, True, sqlite3.connect(uri, uri=True, check_same_thread=False)
+    if db_path.startswith("file:"):
+        return db_path, True, None
+    Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+    return db_path, False, None
+
+
+def _set_db(path: str, is_uri: bool, anchor) -> None:
+    global DB_PATH, _DB_URI, _anchor
+    DB_PATH, _DB_URI, _anchor = path, is_uri, anchor
+    _invalidate_roles()
+    payment_cache.clear()
+    _close_reader()
+
+
+def data_dir() -> str:
+    """Directory for files that live next to the database (receipts, snapshots)."""
+    if _DB_URI:
+        return tempfile.gettempdir()
+    return os.path.dirname(os.path.abspath(DB_PATH))
+
+
+@contextmanager
+def database(db_path: str | None = None):
+    """Use another database inside the block, with the schema initialized.
+
+    Default is a fresh temporary file (removed afterwards); pass ":memory:" for a
+    shared-cache in-memory DB. The previous database is restored on exit."""
+    prev = (DB_PATH, _DB_URI, _anchor)
+    tmpdir = None
+    if db_path is None:
+        tmpdir = tempfile.TemporaryDirectory(prefix="botdata-")
+        db_path = os.path.join(tmpdir.name, "botdata.db")
+    target = _open_target(db_path)
+    _set_db(*target)
+    try:
+        init_db()
+        yield DB_PATH
+    finally:
+        if target[2] is not None:
+            target[2].close()
+        _set_db(*prev)
+        if tmpdir is not None:
+            tmpdir.cleanup()
+
+# --- CURRENCIES ---
+# Amounts are also stored converted to BASE_CURRENCY (payments.amount_base) at approval
+# time, using the local fx_rates table (rate = BASE_CURRENCY units per 1 unit).
+BASE_CURRENCY = os.getenv("BASE_CURRENCY", "THB")
+CURRENCIES = [BASE_CURRENCY] + [c for c in ("USD", "USDT") if c != BASE_CURRENCY]
 
 # --- CONNECTION ---
 
+# Several bot workers may share one DB file; give writers time to queue on the lock.
+BUSY_TIMEOUT = 30.0
+
+
 def _conn():
-    con = sqlite3.connect(DB_PATH)
+    con = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT, uri=_DB_URI)
     con.row_factory = sqlite3.Row
+    # with WAL (set in init_db) a commit appends to the -wal file; fsync happens at checkpoints
+    con.execute("PRAGMA synchronous=NORMAL")
     return con
 
 # --- INIT DB ---
@@ -20,6 +105,12 @@ def _conn():
 def init_db() -> None:
     with _conn() as con:
         cur = con.cursor()
+        # takes effect only for a new file (so before journal_mode); maintenance.py switches
+        # older ones with a VACUUM
+        cur.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        if not _DB_URI:
+            # persistent; readers no longer block the writer and commits skip the journal rewrite
+            cur.execute("PRAGMA journal_mode=WAL")
         # config key/value
         cur.execute(
             """
@@ -74,16 +165,244 @@ def init_db() -> None:
             )
             """
         )
+        # staged request claims: one row per staged id makes approve/reject exactly-once
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS staged_claims (
+                staged_id   INTEGER PRIMARY KEY,
+                action      TEXT NOT NULL,
+                actor_id    INTEGER NOT NULL,
+                payment_id  INTEGER,
+                ts          TEXT NOT NULL,
+                FOREIGN KEY (payment_id) REFERENCES payments(id)
+            )
+            """
+        )
+        # user roles: many initiators/approvers/viewers per role
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS user_roles (
+                user_id  INTEGER NOT NULL,
+                role     TEXT NOT NULL,
+                PRIMARY KEY (user_id, role)
+            ) WITHOUT ROWID
+            """
+        )
+        _migrate_roles(cur)
+        _migrate_audit_log(cur)
+        # FX rates maintained locally (python importer.py fx FILE, /fx_set)
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS fx_rates (
+                date      TEXT NOT NULL,
+                currency  TEXT NOT NULL,
+                rate      REAL NOT NULL,
+                PRIMARY KEY (currency, date)
+            ) WITHOUT ROWID
+            """
+        )
+        _ensure_column(cur, "payments", "amount_base", "REAL")
+        # row version: bumped by every UPDATE, keys the in-process payment cache
+        _ensure_column(cur, "payments", "version", "INTEGER NOT NULL DEFAULT 1")
+        _migrate_epoch_columns(cur)
+        # receipts attached to payments (Telegram file ids + content hash of the local copy)
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS receipts (
+                id              INTEGER PRIMARY KEY AUTOINCREMENT,
+                payment_id      INTEGER NOT NULL,
+                file_id         TEXT NOT NULL,
+                file_unique_id  TEXT,
+                kind            TEXT,
+                file_name       TEXT,
+                sha256          TEXT,
+                size            INTEGER,
+                attempts        INTEGER NOT NULL DEFAULT 0,
+                created_at      TEXT NOT NULL,
+                stored_at       TEXT,
+                FOREIGN KEY (payment_id) REFERENCES payments(id)
+            )
+            """
+        )
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_receipts_payment ON receipts(payment_id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_receipts_unique ON receipts(file_unique_id)")
+        _migrate_fingerprints(cur)
         # seed system methods if empty
         cur.execute("SELECT COUNT(*) AS cnt FROM methods")
         if cur.fetchone()[0] == 0:
             cur.executemany("INSERT INTO methods(name) VALUES (?)", [("Bank",), ("USDT",), ("Cash",)])
         con.commit()
+    _invalidate_roles()
+    backfill_amount_base()
     try:
         ensure_methods_whitelist()
     except Exception:
         pass
 
+_reader = None          # (connection, generation) shared by read-only API requests
+_reader_lock = threading.Lock()
+
+
+def _close_reader() -> None:
+    global _reader
+    with _reader_lock:
+        if _reader is not None:
+            _reader[0].close()
+            _reader = None
+
+
+@contextmanager
+def reader():
+    """Yield (connection, data version) on the long-lived read-only connection.
+
+    PRAGMA data_version changes whenever another connection commits, so the version string
+    (prefixed with a per-connection generation) is a cheap cache validator. Callers are
+    serialized; keep the block short."""
+    global _reader
+    with _reader_lock:
+        if _reader is None:
+            con = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT, uri=_DB_URI, check_same_thread=False)
+            con.row_factory = sqlite3.Row
+            con.execute("PRAGMA query_only=ON")
+            _reader = (con, uuid.uuid4().hex[:8])
+        con, generation = _reader
+        version = con.execute("PRAGMA data_version").fetchone()[0]
+        yield con, f"{generation}-{version}"
+
+
+def check_db_writable(timeout: float = 1.0) -> bool:
+    """True if a write lock can be taken right now (nothing is written)."""
+    try:
+        con = sqlite3.connect(DB_PATH, timeout=timeout, uri=_DB_URI)
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            con.rollback()
+        finally:
+            con.close()
+        return True
+    except sqlite3.Error:
+        return False
+
+def _ensure_column(cur, table: str, column: str, decl: str) -> None:
+    cur.execute(f"PRAGMA table_xinfo({table})")  # xinfo: generated columns too
+    if column not in {r[1] for r in cur.fetchall()}:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+def _migrate_epoch_columns(cur) -> None:
+    """created_ts/approved_ts/rejected_ts: UTC epoch seconds next to the local-time TEXT
+    columns; filled from the text (read as local time) for rows written before them."""
+    for name in ("created", "approved", "rejected"):
+        _ensure_column(cur, "payments", f"{name}_ts", "INTEGER")
+        cur.execute(
+            f"UPDATE payments SET {name}_ts = CAST(strftime('%s', {name}_at, 'utc') AS INTEGER) "
+            f"WHERE {name}_ts IS NULL AND {name}_at IS NOT NULL"
+        )
+    # one index for the approved range: keyset pages in (approved_ts, id) order and, with
+    # amount_base in it, totals that never touch the table
+    columns = ["status", "approved_ts", "id", "amount_base"]
+    cur.execute("PRAGMA index_info(idx_payments_approved_ts)")
+    if [r[2] for r in cur.fetchall()] != columns:
+        cur.execute("DROP INDEX IF EXISTS idx_payments_approved_ts")
+    cur.execute(f"CREATE INDEX IF NOT EXISTS idx_payments_approved_ts ON payments({', '.join(columns)})")
+    cur.execute("DROP INDEX IF EXISTS idx_payments_status_approved_base")  # superseded (approved_at TEXT)
+
+
+_LEGACY_MONEY = re.compile(r"^(-?[\d.]+) (\S+) (.+?) \| (.*)$")
+_LEGACY_POSTED = re.compile(r"^chat_id=(-?\d+), msg_id=(\d+)$")
+
+
+def _legacy_payload(text: str) -> dict:
+    """JSON form of the old free-form audit payloads ("1000.0 THB Cash | Rent", "chat_id=.., msg_id=..")."""
+    m = _LEGACY_MONEY.match(text)
+    if m:
+        return {"amount": float(m[1]), "currency": m[2], "method": m[3], "category": m[4]}
+    m = _LEGACY_POSTED.match(text)
+    if m:
+        return {"chat_id": int(m[1]), "msg_id": int(m[2])}
+    return {"text": text}
+
+
+def _migrate_audit_log(cur) -> None:
+    """JSON payloads with generated columns over them, and the history / actor indexes."""
+    # payload fields as virtual columns; json_valid keeps a stray non-JSON payload from failing reads
+    for column, path, kind in (("amount", "$.amount", "REAL"), ("currency", "$.currency", "TEXT"), ("chat_id", "$.chat_id", "INTEGER")):
+        _ensure_column(
+            cur, "audit_log", f"p_{column}",
+            f"{kind} GENERATED ALWAYS AS (CASE WHEN json_valid(payload) THEN json_extract(payload, '{path}') END) VIRTUAL",
+        )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_audit_payment_ts ON audit_log(payment_id, ts)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_audit_actor_ts ON audit_log(actor_id, ts)")
+    cur.execute("SELECT 1 FROM config WHERE key='audit_json'")
+    if cur.fetchone():
+        return
+    cur.execute("SELECT id, payload FROM audit_log WHERE payload IS NOT NULL AND NOT json_valid(payload)")
+    cur.executemany(
+        "UPDATE audit_log SET payload=? WHERE id=?",
+        [(_payload(**_legacy_payload(text)), aid) for aid, text in cur.fetchall()],
+    )
+    cur.execute("INSERT INTO config (key, value) VALUES ('audit_json', '1')")
+
+
+def _payload(**fields) -> str | None:
+    """audit_log.payload: compact JSON of the non-empty fields (None if there are none)."""
+    fields = {k: v for k, v in fields.items() if v is not None}
+    return json.dumps(fields, ensure_ascii=False, separators=(",", ":")) if fields else None
+
+
+def _migrate_roles(cur) -> None:
+    """Fill user_roles once from the legacy scalar config keys and the 'initiators' list.
+
+    The 'roles_migrated' marker keeps a table emptied later (every role revoked) empty;
+    databases migrated before the marker existed are recognized by a non-empty table."""
+    cur.execute("SELECT 1 FROM config WHERE key='roles_migrated'")
+    if cur.fetchone():
+        return
+    cur.execute("INSERT INTO config (key, value) VALUES ('roles_migrated', '1')")
+    cur.execute("SELECT 1 FROM user_roles LIMIT 1")
+    if cur.fetchone():
+        return
+    cur.execute("SELECT key, value FROM config WHERE key IN ('initiator_id','secondary_initiator_id','initiators','approver_id','viewer_id')")
+    rows = []
+    for key, value in cur.fetchall():
+        if key == "initiators":
+            rows += [(uid, "initiator") for uid in _parse_int_list(value or "")]
+        elif value is not None and str(value).lstrip("+-").isdigit():
+            role = "initiator" if key in ("initiator_id", "secondary_initiator_id") else key[:-3]
+            rows.append((int(value), role))
+    cur.executemany("INSERT OR IGNORE INTO user_roles (user_id, role) VALUES (?, ?)", rows)
+
+def _migrate_fingerprints(cur) -> None:
+    """Duplicate detector: one row per staged request or approved payment, looked up by fp."""
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='fingerprints'")
+    exists = cur.fetchone() is not None
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS fingerprints (
+            id            INTEGER PRIMARY KEY AUTOINCREMENT,
+            fp            TEXT NOT NULL,
+            staged_id     INTEGER UNIQUE,
+            payment_id    INTEGER,
+            initiator_id  INTEGER,
+            created_ts    INTEGER NOT NULL
+        )
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_fingerprints_fp ON fingerprints(fp, created_ts)")
+    if exists:
+        return
+    # new table: recently approved payments count as possible originals right away
+    since = int(datetime.now().timestamp()) - DUPLICATE_WINDOW_DAYS * 86400
+    cur.execute(
+        "SELECT id, amount, currency, method, category, description, initiator_id, approved_ts FROM payments "
+        "WHERE status='APPROVED' AND approved_ts >= ?",
+        (since,),
+    )
+    cur.executemany(
+        "INSERT INTO fingerprints (fp, payment_id, initiator_id, created_ts) VALUES (?, ?, ?, ?)",
+        [(payment_fingerprint(r[1], r[2], r[3], r[4], r[5]), r[0], r[6], r[7]) for r in cur.fetchall()],
+    )
+
 # --- CONFIG UTILS ---
 
 def set_config(key: str, value) -> None:
@@ -124,29 +443,120 @@ def set_group_id(chat_id: int) -> None:
 
 
 def get_roles() -> dict:
+    """Primary user per role (legacy scalar view, used for display)."""
     return {
         "initiator_id": get_config("initiator_id", None, int),
         "approver_id": get_config("approver_id", None, int),
         "viewer_id": get_config("viewer_id", None, int),
     }
 
+# --- ROLES ---
+ROLES = ("initiator", "approver", "viewer")
+
+# In-memory role map {role: frozenset(user_ids)}; rebuilt after any role change, so
+# authorization checks cost no queries. Other processes pick up changes on restart.
+_role_map: dict | None = None
+_role_lock = threading.Lock()
+
+
+def _invalidate_roles() -> None:
+    global _role_map
+    with _role_lock:
+        _role_map = None
+
+
+def _roles() -> dict:
+    global _role_map
+    m = _role_map
+    if m is not None:
+        return m
+    with _role_lock:
+        if _role_map is None:
+            acc = {r: set() for r in ROLES}
+            with _conn() as con:
+                for uid, role in con.execute("SELECT user_id, role FROM user_roles"):
+                    acc.setdefault(role, set()).add(int(uid))
+            _role_map = {r: frozenset(ids) for r, ids in acc.items()}
+        return _role_map
+
+
+def role_members(role: str) -> frozenset:
+    return _roles().get(role, frozenset())
+
+
+def has_role(user_id: int, *roles: str) -> bool:
+    """Authorization helper: True if user_id holds any of `roles`."""
+    m = _roles()
+    return any(user_id in m.get(r, ()) for r in roles)
+
+
+def add_role(user_id: int, role: str) -> None:
+    if role not in ROLES:
+        raise ValueError(f"Unknown role: {role}")
+    with _conn() as con:
+        con.execute("INSERT OR IGNORE INTO user_roles (user_id, role) VALUES (?, ?)", (int(user_id), role))
+        con.commit()
+    _invalidate_roles()
+
+
+def remove_role(user_id: int, role: str) -> bool:
+    with _conn() as con:
+        cur = con.execute("DELETE FROM user_roles WHERE user_id=? AND role=?", (int(user_id), role))
+        con.commit()
+    _invalidate_roles()
+    return cur.rowcount > 0
+
+
+# scalar config keys that grant each role
+_PRIMARY_KEYS = {
+    "initiator": ("initiator_id", "secondary_initiator_id"),
+    "approver": ("approver_id",),
+    "viewer": ("viewer_id",),
+}
+
+
+def _set_primary(key: str, role: str, user_id: int) -> None:
+    """Set the scalar config key and replace its previous holder in user_roles (unless
+    another key of the same role still names that user)."""
+    user_id = int(user_id)
+    with _conn() as con:
+        cur = con.cursor()
+        cur.execute("SELECT value FROM config WHERE key=?", (key,))
+        row = cur.fetchone()
+        prev = row[0] if row else None
+        if prev is not None and str(prev).lstrip("+-").isdigit() and int(prev) != user_id:
+            others = [k for k in _PRIMARY_KEYS[role] if k != key]
+            cur.execute(
+                f"SELECT 1 FROM config WHERE key IN ({','.join('?' * len(others))}) AND value=?",
+                (*others, str(int(prev))),
+            )
+            if cur.fetchone() is None:
+                cur.execute("DELETE FROM user_roles WHERE user_id=? AND role=?", (int(prev), role))
+        cur.execute(
+            "INSERT INTO config(key,value) VALUES(?,?) ON CONFLICT(key) DO UPDATE SET value=excluded.value",
+            (key, str(user_id)),
+        )
+        cur.execute("INSERT OR IGNORE INTO user_roles (user_id, role) VALUES (?, ?)", (user_id, role))
+        con.commit()
+    _invalidate_roles()
+
 
 def set_all_me(user_id: int) -> None:
-    set_config("initiator_id", user_id)
-    set_config("approver_id", user_id)
-    set_config("viewer_id", user_id)
+    set_initiator(user_id)
+    set_approver(user_id)
+    set_viewer(user_id)
 
 
 def set_initiator(user_id: int) -> None:
-    set_config("initiator_id", user_id)
+    _set_primary("initiator_id", "initiator", user_id)
 
 
 def set_approver(approver_id: int) -> None:
-    set_config("approver_id", approver_id)
+    _set_primary("approver_id", "approver", approver_id)
 
 
 def set_viewer(viewer_id: int) -> None:
-    set_config("viewer_id", viewer_id)
+    _set_primary("viewer_id", "viewer", viewer_id)
 
 
 def get_secondary_initiator():
@@ -154,7 +564,7 @@ def get_secondary_initiator():
 
 
 def set_secondary_initiator(user_id: int) -> None:
-    set_config("secondary_initiator_id", int(user_id))
+    _set_primary("secondary_initiator_id", "initiator", user_id)
 
 
 def seed_secondary_initiator_if_empty(user_id: int) -> None:
@@ -180,36 +590,48 @@ def _parse_int_list(val: str):
 
 
 def get_initiators():
-    raw = get_config("initiators", "", str)
-    lst = _parse_int_list(raw or "")
-    legacy = get_config("initiator_id", None, int)
-    if isinstance(legacy, int) and legacy not in lst:
-        lst.append(legacy)
-    return sorted(set(int(x) for x in lst))
+    return sorted(role_members("initiator"))
 
 
 def set_initiators(ids):
     try:
-        ids = [int(x) for x in ids]
+        ids = sorted({int(x) for x in ids})
     except Exception:
         ids = []
-    ids = sorted(set(ids))
-    set_config("initiators", ",".join(str(i) for i in ids))
+    with _conn() as con:
+        con.execute("DELETE FROM user_roles WHERE role='initiator'")
+        con.executemany("INSERT INTO user_roles (user_id, role) VALUES (?, 'initiator')", [(i,) for i in ids])
+        con.commit()
+    _invalidate_roles()
 
 
 def add_initiator(user_id: int):
-    ids = get_initiators()
-    if int(user_id) not in ids:
-        ids.append(int(user_id))
-        set_initiators(ids)
+    add_role(user_id, "initiator")
 
 
 def is_initiator(user_id: int) -> bool:
-    return int(user_id) in set(get_initiators())
+    return has_role(int(user_id), "initiator")
 
 # --- METHODS ---
 ALLOWED_METHODS = ["Bank", "USDT", "Cash"]
 
+# --- CATEGORIES (label, code) ---
+CATEGORIES = [
+    ("📮 Rent & Utilities", "rent"),
+    ("🥳 Salaries & Employee Payments", "salaries"),
+    ("🛵 Transport & Logistics", "transport"),
+    ("⚡️ Marketing & Advertising", "marketing"),
+    ("👨🏽‍💻 IT & Services", "it"),
+    ("🧐 Operating Expenses (Other)", "operating"),
+]
+
+
+def get_category_label_by_code(code: str) -> str:
+    for label, c in CATEGORIES:
+        if c == code:
+            return label
+    return "🧐 Operating Expenses (Other)"
+
 
 def ensure_methods_whitelist():
     with _conn() as con:
@@ -276,21 +698,167 @@ def get_method_by_id(mid: int):
             return None
         return {"id": int(row[0]), "name": row[1]}
 
+# --- FX RATES ---
+
+def set_fx_rates(rows) -> int:
+    """Upsert (date YYYY-MM-DD, currency, rate) rows; fills amount_base where it was missing."""
+    rows = [(str(d), str(c).upper(), float(r)) for d, c, r in rows]
+    with _conn() as con:
+        con.executemany(
+            "INSERT INTO fx_rates (date, currency, rate) VALUES (?, ?, ?) "
+            "ON CONFLICT(currency, date) DO UPDATE SET rate=excluded.rate",
+            rows,
+        )
+        con.commit()
+    backfill_amount_base()
+    return len(rows)
+
+
+def get_fx_rate(currency: str, on_date: str | None = None):
+    """Latest rate for currency on or before on_date (YYYY-MM-DD, default today); 1.0 for the base."""
+    with _conn() as con:
+        return _fx_lookup(con.cursor())(currency, on_date or _now()[:10])
+
+
+def list_fx_latest() -> list:
+    with _conn() as con:
+        cur = con.cursor()
+        cur.execute("SELECT currency, MAX(date) AS date, rate FROM fx_rates GROUP BY currency ORDER BY currency")
+        return [dict(r) for r in cur.fetchall()]
+
+
+def _fx_lookup(cur):
+    """Memoized (currency, YYYY-MM-DD) -> rate or None, for use inside one transaction."""
+    memo = {}
+
+    def lookup(currency: str, day: str):
+        if currency == BASE_CURRENCY:
+            return 1.0
+        key = (currency, day[:10])
+        if key not in memo:
+            cur.execute(
+                "SELECT rate FROM fx_rates WHERE currency=? AND date<=? ORDER BY date DESC LIMIT 1",
+                key,
+            )
+            row = cur.fetchone()
+            memo[key] = float(row[0]) if row else None
+        return memo[key]
+
+    return lookup
+
+
+def _to_base(lookup, amount: float, currency: str, day: str):
+    rate = lookup(currency, day)
+    return round(float(amount) * rate, 2) if rate is not None else None
+
+
+def backfill_amount_base() -> int:
+    """Compute amount_base for approved payments that still lack it (e.g. rate imported later).
+    Rows with still no rate are left alone: no version bump, no cache flush."""
+    with _conn() as con:
+        cur = con.cursor()
+        cur.execute(
+            f"""
+            UPDATE payments SET version = version + 1, amount_base = CASE WHEN currency = ? THEN amount ELSE ROUND(amount * (
+                SELECT rate FROM fx_rates f WHERE f.currency = payments.currency
+                  AND f.date <= substr(COALESCE(payments.approved_at, payments.created_at), 1, 10)
+                ORDER BY f.date DESC LIMIT 1), 2) END
+            WHERE amount_base IS NULL AND status = 'APPROVED' AND (currency = ? OR EXISTS (
+                SELECT 1 FROM fx_rates f WHERE f.currency = payments.currency
+                  AND f.date <= substr(COALESCE(payments.approved_at, payments.created_at), 1, 10)))
+            """,
+            (BASE_CURRENCY, BASE_CURRENCY),
+        )
+        con.commit()
+    if cur.rowcount:
+        payment_cache.clear()
+    return cur.rowcount
+
+
+def _approved_range(since, until, alias: str = "") -> tuple[str, list]:
+    """SQL condition (uses idx_payments_approved_ts) for approval time in [since, until];
+    bounds as accepted by _epoch, a bare `until` date is inclusive."""
+    sql, args = f" AND {alias}approved_ts IS NOT NULL", []
+    lo, hi = _epoch(since), _epoch(until, end=True)
+    if lo is not None:
+        sql += f" AND {alias}approved_ts >= ?"
+        args.append(lo)
+    if hi is not None:
+        sql += f" AND {alias}approved_ts < ?"
+        args.append(hi)
+    return sql, args
+
+
+def sum_approved_base(since=None, until=None, con=None) -> dict:
+    """Total of approved payments in BASE_CURRENCY approved in [since, until] (dates).
+    `con`: connection to read from (e.g. the one from reader()), default a new one."""
+    cond, args = _approved_range(since, until)
+    sql = "SELECT COUNT(*), COALESCE(SUM(amount_base), 0), COUNT(*) - COUNT(amount_base) FROM payments WHERE status='APPROVED'" + cond
+    with (nullcontext(con) if con is not None else _conn()) as con:
+        count, total, unconverted = con.execute(sql, args).fetchone()
+    return {"count": count, "total": round(total, 2), "currency": BASE_CURRENCY, "unconverted": unconverted}
+
 # --- PAYMENTS ---
 
 def _now() -> str:
     return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
 
+def _stamp() -> tuple[str, int]:
+    """(local TEXT timestamp, UTC epoch seconds) of the same instant."""
+    now = datetime.now().replace(microsecond=0)
+    return now.strftime("%Y-%m-%d %H:%M:%S"), int(now.timestamp())
+
+
+def _epoch(value, end: bool = False):
+    """UTC epoch seconds for an epoch, date, datetime or 'YYYY-MM-DD[ HH:MM[:SS]]' (local time).
+    With end=True a bare date means the end of that day (exclusive bound)."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    if isinstance(value, date):
+        day_only, value = True, datetime.combine(value, datetime.min.time())
+    else:
+        text = str(value).strip()
+        day_only, value = len(text) == 10, datetime.fromisoformat(text)
+    if end and day_only:
+        value += timedelta(days=1)
+    return int(value.timestamp())
+
+
+def _payments_cursor(con):
+    """Cursor yielding models.Payment records (same connection and transaction)."""
+    cur = con.cursor()
+    cur.row_factory = payment_row
+    return cur
+
+
+def _fetch_payment(cur, payment_id: int):
+    """models.Payment or None, read in the transaction of `cur`."""
+    pcur = _payments_cursor(cur.connection)
+    pcur.execute("SELECT * FROM payments WHERE id=?", (payment_id,))
+    return pcur.fetchone()
+
+
+def _row_version(cur, payment_id: int) -> int:
+    """Row version after an UPDATE in the current transaction (for payment_cache.invalidate)."""
+    cur.execute("SELECT version FROM payments WHERE id=?", (payment_id,))
+    return int(cur.fetchone()[0])
+
+
 def create_payment(initiator_id: int, amount: float, currency: str, method: str, description: str, category: str) -> int:
+    now, now_ts = _stamp()
     with _conn() as con:
         cur = con.cursor()
         cur.execute(
             """
-            INSERT INTO payments (created_at, initiator_id, amount, currency, method, description, status, category)
-            VALUES (?, ?, ?, ?, ?, ?, 'PENDING', ?)
+            INSERT INTO payments (created_at, created_ts, initiator_id, amount, currency, method, description, status, category)
+            VALUES (?, ?, ?, ?, ?, ?, ?, 'PENDING', ?)
             """,
-            (_now(), initiator_id, amount, currency, method, description, category),
+            (now, now_ts, initiator_id, amount, currency, method, description, category),
         )
         pid = cur.lastrowid
         cur.execute(
@@ -298,67 +866,366 @@ def create_payment(initiator_id: int, amount: float, currency: str, method: str,
             INSERT INTO audit_log (payment_id, actor_id, action, ts, payload)
             VALUES (?, ?, 'CREATE', ?, ?)
             """,
-            (pid, initiator_id, _now(), f"{amount} {currency} {method} | {category}"),
+            (pid, initiator_id, now, _payload(amount=amount, currency=currency, method=method, category=category)),
         )
+        row = _fetch_payment(cur, pid)
         con.commit()
-        return int(pid)
+    payment_cache.put(row)
+    return int(pid)
+
+
+def _claim(cur, staged_id: int, action: str, actor_id: int, ts: str | None = None) -> bool:
+    """Record the claim for a staged id; False if any worker has already claimed it."""
+    cur.execute(
+        "INSERT OR IGNORE INTO staged_claims (staged_id, action, actor_id, ts) VALUES (?, ?, ?, ?)",
+        (int(staged_id), action, actor_id, ts or _now()),
+    )
+    return cur.rowcount == 1
 
 
-def create_approved_payment(initiator_id: int, approver_id: int, amount: float, currency: str, method: str, description: str, category: str) -> int:
+def claim_staged(staged_id: int, action: str, actor_id: int) -> bool:
+    """Atomically claim a staged request (e.g. for REJECT). Only the first caller gets True."""
+    with _conn() as con:
+        cur = con.cursor()
+        ok = _claim(cur, staged_id, action, actor_id)
+        if ok and action == "REJECT":
+            cur.execute("DELETE FROM fingerprints WHERE staged_id=?", (int(staged_id),))
+        con.commit()
+        return ok
+
+
+def get_staged_claim(staged_id: int):
+    with _conn() as con:
+        cur = con.cursor()
+        cur.execute("SELECT * FROM staged_claims WHERE staged_id=?", (int(staged_id),))
+        row = cur.fetchone()
+        return dict(row) if row else None
+
+
+def _receipt_row(pid: int, st: dict, now: str):
+    """receipts row from staged-style keys, or None when no receipt was attached."""
+    if not st.get("receipt_file"):
+        return None
+    return (pid, st["receipt_file"], st.get("receipt_unique_id"), st.get("receipt_kind"), st.get("receipt_name"), now)
+
+
+# --- DUPLICATES ---
+
+DUPLICATE_WINDOW_DAYS = int(os.getenv("DUPLICATE_WINDOW_DAYS", "30"))
+
+# the staged request's row (if any) gets the payment id; otherwise a new row
+_UPSERT_FINGERPRINT = """
+    INSERT INTO fingerprints (fp, staged_id, payment_id, initiator_id, created_ts) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(staged_id) DO UPDATE SET payment_id=excluded.payment_id
+"""
+
+
+def _normalize_text(text: str) -> str:
+    """Casefolded words only: 'Rent,  MARCH!' and 'rent march' are the same."""
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    return " ".join("".join(ch if ch.isalnum() else " " for ch in text).split())
+
+
+def payment_fingerprint(amount, currency: str, method: str, category: str, description: str) -> str:
+    """Hash of amount (2 decimals), currency, method, category and normalized description."""
+    key = "|".join([f"{float(amount):.2f}", str(currency or "").upper(), str(method or ""),
+                    str(category or ""), _normalize_text(description)])
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:20]
+
+
+def register_fingerprint(fp: str, staged_id: int, initiator_id: int, window_days: int = DUPLICATE_WINDOW_DAYS) -> list:
+    """Record a new staged request and return earlier requests / payments with the same
+    fingerprint within `window_days` (newest first): one search on idx_fingerprints_fp."""
+    now_ts = int(datetime.now().timestamp())
     with _conn() as con:
         cur = con.cursor()
         cur.execute(
             """
-            INSERT INTO payments (created_at, initiator_id, amount, currency, method, description, status, approved_by, approved_at, category)
-            VALUES (?, ?, ?, ?, ?, ?, 'APPROVED', ?, ?, ?)
+            SELECT staged_id, payment_id, initiator_id, created_ts FROM fingerprints
+            WHERE fp=? AND created_ts >= ? ORDER BY created_ts DESC LIMIT 5
             """,
-            (_now(), initiator_id, amount, currency, method, description, approver_id, _now(), category),
+            (fp, now_ts - window_days * 86400),
         )
-        pid = cur.lastrowid
+        found = [dict(r) for r in cur.fetchall()]
+        cur.execute(_UPSERT_FINGERPRINT, (fp, int(staged_id), None, initiator_id, now_ts))
+        con.commit()
+    return found
+
+
+_INSERT_RECEIPT = "INSERT INTO receipts (payment_id, file_id, file_unique_id, kind, file_name, created_at) VALUES (?, ?, ?, ?, ?, ?)"
+
+
+def create_approved_payment(initiator_id: int, approver_id: int, amount: float, currency: str, method: str, description: str, category: str,
+                            staged_id: int | None = None, receipt_file: str | None = None, receipt_kind: str | None = None,
+                            receipt_unique_id: str | None = None, receipt_name: str | None = None,
+                            group_chat_id: int | None = None, group_msg_id: int | None = None) -> int | None:
+    """Insert an already approved payment (and its receipt, if any).
+
+    With `staged_id` the insert is idempotent: the claim and the payment are written in
+    one transaction, and a repeated call for the same staged id returns None. The group
+    message location (and its POSTED audit row) goes into the same transaction, and all
+    rows share one timestamp."""
+    with _conn() as con:
+        cur = con.cursor()
+        now, now_ts = _stamp()
+        if staged_id is not None and not _claim(cur, staged_id, "APPROVE", approver_id, now):
+            con.rollback()
+            return None
+        amount_base = _to_base(_fx_lookup(cur), amount, currency, now)
         cur.execute(
             """
-            INSERT INTO audit_log (payment_id, actor_id, action, ts, payload)
-            VALUES (?, ?, 'CREATE_APPROVED', ?, ?)
+            INSERT INTO payments (created_at, created_ts, initiator_id, amount, currency, method, description, status, approved_by,
+                                  approved_at, approved_ts, group_chat_id, group_msg_id, category, amount_base)
+            VALUES (?, ?, ?, ?, ?, ?, ?, 'APPROVED', ?, ?, ?, ?, ?, ?, ?)
             """,
-            (pid, initiator_id, _now(), f"{amount} {currency} {method} | {category}"),
+            (now, now_ts, initiator_id, amount, currency, method, description, approver_id, now, now_ts,
+             group_chat_id, group_msg_id, category, amount_base),
         )
-        cur.execute(
+        pid = cur.lastrowid
+        audit = [
+            (pid, initiator_id, "CREATE_APPROVED", now, _payload(amount=amount, currency=currency, method=method, category=category)),
+            (pid, approver_id, "APPROVE", now, None),
+        ]
+        if group_chat_id and group_msg_id:
+            audit.append((pid, 0, "POSTED", now, _payload(chat_id=group_chat_id, msg_id=group_msg_id)))
+        cur.executemany("INSERT INTO audit_log (payment_id, actor_id, action, ts, payload) VALUES (?, ?, ?, ?, ?)", audit)
+        receipt = _receipt_row(pid, {
+            "receipt_file": receipt_file, "receipt_kind": receipt_kind,
+            "receipt_unique_id": receipt_unique_id, "receipt_name": receipt_name,
+        }, now)
+        if receipt:
+            cur.execute(_INSERT_RECEIPT, receipt)
+        if staged_id is not None:
+            cur.execute("UPDATE staged_claims SET payment_id=? WHERE staged_id=?", (pid, int(staged_id)))
+        cur.execute(_UPSERT_FINGERPRINT, (
+            payment_fingerprint(amount, currency, method, category, description),
+            None if staged_id is None else int(staged_id), pid, initiator_id, now_ts,
+        ))
+        row = _fetch_payment(cur, pid)
+        con.commit()
+    payment_cache.put(row)  # the handler renders the card right away
+    return int(pid)
+
+
+def _next_payment_id(cur) -> int:
+    """Next AUTOINCREMENT id; call only inside a write (BEGIN IMMEDIATE) transaction."""
+    cur.execute(
+        """
+        SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name='payments'), 0),
+                   COALESCE((SELECT MAX(id) FROM payments), 0)) + 1
+        """
+    )
+    return int(cur.fetchone()[0])
+
+
+def create_approved_payments_bulk(items, approver_id: int | None = None) -> dict:
+    """Approve many staged requests in one transaction.
+
+    `items` is an iterable of (staged_id, staged dict) as kept in memory_store; the staged
+    dict may carry group_chat_id/group_msg_id of its preview message and its own
+    approver_id (used by the group committer). Payments, audit rows and claims are written
+    with executemany. Staged ids already claimed (by another tap or worker) are skipped.
+    Returns {staged_id: payment_id} for the inserted ones."""
+    items = [(int(sid), st) for sid, st in items]
+    if not items:
+        return {}
+    now, now_ts = _stamp()
+    with _conn() as con:
+        cur = con.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        ids = [sid for sid, _ in items]
+        taken = set()
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            cur.execute(f"SELECT staged_id FROM staged_claims WHERE staged_id IN ({','.join('?' * len(chunk))})", chunk)
+            taken.update(r[0] for r in cur.fetchall())
+        pid = _next_payment_id(cur)
+        fx = _fx_lookup(cur)
+        result = {}
+        payments, audit, claims, receipts, fingerprints = [], [], [], [], []
+        for sid, st in items:
+            if sid in taken or sid in result:
+                continue
+            chat_id, msg_id = st.get("group_chat_id"), st.get("group_msg_id")
+            approver = st.get("approver_id", approver_id)
+            payments.append((
+                pid, now, now_ts, st["initiator_id"], st["amount"], st["currency"], st["method"],
+                st["description"], approver, now, now_ts, chat_id, msg_id, st["category"],
+                _to_base(fx, st["amount"], st["currency"], now),
+            ))
+            audit.append((pid, st["initiator_id"], "CREATE_APPROVED", now, _payload(
+                amount=st["amount"], currency=st["currency"], method=st["method"], category=st["category"])))
+            audit.append((pid, approver, "APPROVE", now, None))
+            if chat_id and msg_id:
+                audit.append((pid, 0, "POSTED", now, _payload(chat_id=chat_id, msg_id=msg_id)))
+            claims.append((sid, "APPROVE", approver, pid, now))
+            fingerprints.append((
+                payment_fingerprint(st["amount"], st["currency"], st["method"], st["category"], st["description"]),
+                sid, pid, st["initiator_id"], now_ts,
+            ))
+            receipt = _receipt_row(pid, st, now)
+            if receipt:
+                receipts.append(receipt)
+            result[sid] = pid
+            pid += 1
+        cur.executemany(
             """
-            INSERT INTO audit_log (payment_id, actor_id, action, ts, payload)
-            VALUES (?, ?, 'APPROVE', ?, NULL)
+            INSERT INTO payments (id, created_at, created_ts, initiator_id, amount, currency, method, description, status,
+                                  approved_by, approved_at, approved_ts, group_chat_id, group_msg_id, category, amount_base)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'APPROVED', ?, ?, ?, ?, ?, ?, ?)
             """,
-            (pid, approver_id, _now()),
+            payments,
+        )
+        cur.executemany(
+            "INSERT INTO audit_log (payment_id, actor_id, action, ts, payload) VALUES (?, ?, ?, ?, ?)",
+            audit,
+        )
+        cur.executemany(
+            "INSERT INTO staged_claims (staged_id, action, actor_id, payment_id, ts) VALUES (?, ?, ?, ?, ?)",
+            claims,
+        )
+        cur.executemany(_INSERT_RECEIPT, receipts)
+        cur.executemany(_UPSERT_FINGERPRINT, fingerprints)
+        rows = []
+        if result:
+            pcur = _payments_cursor(con)
+            pcur.execute("SELECT * FROM payments WHERE id BETWEEN ? AND ?", (min(result.values()), max(result.values())))
+            rows = pcur.fetchall()
+        con.commit()
+    for row in rows:
+        payment_cache.put(row)
+    return result
+
+
+def claim_staged_bulk(staged_ids, action: str, actor_id: int) -> list:
+    """Claim many staged ids in one transaction; returns the ids this call claimed."""
+    now = _now()
+    claimed = []
+    with _conn() as con:
+        cur = con.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        for sid in staged_ids:
+            cur.execute(
+                "INSERT OR IGNORE INTO staged_claims (staged_id, action, actor_id, ts) VALUES (?, ?, ?, ?)",
+                (int(sid), action, actor_id, now),
+            )
+            if cur.rowcount == 1:
+                claimed.append(int(sid))
+        if action == "REJECT":
+            cur.executemany("DELETE FROM fingerprints WHERE staged_id=?", [(sid,) for sid in claimed])
+        con.commit()
+    return claimed
+
+
+def insert_imported_payments(rows, actor_id: int) -> list:
+    """Insert already validated historical payments in one transaction.
+
+    Each row is (created_at, initiator_id, amount, currency, method, description,
+    approved_by, approved_at, category). Every payment gets an IMPORT audit row by actor_id.
+    Returns the new payment ids in row order."""
+    rows = list(rows)
+    if not rows:
+        return []
+    now = _now()
+    with _conn() as con:
+        cur = con.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        first = _next_payment_id(cur)
+        ids = list(range(first, first + len(rows)))
+        fx = _fx_lookup(cur)
+        cur.executemany(
+            """
+            INSERT INTO payments (id, created_at, initiator_id, amount, currency, method, description, status,
+                                  approved_by, approved_at, category, amount_base, created_ts, approved_ts)
+            VALUES (?, ?, ?, ?, ?, ?, ?, 'APPROVED', ?, ?, ?, ?, ?, ?)
+            """,
+            [(pid,) + tuple(r) + (_to_base(fx, r[2], r[3], r[7]), _epoch(r[0]), _epoch(r[7])) for pid, r in zip(ids, rows)],
+        )
+        cur.executemany(
+            "INSERT INTO audit_log (payment_id, actor_id, action, ts, payload) VALUES (?, ?, 'IMPORT', ?, ?)",
+            [(pid, actor_id, now, _payload(amount=r[2], currency=r[3], method=r[4], category=r[8])) for pid, r in zip(ids, rows)],
         )
         con.commit()
-        return int(pid)
+    return ids
+
+
+def optimize_db() -> None:
+    """Refresh planner statistics after large writes."""
+    with _conn() as con:
+        con.execute("PRAGMA optimize")
 
 
 def set_group_message(payment_id: int, chat_id: int, message_id: int) -> None:
     with _conn() as con:
         cur = con.cursor()
-        cur.execute("UPDATE payments SET group_chat_id=?, group_msg_id=? WHERE id=?", (chat_id, message_id, payment_id))
+        cur.execute(
+            "UPDATE payments SET group_chat_id=?, group_msg_id=?, version=version+1 WHERE id=?",
+            (chat_id, message_id, payment_id),
+        )
         cur.execute(
             """
             INSERT INTO audit_log (payment_id, actor_id, action, ts, payload)
             VALUES (?, 0, 'POSTED', ?, ?)
             """,
-            (payment_id, _now(), f"chat_id={chat_id}, msg_id={message_id}"),
+            (payment_id, _now(), _payload(chat_id=chat_id, msg_id=message_id)),
         )
+        version = _row_version(cur, payment_id)
         con.commit()
+    payment_cache.invalidate(payment_id, version)
+
+
+def _cached_payments(ids: list) -> dict:
+    """id -> cached row, for the cached rows whose version still matches the DB. Other
+    workers write the same file without invalidating this process's cache; checking the
+    version is one primary-key lookup per 500 ids on the reader connection."""
+    cached = {}
+    for pid in ids:
+        row = payment_cache.get(pid)
+        if row is not None:
+            cached[pid] = row
+    if not cached:
+        return cached
+    current = {}
+    keys = list(cached)
+    with reader() as (con, _version):
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            for pid, version in con.execute(f"SELECT id, version FROM payments WHERE id IN ({','.join('?' * len(chunk))})", chunk):
+                current[pid] = version
+    return {pid: row for pid, row in cached.items() if current.get(pid) == row["version"]}
 
 
 def get_payment(payment_id: int):
+    """Full payment row; served from payment_cache while the cached version is current."""
+    row = _cached_payments([payment_id]).get(payment_id)
+    if row is not None:
+        return row
     with _conn() as con:
-        cur = con.cursor()
-        cur.execute("SELECT * FROM payments WHERE id=?", (payment_id,))
-        row = cur.fetchone()
-        return dict(row) if row else None
+        row = _fetch_payment(con.cursor(), payment_id)
+    payment_cache.put(row)
+    return row
+
+
+def get_payments(payment_ids) -> list:
+    ids = sorted({int(x) for x in payment_ids})
+    found = _cached_payments(ids)
+    missing = [pid for pid in ids if pid not in found]
+    if missing:
+        with _conn() as con:
+            cur = _payments_cursor(con)
+            for i in range(0, len(missing), 500):
+                chunk = missing[i:i + 500]
+                cur.execute(f"SELECT * FROM payments WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+                for p in cur.fetchall():
+                    found[p.id] = p
+                    payment_cache.put(p)
+    return [found[pid] for pid in ids if pid in found]
 
 
 def approve_payment(payment_id: int, approver_id: int):
     with _conn() as con:
         cur = con.cursor()
-        cur.execute("SELECT status, approved_by FROM payments WHERE id=?", (payment_id,))
+        cur.execute("SELECT status, approved_by, amount, currency FROM payments WHERE id=?", (payment_id,))
         row = cur.fetchone()
         if not row:
             return False, "Payment not found"
@@ -367,16 +1234,26 @@ def approve_payment(payment_id: int, approver_id: int):
             return False, f"Wrong status: {status}"
         if approved_by is not None:
             return False, "Already approved"
-        cur.execute("UPDATE payments SET status='APPROVED', approved_by=?, approved_at=? WHERE id=?", (approver_id, _now(), payment_id))
+        approved_at, approved_ts = _stamp()
+        amount_base = _to_base(_fx_lookup(cur), row[2], row[3], approved_at)
+        cur.execute(
+            """
+            UPDATE payments SET status='APPROVED', approved_by=?, approved_at=?, approved_ts=?, amount_base=?, version=version+1
+            WHERE id=?
+            """,
+            (approver_id, approved_at, approved_ts, amount_base, payment_id),
+        )
         cur.execute(
             """
             INSERT INTO audit_log (payment_id, actor_id, action, ts, payload)
             VALUES (?, ?, 'APPROVE', ?, NULL)
             """,
-            (payment_id, approver_id, _now()),
+            (payment_id, approver_id, approved_at),
         )
+        version = _row_version(cur, payment_id)
         con.commit()
-        return True, "OK"
+    payment_cache.invalidate(payment_id, version)
+    return True, "OK"
 
 
 def reject_payment(payment_id: int, approver_id: int):
@@ -389,22 +1266,133 @@ def reject_payment(payment_id: int, approver_id: int):
         status = row[0]
         if status in ("APPROVED", "REJECTED"):
             return False, f"Already finalized: {status}"
-        cur.execute("UPDATE payments SET status='REJECTED', rejected_by=?, rejected_at=? WHERE id=?", (approver_id, _now(), payment_id))
+        rejected_at, rejected_ts = _stamp()
+        cur.execute(
+            "UPDATE payments SET status='REJECTED', rejected_by=?, rejected_at=?, rejected_ts=?, version=version+1 WHERE id=?",
+            (approver_id, rejected_at, rejected_ts, payment_id),
+        )
         cur.execute(
             """
             INSERT INTO audit_log (payment_id, actor_id, action, ts, payload)
             VALUES (?, ?, 'REJECT', ?, NULL)
             """,
-            (payment_id, approver_id, _now()),
+            (payment_id, approver_id, rejected_at),
         )
+        version = _row_version(cur, payment_id)
         con.commit()
-        return True, "OK"
+    payment_cache.invalidate(payment_id, version)
+    return True, "OK"
+
+# --- AUDIT ---
+
+AUDIT_PAGE = 20
+
+
+def _audit_rows(cur) -> list:
+    rows = []
+    for r in cur.fetchall():
+        row = dict(r)
+        try:
+            row["payload"] = json.loads(row["payload"]) if row["payload"] else {}
+        except ValueError:
+            row["payload"] = {"text": row["payload"]}
+        rows.append(row)
+    return rows
+
+
+def get_payment_history(payment_id: int) -> list:
+    """Audit rows of one payment, oldest first (idx_audit_payment_ts); payload decoded to a dict."""
+    with _conn() as con:
+        cur = con.cursor()
+        cur.execute(
+            """
+            SELECT id, payment_id, actor_id, action, ts, payload FROM audit_log
+            WHERE payment_id=? ORDER BY ts ASC, id ASC
+            """,
+            (payment_id,),
+        )
+        return _audit_rows(cur)
+
+
+def list_actor_actions(actor_id: int, limit: int = AUDIT_PAGE) -> list:
+    """Latest audit rows by one user, newest first (idx_audit_actor_ts)."""
+    with _conn() as con:
+        cur = con.cursor()
+        cur.execute(
+            """
+            SELECT id, payment_id, actor_id, action, ts, payload FROM audit_log
+            WHERE actor_id=? ORDER BY ts DESC, id DESC LIMIT ?
+            """,
+            (actor_id, limit),
+        )
+        return _audit_rows(cur)
+
+# --- RECEIPTS ---
+
+MAX_RECEIPT_ATTEMPTS = 5
+
+
+def list_payment_receipts(payment_id: int) -> list:
+    with _conn() as con:
+        cur = con.cursor()
+        cur.execute("SELECT * FROM receipts WHERE payment_id=? ORDER BY id ASC", (payment_id,))
+        return [dict(r) for r in cur.fetchall()]
+
+
+def list_receipts_to_fetch(limit: int = 20) -> list:
+    """Receipts without a local copy yet (and not given up on)."""
+    with _conn() as con:
+        cur = con.cursor()
+        cur.execute(
+            "SELECT * FROM receipts WHERE sha256 IS NULL AND attempts < ? ORDER BY id ASC LIMIT ?",
+            (MAX_RECEIPT_ATTEMPTS, limit),
+        )
+        return [dict(r) for r in cur.fetchall()]
+
+
+def find_stored_receipt(file_unique_id: str | None):
+    """(sha256, size) of an already stored copy of the same Telegram file, if any."""
+    if not file_unique_id:
+        return None
+    with _conn() as con:
+        cur = con.cursor()
+        cur.execute(
+            "SELECT sha256, size FROM receipts WHERE file_unique_id=? AND sha256 IS NOT NULL LIMIT 1",
+            (file_unique_id,),
+        )
+        row = cur.fetchone()
+        return (row[0], row[1]) if row else None
+
+
+def mark_receipt_stored(receipt_id: int, sha256: str, size: int) -> None:
+    with _conn() as con:
+        con.execute("UPDATE receipts SET sha256=?, size=?, stored_at=? WHERE id=?", (sha256, size, _now(), receipt_id))
+        con.commit()
+
+
+def mark_receipt_failed(receipt_id: int) -> None:
+    with _conn() as con:
+        con.execute("UPDATE receipts SET attempts=attempts+1 WHERE id=?", (receipt_id,))
+        con.commit()
+
+
+def list_receipts_between(since=None, until=None) -> list:
+    """Receipts of approved payments approved in [since, until] (YYYY-MM-DD, inclusive)."""
+    cond, args = _approved_range(since, until, "p.")
+    sql = """
+        SELECT r.*, p.approved_at FROM receipts r JOIN payments p ON p.id = r.payment_id
+        WHERE p.status='APPROVED'
+    """ + cond + " ORDER BY r.payment_id ASC, r.id ASC"
+    with _conn() as con:
+        cur = con.cursor()
+        cur.execute(sql, args)
+        return [dict(r) for r in cur.fetchall()]
 
 # --- LISTING & EXPORT ---
 
 def list_pending(limit: int = 20):
     with _conn() as con:
-        cur = con.cursor()
+        cur = _payments_cursor(con)
         cur.execute(
             """
             SELECT id, created_at, initiator_id, amount, currency, method, description, status, category
@@ -412,12 +1400,12 @@ def list_pending(limit: int = 20):
             """,
             (limit,),
         )
-        return [dict(r) for r in cur.fetchall()]
+        return cur.fetchall()
 
 
 def list_user_payments(user_id: int, limit: int = 20):
     with _conn() as con:
-        cur = con.cursor()
+        cur = _payments_cursor(con)
         cur.execute(
             """
             SELECT id, created_at, initiator_id, amount, currency, method, description, status, category
@@ -425,42 +1413,176 @@ def list_user_payments(user_id: int, limit: int = 20):
             """,
             (user_id, limit),
         )
-        return [dict(r) for r in cur.fetchall()]
+        return cur.fetchall()
 
 
 def get_payment_compact(payment_id: int):
-    with _conn() as con:
-        cur = con.cursor()
-        cur.execute(
-            """
-            SELECT id, created_at, initiator_id, amount, currency, method, description, status,
-                   approved_by, approved_at, rejected_by, rejected_at, category
-            FROM payments WHERE id=?
-            """,
-            (payment_id,),
-        )
-        row = cur.fetchone()
-        return dict(row) if row else None
+    """Payment for /pay; the full cached row (a superset of the card fields)."""
+    return get_payment(payment_id)
 
 
-def export_payments_csv(path: str) -> str:
+LIST_PAGE = 100
+
+
+def _parse_cursor(cursor: str) -> tuple[int, int]:
+    ts, _, pid = str(cursor).partition(":")
+    try:
+        return int(ts), int(pid)
+    except ValueError:
+        raise ValueError(f"Bad cursor: {cursor!r}")
+
+
+def _make_cursor(approved_ts: int, payment_id: int) -> str:
+    return f"{approved_ts}:{payment_id}"
+
+
+def _page_query(columns: str, since, until, category, method, cursor, limit: int) -> tuple[str, list]:
+    """One keyset page of approved payments ordered by (approved_ts, id)."""
+    cond, args = _approved_range(since, until)
+    if category:
+        cond += " AND category=?"
+        args.append(category)
+    if method:
+        cond += " AND method=?"
+        args.append(method)
+    if cursor:
+        ts, pid = _parse_cursor(cursor)
+        # range on the approved_ts index, then skip ids already returned for the same second
+        cond += " AND approved_ts >= ? AND (approved_ts > ? OR id > ?)"
+        args += [ts, ts, pid]
+    sql = f"SELECT {columns} FROM payments WHERE status='APPROVED'{cond} ORDER BY approved_ts ASC, id ASC LIMIT ?"
+    return sql, args + [limit]
+
+
+def list_payments(since=None, until=None, category: str | None = None, method: str | None = None,
+                  cursor: str | None = None, limit: int = LIST_PAGE, con=None) -> tuple[list, str | None]:
+    """Approved payments by approval time (oldest first), one page at a time.
+
+    since/until: epoch seconds, date/datetime or 'YYYY-MM-DD[ HH:MM[:SS]]' in local time
+    (a bare `until` date is inclusive). Returns (rows, next_cursor); pass next_cursor back
+    for the following page, None means there is nothing more. `con` as in sum_approved_base."""
+    if limit < 1:
+        raise ValueError(f"Bad limit: {limit!r}")
+    sql, args = _page_query("*", since, until, category, method, cursor, limit)
+    with (nullcontext(con) if con is not None else _conn()) as con:
+        cur = _payments_cursor(con)
+        cur.execute(sql, args)
+        rows = cur.fetchall()
+    if len(rows) < limit:
+        return rows, None
+    return rows, _make_cursor(rows[-1].approved_ts, rows[-1].id)
+
+
+EXPORT_CHUNK = 5000
+EXPORT_FORMATS = ("csv", "jsonl", "jsonl.gz", "jsonl.zst", "parquet")
+
+
+def _has_module(name: str) -> bool:
+    import importlib.util
+    return importlib.util.find_spec(name) is not None
+
+
+def best_columnar_format() -> str:
+    """parquet if pyarrow is installed, else compressed JSONL (zstd if available)."""
+    if _has_module("pyarrow"):
+        return "parquet"
+    return "jsonl.zst" if _has_module("zstandard") else "jsonl.gz"
+
+
+def _iter_export_chunks(con, chunk: int = EXPORT_CHUNK, since=None, until=None):
+    """Yield (columns, declared types) first, then lists of plain tuples, `chunk` rows at a time
+    (keyset pages of list_payments order)."""
+    con.row_factory = None
+    cur = con.cursor()
+    cur.execute("PRAGMA table_info(payments)")
+    info = cur.fetchall()
+    cols = [c[1] for c in info]
+    yield cols, [(c[2] or "TEXT").upper() for c in info]
+    ts_at, id_at = cols.index("approved_ts"), cols.index("id")
+    cursor = None
+    while True:
+        cur.execute(*_page_query(", ".join(cols), since, until, None, None, cursor, chunk))
+        rows = cur.fetchall()
+        if rows:
+            yield rows
+        if len(rows) < chunk:
+            break
+        cursor = _make_cursor(rows[-1][ts_at], rows[-1][id_at])
+
+
+def _export_csv(chunks, path: str) -> None:
     import csv
-    with _conn() as con, open(path, "w", newline="", encoding="utf-8") as f:
-        cur = con.cursor()
-        cur.execute("PRAGMA table_info(payments)")
-        cols = [c[1] for c in cur.fetchall()]
+    cols, _ = next(chunks)
+    with open(path, "w", newline="", encoding="utf-8") as f:
         writer = csv.writer(f)
         writer.writerow(cols)
-        cur.execute("SELECT * FROM payments WHERE status='APPROVED' ORDER BY id ASC")
-        for r in cur.fetchall():
-            writer.writerow([r[c] for c in cols])
+        for rows in chunks:
+            writer.writerows(rows)
+
+
+def _open_text_sink(path: str, compression: str | None):
+    import io
+    if compression == "gz":
+        import gzip
+        return gzip.open(path, "wt", encoding="utf-8")
+    if compression == "zst":
+        import zstandard  # optional dependency
+        raw = open(path, "wb")
+        return io.TextIOWrapper(zstandard.ZstdCompressor(level=10).stream_writer(raw, closefd=True), encoding="utf-8")
+    return open(path, "w", encoding="utf-8")
+
+
+def _export_jsonl(chunks, path: str, compression: str | None) -> None:
+    import json
+    cols, _ = next(chunks)
+    dumps = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+    with _open_text_sink(path, compression) as f:
+        for rows in chunks:
+            f.write("".join(dumps(dict(zip(cols, r))) + "\n" for r in rows))
+
+
+def _export_parquet(chunks, path: str) -> None:
+    import pyarrow as pa  # optional dependency
+    import pyarrow.parquet as pq
+    cols, types = next(chunks)
+    mapping = {"INTEGER": pa.int64(), "REAL": pa.float64()}
+    schema = pa.schema([(c, mapping.get(t, pa.string())) for c, t in zip(cols, types)])
+    with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+        for rows in chunks:
+            columns = list(zip(*rows))
+            writer.write_batch(pa.record_batch([pa.array(col, type=f.type) for col, f in zip(columns, schema)], schema=schema))
+
+
+def export_payments(path: str, fmt: str = "csv", since=None, until=None) -> str:
+    """Export payments approved in [since, until] (default: all) to `path` in one of EXPORT_FORMATS.
+
+    Rows are streamed from SQLite in EXPORT_CHUNK batches. JSONL and Parquet keep the
+    column types (integers, reals, NULLs); Parquet needs pyarrow, jsonl.zst needs zstandard."""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    if fmt == "parquet" and not _has_module("pyarrow"):
+        raise ValueError("Parquet export requires pyarrow")
+    if fmt == "jsonl.zst" and not _has_module("zstandard"):
+        raise ValueError("zstd compression requires zstandard")
+    with _conn() as con:
+        chunks = _iter_export_chunks(con, since=since, until=until)
+        if fmt == "csv":
+            _export_csv(chunks, path)
+        elif fmt == "parquet":
+            _export_parquet(chunks, path)
+        else:
+            _export_jsonl(chunks, path, fmt.partition(".")[2] or None)
     return path
 
 
+def export_payments_csv(path: str) -> str:
+    return export_payments(path, "csv")
+
+
 def seed_approver_if_empty(approver_id: int, viewer_id: int) -> None:
     current_approver = get_config("approver_id", None, int)
     current_viewer = get_config("viewer_id", None, int)
     if current_approver is None:
-        set_config("approver_id", approver_id)
+        set_approver(approver_id)
     if current_viewer is None:
-        set_config("viewer_id", viewer_id)
+        set_viewer(viewer_id)
@@ -1,38 +1,41 @@
+import asyncio
+import logging
+from datetime import datetime
+
 from aiogram import Router, F
 from aiogram.filters import CommandStart, Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
-from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile
+from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile, BufferedInputFile
 
 from generators import (
-    get_group_id, set_group_id, get_roles, set_all_me, set_initiator,
-    list_methods, create_approved_payment, get_payment,
-    list_pending, list_user_payments, get_payment_compact, export_payments_csv,
-    set_approver, set_viewer,
-    get_config, set_group_message
+    get_group_id, set_group_id, set_all_me, set_initiator,
+    list_methods, get_payment,
+    list_pending, list_user_payments, list_payments, get_payment_compact, export_payments_csv,
+    export_payments, best_columnar_format, EXPORT_FORMATS,
+    set_approver, set_viewer, has_role, role_members, add_role, remove_role, ROLES,
+    set_group_message, CATEGORIES, get_category_label_by_code,
+    BASE_CURRENCY, CURRENCIES, set_fx_rates, list_fx_latest, sum_approved_base, claim_staged,
+    create_approved_payments_bulk, claim_staged_bulk, get_payments,
+    get_payment_history, list_actor_actions, AUDIT_PAGE,
+    payment_fingerprint, register_fingerprint
 )
-from sheet_logger import log_approval_to_sheet
-from memory_store import put_staged, pop_staged, get_staged
+from sheet_logger import log_approval_to_sheet, log_approvals_to_sheet
+from models import Payment
+from memory_store import put_staged, pop_staged, next_staged_id, update_staged, pop_staged_many
+import tg_sender
+import receipt_store
+import payment_cache
+import profiler
+from committer import committer
+from logging_setup import payment_id_var
 
 router = Router()
 
-CURRENCY = "THB"  # фиксированная валюта
+CURRENCY = BASE_CURRENCY  # базовая валюта; валюта оплаты выбирается в /newpay
 
 # ========= Категории расходов =========
-CATEGORIES = [
-    ("📮 Rent & Utilities", "rent"),
-    ("🥳 Salaries & Employee Payments", "salaries"),
-    ("🛵 Transport & Logistics", "transport"),
-    ("⚡️ Marketing & Advertising", "marketing"),
-    ("👨🏽‍💻 IT & Services", "it"),
-    ("🧐 Operating Expenses (Other)", "operating"),
-]
-
-def get_category_label_by_code(code: str) -> str:
-    for label, c in CATEGORIES:
-        if c == code:
-            return label
-    return "🧐 Operating Expenses (Other)"
+# CATEGORIES живут в generators (нужны и импорту без aiogram)
 
 # ========= Клавиатуры =========
 def kb_nav(back: bool = True) -> InlineKeyboardMarkup:
@@ -48,6 +51,11 @@ def category_kb() -> InlineKeyboardMarkup:
                  InlineKeyboardButton(text="🙅🏽‍♂️ Cancel", callback_data="nav:cancel")])
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
+def currency_kb() -> InlineKeyboardMarkup:
+    rows = [[InlineKeyboardButton(text=c, callback_data=f"cur:{c}") for c in CURRENCIES]]
+    rows.append([InlineKeyboardButton(text="🙅🏽‍♂️ Cancel", callback_data="nav:cancel")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
 def methods_kb(include_nav: bool = True) -> InlineKeyboardMarkup:
     rows = []
     allowed = {"Bank", "USDT", "Cash"}
@@ -75,25 +83,31 @@ def fmt_amount(val: float) -> str:
     s = f"{val:,.2f}".replace(",", "§").replace(".", ",").replace("§", ".")
     return s
 
-def render_card(p: dict) -> str:
-    category_text = p.get("category") or "🧐 Operating Expenses (Other)"
+def _base_suffix(p: Payment) -> str:
+    """' (≈ 3.600 THB)' for payments in a foreign currency with a known base amount."""
+    if (p.currency or CURRENCY) == BASE_CURRENCY or p.amount_base is None:
+        return ""
+    return f" (≈ {fmt_amount(p.amount_base)} {BASE_CURRENCY})"
+
+def render_card(p: Payment) -> str:
+    category_text = p.category or "🧐 Operating Expenses (Other)"
     lines = [
-        f"#PAY-{p['id']}",
-        f"• {fmt_amount(p['amount'])} {p.get('currency', CURRENCY)}",
-        f"• {p['method']}",
+        f"#PAY-{p.id}",
+        f"• {fmt_amount(p.amount)} {p.currency or CURRENCY}{_base_suffix(p)}",
+        f"• {p.method}",
         f"• {category_text}",
         "",
-        f"• Description: {p['description']}",
+        f"• Description: {p.description}",
         "",
-        f"Status: {p['status']}",
-        f"Initiator: {p['initiator_id']}",
+        f"Status: {p.status}",
+        f"Initiator: {p.initiator_id}",
         "",
-        f"Created: {p['created_at']}",
+        f"Created: {p.created_at}",
     ]
-    if p.get("approved_by"):
-        lines.append(f"✅ Approved by: {p['approved_by']} at {p.get('approved_at','')}")
-    if p.get("rejected_by"):
-        lines.append(f"Rejected by: {p['rejected_by']} at {p.get('rejected_at','')}")
+    if p.approved_by:
+        lines.append(f"✅ Approved by: {p.approved_by} at {p.approved_at or ''}")
+    if p.rejected_by:
+        lines.append(f"Rejected by: {p.rejected_by} at {p.rejected_at or ''}")
     return "\n".join(lines)
 
 # --- helper for unified edit (caption or text) ---
@@ -105,37 +119,53 @@ async def _safe_edit_final(call_message, new_text: str):
         await call_message.edit_caption(caption=new_text, reply_markup=None)
         return True
     except Exception as e:
-        print(f"[edit_caption (message) fail] {e}")
+        logging.debug(f"edit_caption (message) failed: {e}")
     # Try bot-level edit caption
     try:
         await call_message.bot.edit_message_caption(chat_id=call_message.chat.id, message_id=call_message.message_id, caption=new_text, reply_markup=None)
         return True
     except Exception as e:
-        print(f"[edit_caption (bot) fail] {e}")
+        logging.debug(f"edit_caption (bot) failed: {e}")
     # Try text edits
     try:
         await call_message.edit_text(text=new_text, reply_markup=None)
         return True
     except Exception as e:
-        print(f"[edit_text (message) fail] {e}")
+        logging.debug(f"edit_text (message) failed: {e}")
     try:
         await call_message.bot.edit_message_text(chat_id=call_message.chat.id, message_id=call_message.message_id, text=new_text, reply_markup=None)
         return True
     except Exception as e:
-        print(f"[edit_text (bot) fail] {e}")
+        logging.warning(f"Cannot edit message {call_message.chat.id}/{call_message.message_id}: {e}")
         return False
 
-def render_line(row) -> str:
+def render_staged_rejected(temp_id: int, staged: dict, rejected_by: int) -> str:
+    return (
+        f"#PAY-STAGED-{temp_id}\n• {fmt_amount(staged['amount'])} {staged['currency']}\n"
+        f"• {staged['method']}\n• {staged['category']}\n\n"
+        f"• Description: {staged['description']}\n\nStatus: REJECTED (not saved)\nInitiator: {staged['initiator_id']}\nRejected by: {rejected_by}"
+    )
+
+def render_duplicates(found: list) -> str:
+    """'⚠️ Possible duplicate of #PAY-12 (2025-01-31), #PAY-STAGED-… (…)' for the group preview."""
+    refs = []
+    for f in found:
+        ref = f"#PAY-{f['payment_id']}" if f.get("payment_id") else f"#PAY-STAGED-{f['staged_id']}"
+        refs.append(f"{ref} ({datetime.fromtimestamp(f['created_ts']):%Y-%m-%d})")
+    return "⚠️ Possible duplicate of " + ", ".join(refs)
+
+def render_line(p: Payment) -> str:
     """Короткая строка для списков."""
-    cat = row.get("category") or "🧐 Operating Expenses (Other)"
-    return f"#PAY-{row['id']} — {fmt_amount(row['amount'])} {row['currency']} — {row['method']} — {cat} — {row['status']} — {row['created_at']}"
+    cat = p.category or "🧐 Operating Expenses (Other)"
+    return f"#PAY-{p.id} — {fmt_amount(p.amount)} {p.currency} — {p.method} — {cat} — {p.status} — {p.created_at}"
 
 # ========= Базовые команды =========
 @router.message(CommandStart())
 async def cmd_start(message: Message) -> None:
     await message.answer(
         "✅ Bot online.\n"
-        "Commands: /ping, /newpay, /methods, /pending, /my, /pay <id>, /export_csv, /whoami, /roles, /set_all_me, /set_initiator <id>, /set_approver <id>, /set_viewer <id>, /setup_here (in group), /ver"
+        "Commands: /ping, /newpay, /methods, /pending, /my, /pay <id>, /history <id>, /actor <user id>, /approved [from] [to], /export_csv, /export [format] [from] [to], /export_receipts [from] [to], /totals [from] [to], /fx, /fx_set <CUR> <rate>, /whoami, /roles, /set_all_me, /set_initiator <id>, /set_approver <id>, /set_viewer <id>, /grant <role> <id>, /revoke <role> <id>, /import, /profile <seconds>, /setup_here (in group), /ver\n"
+        "Bulk: /approve_all [initiator_id], /approve_selected <ids>, /reject_all [initiator_id], /reject_selected <ids>"
     )
 
 @router.message(Command("ver"))
@@ -152,47 +182,39 @@ async def cmd_whoami(message: Message) -> None:
 
 @router.message(Command("roles"))
 async def cmd_roles(message: Message) -> None:
-    roles = get_roles()
     gid = get_group_id()
-    await message.answer(
-        "Roles:\n"
-        f"- initiator_id: {roles['initiator_id']}\n"
-        f"- approver_id: {roles['approver_id']}\n"
-        f"- viewer_id: {roles['viewer_id']}\n"
-        f"- group_id: {gid}"
-    )
+    lines = ["Roles:"]
+    for role in ROLES:
+        ids = ", ".join(str(i) for i in sorted(role_members(role))) or "—"
+        lines.append(f"- {role}: {ids}")
+    lines.append(f"- group_id: {gid}")
+    await message.answer("\n".join(lines))
 
 @router.message(Command("set_all_me"))
 async def cmd_set_all_me_cmd(message: Message) -> None:
     set_all_me(message.from_user.id)
     await message.answer("✅ Saved to DB: you are initiator + approver + viewer. Use /roles to check.")
 
+def _parse_id_arg(text: str):
+    parts = (text or "").split()
+    if len(parts) != 2 or not parts[1].isdigit():
+        return None
+    return int(parts[1])
+
 @router.message(Command("set_initiator"))
 async def cmd_set_initiator_cmd(message: Message) -> None:
     """
     Использование: /set_initiator <id>
-    Менять может только текущий initiator (или secondary_initiator).
-    Если initiатор ещё не задан — первый вызов команды создаст его.
+    Менять может только текущий инициатор.
+    Если инициатор ещё не задан — первый вызов команды создаст его.
     """
-    roles = get_roles()
-    current_init = roles["initiator_id"]
-
-    parts = (message.text or "").split()
-    if len(parts) != 2 or not parts[1].isdigit():
+    new_init = _parse_id_arg(message.text)
+    if new_init is None:
         await message.answer("Usage: /set_initiator <id>")
         return
-
-    new_init = int(parts[1])
-
-    # Если инициатор уже задан — менять может только он или второй инициатор
-    sec = get_config("secondary_initiator_id", None, int)
-    allowed = {current_init, sec}
-    if None in allowed:
-        allowed.discard(None)
-    if current_init is not None and message.from_user.id not in allowed:
+    if role_members("initiator") and not has_role(message.from_user.id, "initiator"):
         await message.answer("Only current initiators can change initiator ID.")
         return
-
     set_initiator(new_init)
     await message.answer(f"✅ Initiator set to {new_init}")
 
@@ -200,23 +222,15 @@ async def cmd_set_initiator_cmd(message: Message) -> None:
 async def cmd_set_approver_cmd(message: Message) -> None:
     """
     Использование: /set_approver <id>
-    Менять может текущий initiator или secondary_initiator.
+    Менять может любой инициатор.
     """
-    roles = get_roles()
-    sec = get_config("secondary_initiator_id", None, int)
-    allowed = {roles.get("initiator_id"), sec}
-    if None in allowed:
-        allowed.discard(None)
-    if not allowed or message.from_user.id not in allowed:
+    if not has_role(message.from_user.id, "initiator"):
         await message.answer("Only initiators can change approver. Ask admin to change roles.")
         return
-
-    parts = (message.text or "").split()
-    if len(parts) != 2 or not parts[1].isdigit():
+    approver_id = _parse_id_arg(message.text)
+    if approver_id is None:
         await message.answer("Usage: /set_approver <approver_id>")
         return
-
-    approver_id = int(parts[1])
     set_approver(approver_id)
     await message.answer(f"✅ Approver set to {approver_id}")
 
@@ -224,26 +238,45 @@ async def cmd_set_approver_cmd(message: Message) -> None:
 async def cmd_set_viewer_cmd(message: Message) -> None:
     """
     Использование: /set_viewer <id>
-    Менять может текущий initiator или secondary_initiator.
+    Менять может любой инициатор.
     """
-    roles = get_roles()
-    sec = get_config("secondary_initiator_id", None, int)
-    allowed = {roles.get("initiator_id"), sec}
-    if None in allowed:
-        allowed.discard(None)
-    if not allowed or message.from_user.id not in allowed:
+    if not has_role(message.from_user.id, "initiator"):
         await message.answer("Only initiators can change viewer. Ask admin to change roles.")
         return
-
-    parts = (message.text or "").split()
-    if len(parts) != 2 or not parts[1].isdigit():
+    viewer_id = _parse_id_arg(message.text)
+    if viewer_id is None:
         await message.answer("Usage: /set_viewer <viewer_id>")
         return
-
-    viewer_id = int(parts[1])
     set_viewer(viewer_id)
     await message.answer(f"✅ Viewer set to {viewer_id}")
 
+@router.message(Command("grant", "revoke"))
+async def cmd_grant_revoke(message: Message) -> None:
+    """
+    Использование: /grant <role> <id>, /revoke <role> <id>
+    Добавляет или снимает роль (initiator, approver, viewer). Только для инициаторов.
+    """
+    if not has_role(message.from_user.id, "initiator"):
+        await message.answer("Only initiators can change roles.")
+        return
+    parts = (message.text or "").split()
+    cmd = parts[0].lstrip("/").split("@")[0]
+    if len(parts) != 3 or parts[1] not in ROLES or not parts[2].isdigit():
+        await message.answer(f"Usage: /{cmd} <{'|'.join(ROLES)}> <id>")
+        return
+    role, uid = parts[1], int(parts[2])
+    if cmd == "grant":
+        add_role(uid, role)
+        await message.answer(f"✅ {uid} is now {role}")
+        return
+    if role == "initiator" and role_members("initiator") == {uid}:
+        await message.answer("Cannot remove the last initiator.")
+        return
+    if remove_role(uid, role):
+        await message.answer(f"✅ {uid} is no longer {role}")
+    else:
+        await message.answer(f"{uid} does not have role {role}")
+
 async def _bind_group(message: Message) -> None:
     if message.chat.type not in ("group", "supergroup"):
         await message.answer("Run this command inside the target group.")
@@ -287,6 +320,41 @@ async def cmd_my(message: Message) -> None:
     text = "Your recent payments (last 20):\n" + "\n".join(render_line(r) for r in rows)
     await message.answer(text)
 
+APPROVED_PAGE = 20
+
+def _approved_page(since, until, cursor=None):
+    rows, next_cursor = list_payments(since, until, cursor=cursor, limit=APPROVED_PAGE)
+    if not rows:
+        return "No approved payments for this period.", None
+    text = f"Approved {since or '…'} — {until or '…'}:\n" + "\n".join(render_line(r) for r in rows)
+    kb = None
+    if next_cursor:
+        kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(
+            text="Next ▶", callback_data=f"appr:{since or ''}:{until or ''}:{next_cursor}")]])
+    return text, kb
+
+@router.message(Command("approved"))
+async def cmd_approved(message: Message) -> None:
+    """Использование: /approved [YYYY-MM-DD] [YYYY-MM-DD] — согласованные оплаты по дате согласования, постранично."""
+    try:
+        since, until = _parse_period((message.text or "").split()[1:])
+    except ValueError:
+        await message.answer("Usage: /approved [YYYY-MM-DD] [YYYY-MM-DD]")
+        return
+    text, kb = await asyncio.to_thread(_approved_page, since, until)
+    await message.answer(text, reply_markup=kb)
+
+@router.callback_query(F.data.startswith("appr:"))
+async def cb_approved_next(call: CallbackQuery) -> None:
+    _, since, until, cursor = call.data.split(":", 3)
+    try:
+        text, kb = await asyncio.to_thread(_approved_page, since or None, until or None, cursor)
+    except ValueError:
+        await call.answer("Bad page", show_alert=True)
+        return
+    await call.message.answer(text, reply_markup=kb)
+    await call.answer()
+
 @router.message(Command("pay"))
 async def cmd_pay(message: Message) -> None:
     parts = message.text.split(maxsplit=1)
@@ -298,18 +366,253 @@ async def cmd_pay(message: Message) -> None:
     if not p:
         await message.answer("Payment not found.")
         return
-    await message.answer(render_card(p))
+    await message.answer(payment_cache.card(p, render_card))
+
+def render_audit_line(row) -> str:
+    """'2025-01-31 10:00:00 — APPROVE — 123 — #PAY-5 — amount=1000 …' for /history and /actor."""
+    details = ", ".join(f"{k}={v}" for k, v in row["payload"].items())
+    actor = "bot" if row["actor_id"] == 0 else row["actor_id"]
+    line = f"{row['ts']} — {row['action']} — {actor} — #PAY-{row['payment_id']}"
+    return f"{line} — {details}" if details else line
+
+def _int_arg(message: Message):
+    parts = (message.text or "").split()
+    if len(parts) < 2:
+        return None
+    arg = parts[1].strip().upper().replace("#PAY-", "")
+    return int(arg) if arg.lstrip("-").isdigit() else None
+
+@router.message(Command("history"))
+async def cmd_history(message: Message) -> None:
+    """Использование: /history <id> — кто и что делал с оплатой (журнал audit_log)."""
+    if not has_role(message.from_user.id, *ROLES):
+        await message.answer("Only initiators, approvers and viewers can read the audit log.")
+        return
+    pid = _int_arg(message)
+    if pid is None:
+        await message.answer("Usage: /history <pay id>  (example: /history 12)")
+        return
+    rows = await asyncio.to_thread(get_payment_history, pid)
+    if not rows:
+        await message.answer("No history for this payment.")
+        return
+    await message.answer(f"History of #PAY-{pid}:\n" + "\n".join(render_audit_line(r) for r in rows))
+
+@router.message(Command("actor"))
+async def cmd_actor(message: Message) -> None:
+    """Использование: /actor <user id> — последние действия пользователя по оплатам."""
+    if not has_role(message.from_user.id, *ROLES):
+        await message.answer("Only initiators, approvers and viewers can read the audit log.")
+        return
+    uid = _int_arg(message)
+    if uid is None:
+        await message.answer("Usage: /actor <user id>")
+        return
+    rows = await asyncio.to_thread(list_actor_actions, uid)
+    if not rows:
+        await message.answer("No actions by this user.")
+        return
+    await message.answer(f"Last {AUDIT_PAGE} actions of {uid}:\n" + "\n".join(render_audit_line(r) for r in rows))
 
 @router.message(Command("export_csv"))
 async def cmd_export_csv(message: Message) -> None:
     import os
-    path = os.path.join(os.path.dirname(__file__), "payments_export.csv")
-    export_payments_csv(path)
-    await message.answer_document(FSInputFile(path), caption="Payments CSV export")
+    import tempfile
+    fd, path = tempfile.mkstemp(prefix="payments_", suffix=".csv")
+    os.close(fd)
+    try:
+        await asyncio.to_thread(export_payments_csv, path)
+        await message.answer_document(FSInputFile(path, filename="payments_export.csv"), caption="Payments CSV export")
+    finally:
+        os.remove(path)
+
+@router.message(Command("export"))
+async def cmd_export(message: Message) -> None:
+    """
+    Использование: /export [csv|jsonl|jsonl.gz|jsonl.zst|parquet] [YYYY-MM-DD] [YYYY-MM-DD]
+    Без формата — Parquet (если установлен pyarrow), иначе сжатый JSONL. Даты — период согласования.
+    """
+    import os
+    import tempfile
+    args = (message.text or "").split()[1:]
+    fmt = args.pop(0).lower() if args and not args[0][:1].isdigit() else best_columnar_format()
+    try:
+        since, until = _parse_period(args)
+    except ValueError:
+        fmt = None
+    if fmt not in EXPORT_FORMATS:
+        await message.answer("Usage: /export [" + "|".join(EXPORT_FORMATS) + "] [YYYY-MM-DD] [YYYY-MM-DD]")
+        return
+    fd, path = tempfile.mkstemp(prefix="payments_", suffix="." + fmt)
+    os.close(fd)
+    try:
+        try:
+            await asyncio.to_thread(export_payments, path, fmt, since, until)
+        except ValueError as e:
+            await message.answer(f"❗ {e}")
+            return
+        await message.answer_document(FSInputFile(path, filename=f"payments_export.{fmt}"), caption=f"Payments export ({fmt})")
+    finally:
+        os.remove(path)
+
+# ========= Валюты =========
+@router.message(Command("fx"))
+async def cmd_fx(message: Message) -> None:
+    rows = list_fx_latest()
+    if not rows:
+        await message.answer(f"No FX rates. Base currency: {BASE_CURRENCY}. Use /fx_set <CUR> <rate> [YYYY-MM-DD].")
+        return
+    text = f"FX rates ({BASE_CURRENCY} per unit):\n" + "\n".join(f"- {r['currency']}: {r['rate']} ({r['date']})" for r in rows)
+    await message.answer(text)
+
+@router.message(Command("profile"))
+async def cmd_profile(message: Message) -> None:
+    """
+    Использование: /profile <seconds>
+    Профилирует бота указанное время (cProfile + сэмплирование стеков всех потоков) и присылает
+    топ функций по cumulative time и файл collapsed stacks для flamegraph. Только для инициаторов.
+    """
+    if not has_role(message.from_user.id, "initiator"):
+        await message.answer("Only initiators can profile the bot.")
+        return
+    parts = (message.text or "").split()
+    try:
+        seconds = float(parts[1]) if len(parts) > 1 else 10.0
+    except ValueError:
+        await message.answer(f"Usage: /profile <seconds>  (1..{profiler.MAX_SECONDS})")
+        return
+    await message.answer(f"Profiling for {min(seconds, profiler.MAX_SECONDS):g}s…")
+    # in the background: the chat's next updates must not queue behind the window
+    task = asyncio.create_task(_send_profile(message, seconds))
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+_background: set = set()
+
+async def _send_profile(message: Message, seconds: float) -> None:
+    try:
+        table, stacks = await profiler.profile(seconds)
+    except profiler.ProfileBusy as e:
+        await message.answer(f"⚠️ {e}")
+        return
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    await message.answer_document(
+        BufferedInputFile(table.encode("utf-8"), filename=f"profile-{stamp}.txt"),
+        caption=table.splitlines()[0],
+    )
+    await message.answer_document(
+        BufferedInputFile(stacks.encode("utf-8"), filename=f"profile-{stamp}.collapsed"),
+        caption="Collapsed stacks (flamegraph.pl / speedscope)",
+    )
+
+@router.message(Command("fx_set"))
+async def cmd_fx_set(message: Message) -> None:
+    """
+    Использование: /fx_set <CUR> <rate> [YYYY-MM-DD]
+    Курс: сколько единиц базовой валюты за 1 единицу CUR. Только для инициаторов.
+    Массовая загрузка: python importer.py fx rates.csv
+    """
+    from datetime import date
+    if not has_role(message.from_user.id, "initiator"):
+        await message.answer("Only initiators can set FX rates.")
+        return
+    parts = (message.text or "").split()
+    try:
+        currency = parts[1].upper()
+        rate = float(parts[2].replace(",", "."))
+        day = date.fromisoformat(parts[3]).isoformat() if len(parts) > 3 else date.today().isoformat()
+        if rate <= 0 or currency == BASE_CURRENCY:
+            raise ValueError
+    except (IndexError, ValueError):
+        await message.answer("Usage: /fx_set <CUR> <rate> [YYYY-MM-DD]")
+        return
+    set_fx_rates([(day, currency, rate)])
+    await message.answer(f"✅ {currency} = {rate} {BASE_CURRENCY} from {day}")
+
+def _parse_period(args) -> tuple:
+    """[YYYY-MM-DD] [YYYY-MM-DD] -> (since, until), None for a missing bound; ValueError if malformed."""
+    from datetime import date
+    dates = [date.fromisoformat(a).isoformat() for a in args[:2]]
+    return tuple(dates + [None] * (2 - len(dates)))
+
+@router.message(Command("totals"))
+async def cmd_totals(message: Message) -> None:
+    """Использование: /totals [YYYY-MM-DD] [YYYY-MM-DD] — сумма согласованных оплат в базовой валюте."""
+    try:
+        since, until = _parse_period((message.text or "").split()[1:])
+    except ValueError:
+        await message.answer("Usage: /totals [YYYY-MM-DD] [YYYY-MM-DD]")
+        return
+    t = await asyncio.to_thread(sum_approved_base, since, until)
+    text = f"Approved {since or '…'} — {until or '…'}: {t['count']} payments, {fmt_amount(t['total'])} {t['currency']}"
+    if t["unconverted"]:
+        text += f"\n⚠️ {t['unconverted']} payment(s) without FX rate are not included"
+    await message.answer(text)
+
+@router.message(Command("export_receipts"))
+async def cmd_export_receipts(message: Message) -> None:
+    """
+    Использование: /export_receipts [YYYY-MM-DD] [YYYY-MM-DD]
+    Архив чеков согласованных оплат за период (из локального хранилища, без повторной загрузки из Telegram).
+    """
+    import os
+    import tempfile
+    try:
+        since, until = _parse_period((message.text or "").split()[1:])
+    except ValueError:
+        await message.answer("Usage: /export_receipts [YYYY-MM-DD] [YYYY-MM-DD]")
+        return
+    fd, path = tempfile.mkstemp(prefix="receipts_", suffix=".zip")
+    os.close(fd)
+    try:
+        added, missing = await asyncio.to_thread(receipt_store.export_receipts_zip, path, since, until)
+        if not added:
+            await message.answer(f"No stored receipts for this period (not downloaded yet: {missing}).")
+            return
+        caption = f"Receipts {since or '…'} — {until or '…'}: {added}"
+        if missing:
+            caption += f" (not downloaded yet: {missing})"
+        await message.answer_document(FSInputFile(path, filename="receipts.zip"), caption=caption)
+    finally:
+        os.remove(path)
+
+@router.message(F.document, F.caption.func(lambda c: isinstance(c, str) and c.strip().startswith("/import")))
+async def cmd_import(message: Message) -> None:
+    """
+    Использование: отправить CSV/XLSX документ с подписью /import
+    Импорт исторических (уже согласованных) оплат. Только для инициаторов.
+    """
+    import io
+    import importer
+    if not has_role(message.from_user.id, "initiator"):
+        await message.answer("Only initiators can import payments.")
+        return
+    name = (message.document.file_name or "").lower()
+    if not name.endswith((".csv", ".xlsx")):
+        await message.answer("Send a .csv or .xlsx file with caption /import")
+        return
+    buf = await message.bot.download(message.document, destination=io.BytesIO())
+    buf.seek(0)
+    fmt = "xlsx" if name.endswith(".xlsx") else "csv"
+    report = await asyncio.to_thread(importer.import_payments, buf, message.from_user.id, fmt)
+    text = f"Import done: {report.summary()}"
+    if report.errors:
+        text += "\n" + "\n".join(f"line {line}: {msg}" for line, msg in report.errors[:20])
+        if report.error_count > 20:
+            text += f"\n… and {report.error_count - 20} more"
+    await message.answer(text)
+
+@router.message(Command("import"))
+async def cmd_import_usage(message: Message) -> None:
+    await message.answer(
+        "Send a CSV/XLSX document with caption /import.\n"
+        "Columns: amount, method, description, [category], [currency], [created_at], [approved_at], [initiator_id], [approver_id]"
+    )
 
 # ========= FSM =========
 class PaymentForm(StatesGroup):
     amount = State()
+    currency_select = State()
     category_select = State()
     method_select = State()
     receipt = State()      # now BEFORE description
@@ -317,22 +620,15 @@ class PaymentForm(StatesGroup):
 
 @router.message(Command("newpay"))
 async def newpay_start(message: Message, state: FSMContext) -> None:
-    roles = get_roles()
-    if roles["initiator_id"] is None:
+    if not role_members("initiator"):
         set_initiator(message.from_user.id)
-        roles = get_roles()
-    # allow primary and secondary initiators
-    sec = get_config("secondary_initiator_id", None, int)
-    allowed = {roles.get("initiator_id"), sec}
-    if None in allowed:
-        allowed.discard(None)
-    if message.from_user.id not in allowed:
+    if not has_role(message.from_user.id, "initiator"):
         await message.answer("Only initiators can create a request. Ask admin to change roles.")
         return
     await state.clear()
     await state.set_state(PaymentForm.amount)
     await message.answer(
-        f"How much? ({CURRENCY})",
+        "How much? (currency is selected next)",
         reply_markup=kb_nav(back=False)  # только Cancel
     )
 
@@ -344,11 +640,22 @@ async def newpay_amount(message: Message, state: FSMContext) -> None:
         if amount <= 0:
             raise ValueError
     except Exception:
-        await message.answer(f"Please enter a valid number. Example: 1250.00 ({CURRENCY})", reply_markup=kb_nav(back=False))
+        await message.answer("Please enter a valid number. Example: 1250.00", reply_markup=kb_nav(back=False))
         return
     await state.update_data(amount=amount)
+    await state.set_state(PaymentForm.currency_select)
+    await message.answer(f"Amount: {fmt_amount(amount)}\nSelect currency:", reply_markup=currency_kb())
+
+@router.callback_query(F.data.startswith("cur:"))
+async def cb_pick_currency(call: CallbackQuery, state: FSMContext) -> None:
+    currency = call.data.split(":", 1)[1]
+    if currency not in CURRENCIES:
+        await call.answer("Unknown currency", show_alert=True)
+        return
+    await state.update_data(currency=currency)
     await state.set_state(PaymentForm.category_select)
-    await message.answer("Select expense category:", reply_markup=category_kb())
+    await call.message.edit_text(f"Currency: {currency}\n\nSelect expense category:", reply_markup=category_kb())
+    await call.answer()
 
 @router.callback_query(F.data.startswith("cat:"))
 async def cb_pick_category(call: CallbackQuery, state: FSMContext) -> None:
@@ -400,7 +707,7 @@ async def cb_pick_method_by_id(call: CallbackQuery, state: FSMContext) -> None:
 @router.callback_query(F.data == "receipt:skip")
 async def cb_receipt_skip(call: CallbackQuery, state: FSMContext) -> None:
     # skip receipt and ask description
-    await state.update_data(receipt_file=None, receipt_kind=None)
+    await state.update_data(receipt_file=None, receipt_kind=None, receipt_unique_id=None, receipt_name=None)
     await state.set_state(PaymentForm.description)
     await call.message.edit_text("Enter description (any language):", reply_markup=kb_nav(back=True))
     await call.answer()
@@ -409,7 +716,8 @@ async def cb_receipt_skip(call: CallbackQuery, state: FSMContext) -> None:
 async def newpay_receipt_photo(message: Message, state: FSMContext) -> None:
     photo = message.photo[-1] if message.photo else None
     fid = photo.file_id if photo else None
-    await state.update_data(receipt_file=fid, receipt_kind="photo")
+    uid = photo.file_unique_id if photo else None
+    await state.update_data(receipt_file=fid, receipt_kind="photo", receipt_unique_id=uid, receipt_name=None)
     await state.set_state(PaymentForm.description)
     await message.answer("Receipt saved. Now enter description:", reply_markup=kb_nav(back=True))
 
@@ -417,7 +725,11 @@ async def newpay_receipt_photo(message: Message, state: FSMContext) -> None:
 async def newpay_receipt_document(message: Message, state: FSMContext) -> None:
     doc = message.document
     fid = doc.file_id if doc else None
-    await state.update_data(receipt_file=fid, receipt_kind="document")
+    await state.update_data(
+        receipt_file=fid, receipt_kind="document",
+        receipt_unique_id=doc.file_unique_id if doc else None,
+        receipt_name=doc.file_name if doc else None,
+    )
     await state.set_state(PaymentForm.description)
     await message.answer("Receipt saved. Now enter description:", reply_markup=kb_nav(back=True))
 
@@ -435,61 +747,78 @@ async def newpay_description(message: Message, state: FSMContext) -> None:
         await message.answer("❗ Group is not set. Send /setup_here in the target group, then try again.")
         await state.clear()
         return
-    import time
-    temp_id = int(time.time())  # simplistic unique id
+    temp_id = next_staged_id()
     staged = {
         "initiator_id": message.from_user.id,
         "amount": data["amount"],
-        "currency": CURRENCY,
+        "currency": data.get("currency") or CURRENCY,
         "method": data["method"],
         "description": desc,
         "category": data.get("category") or "🧐 Operating Expenses (Other)",
         "receipt_file": data.get("receipt_file"),
         "receipt_kind": data.get("receipt_kind"),
+        "receipt_unique_id": data.get("receipt_unique_id"),
+        "receipt_name": data.get("receipt_name"),
     }
     put_staged(temp_id, staged)
     preview = (
-        f"#PAY-STAGED-{temp_id}\n• {fmt_amount(staged['amount'])} {CURRENCY}\n• {staged['method']}\n" \
+        f"#PAY-STAGED-{temp_id}\n• {fmt_amount(staged['amount'])} {staged['currency']}\n• {staged['method']}\n" \
         f"• {staged['category']}\n\n" \
         f"• Description: {desc}\n\nStatus: WAITING APPROVAL (not saved)\nInitiator: {message.from_user.id}\n"
     )
+    try:
+        fp = payment_fingerprint(staged["amount"], staged["currency"], staged["method"], staged["category"], desc)
+        duplicates = await asyncio.to_thread(register_fingerprint, fp, temp_id, message.from_user.id)
+    except Exception as e:
+        logging.warning(f"Duplicate check failed: {e}")
+        duplicates = []
+    if duplicates:
+        preview += "\n" + render_duplicates(duplicates)
     kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="✅ Approve", callback_data=f"approve_staged:{temp_id}"), InlineKeyboardButton(text="❌ Reject", callback_data=f"reject_staged:{temp_id}")]])
     receipt_file = staged.get('receipt_file')
     receipt_kind = staged.get('receipt_kind')
+    media = bool(receipt_file and receipt_kind in ('photo', 'document'))
     try:
         if receipt_file and receipt_kind == 'photo':
-            await message.bot.send_photo(chat_id=group_id, photo=receipt_file, caption=preview, reply_markup=kb)
+            sent = await message.bot.send_photo(chat_id=group_id, photo=receipt_file, caption=preview, reply_markup=kb)
         elif receipt_file and receipt_kind == 'document':
-            await message.bot.send_document(chat_id=group_id, document=receipt_file, caption=preview, reply_markup=kb)
+            sent = await message.bot.send_document(chat_id=group_id, document=receipt_file, caption=preview, reply_markup=kb)
         else:
-            await message.bot.send_message(chat_id=group_id, text=preview, reply_markup=kb)
+            sent = await message.bot.send_message(chat_id=group_id, text=preview, reply_markup=kb)
     except Exception:
-        await message.bot.send_message(chat_id=group_id, text=preview, reply_markup=kb)
+        sent = await message.bot.send_message(chat_id=group_id, text=preview, reply_markup=kb)
+        media = False
+    # remember preview location: bulk approve/reject edits it later
+    update_staged(temp_id, group_chat_id=sent.chat.id, group_msg_id=sent.message_id, preview_media=media)
     await message.answer("Staged request posted for approval. It will be saved only if approved.")
 
 @router.callback_query(F.data.startswith("approve_staged:"))
 async def cb_approve_staged(call: CallbackQuery) -> None:
-    roles = get_roles()
-    if call.from_user.id != roles.get('approver_id'):
+    if not has_role(call.from_user.id, "approver"):
         await call.answer("Not approver", show_alert=True)
         return
     temp_id = int(call.data.split(":")[1])
-    staged = get_staged(temp_id)
+    # pop-if-present: a second tap in this process finds nothing
+    staged = pop_staged(temp_id)
     if not staged:
-        await call.answer("Staged data missing", show_alert=True)
-        return
-    pid = create_approved_payment(
-        initiator_id=staged['initiator_id'],
-        approver_id=call.from_user.id,
-        amount=staged['amount'],
-        currency=staged['currency'],
-        method=staged['method'],
-        description=staged['description'],
-        category=staged['category']
-    )
-    pop_staged(temp_id)
-    p = get_payment(pid)
-    final_text = render_card(p)
+        await call.answer("Already processed or staged data missing", show_alert=True)
+        return
+    try:
+        # claim + payment + audit + group message location in one transaction (exactly-once
+        # across workers); concurrent approvals are group-committed
+        location = dict(staged, group_chat_id=call.message.chat.id, group_msg_id=call.message.message_id)
+        pid = await committer.approve(temp_id, location, call.from_user.id)
+    except Exception:
+        put_staged(temp_id, staged)
+        raise
+    if pid is None:
+        await call.answer("Already processed", show_alert=True)
+        return
+    payment_id_var.set(pid)
+    if staged.get('receipt_file'):
+        receipt_store.notify()
+    p = get_payment(pid)  # cached on insert, no DB read
+    final_text = payment_cache.card(p, render_card)
     edited = await _safe_edit_final(call.message, final_text)
     if not edited:
         # Fallback: resend media (keeping file with updated caption) or plain text, then delete original to avoid duplicates
@@ -504,18 +833,18 @@ async def cb_approve_staged(call: CallbackQuery) -> None:
                 else:
                     new_msg = await call.bot.send_message(gid, final_text)
         except Exception as e:
-            print(f"[approve fallback send fail] {e}")
+            logging.warning(f"Approve fallback send failed: {e}")
         # Try delete original staged message (removes inline keyboard duplicate)
         try:
             await call.message.delete()
         except Exception as e:
-            print(f"[approve delete original fail] {e}")
-    else:
-        # Save message location for approved payment (optional tracking)
-        try:
-            set_group_message(pid, call.message.chat.id, call.message.message_id)
-        except Exception:
-            pass
+            logging.warning(f"Approve: cannot delete original preview: {e}")
+        # the card now lives in the resent message
+        if new_msg is not None:
+            try:
+                await asyncio.to_thread(set_group_message, pid, new_msg.chat.id, new_msg.message_id)
+            except Exception as e:
+                logging.warning(f"Cannot record group message of payment {pid}: {e}")
     await call.answer("Approved ✅")
     try:
         log_approval_to_sheet(p)
@@ -525,21 +854,23 @@ async def cb_approve_staged(call: CallbackQuery) -> None:
 
 @router.callback_query(F.data.startswith("reject_staged:"))
 async def cb_reject_staged(call: CallbackQuery) -> None:
-    roles = get_roles()
-    if call.from_user.id != roles.get('approver_id'):
+    if not has_role(call.from_user.id, "approver"):
         await call.answer("Not approver", show_alert=True)
         return
     temp_id = int(call.data.split(":")[1])
-    staged = get_staged(temp_id)
+    staged = pop_staged(temp_id)
     if not staged:
         await call.answer("Nothing to discard", show_alert=True)
         return
-    final_text = (
-        f"#PAY-STAGED-{temp_id}\n• {fmt_amount(staged['amount'])} {staged['currency']}\n"
-        f"• {staged['method']}\n• {staged['category']}\n\n"
-        f"• Description: {staged['description']}\n\nStatus: REJECTED (not saved)\nInitiator: {staged['initiator_id']}\nRejected by: {call.from_user.id}"
-    )
-    pop_staged(temp_id)
+    try:
+        claimed = claim_staged(temp_id, "REJECT", call.from_user.id)
+    except Exception:
+        put_staged(temp_id, staged)
+        raise
+    if not claimed:
+        await call.answer("Already processed", show_alert=True)
+        return
+    final_text = render_staged_rejected(temp_id, staged, call.from_user.id)
     edited = await _safe_edit_final(call.message, final_text)
     if not edited:
         # Fallback resend + delete original to prevent duplicates
@@ -553,19 +884,119 @@ async def cb_reject_staged(call: CallbackQuery) -> None:
                 else:
                     await call.bot.send_message(gid, final_text)
         except Exception as e:
-            print(f"[reject fallback send fail] {e}")
+            logging.warning(f"Reject fallback send failed: {e}")
         try:
             await call.message.delete()
         except Exception as e:
-            print(f"[reject delete original fail] {e}")
+            logging.warning(f"Reject: cannot delete original preview: {e}")
     await call.answer("Discarded ❌")
     # No private notification
 
+# ========= Массовое согласование =========
+async def _edit_staged_preview(bot, staged: dict, text: str) -> bool:
+    """Replace a staged preview (caption or text) via the rate-limited sender."""
+    chat_id, msg_id = staged.get("group_chat_id"), staged.get("group_msg_id")
+    if not chat_id or not msg_id:
+        return False
+    try:
+        if staged.get("preview_media"):
+            await tg_sender.send(chat_id, lambda: bot.edit_message_caption(chat_id=chat_id, message_id=msg_id, caption=text, reply_markup=None))
+        else:
+            await tg_sender.send(chat_id, lambda: bot.edit_message_text(chat_id=chat_id, message_id=msg_id, text=text, reply_markup=None))
+        return True
+    except Exception as e:
+        logging.warning(f"Bulk edit of preview {chat_id}/{msg_id} failed: {e}")
+        return False
+
+def _parse_bulk_args(text: str):
+    """'/approve_all [initiator_id]' or '/approve_selected <id> <id> ...' -> list of ints or None."""
+    parts = (text or "").replace(",", " ").split()[1:]
+    ids = []
+    for part in parts:
+        part = part.strip().upper().replace("#PAY-STAGED-", "")
+        if not part.isdigit():
+            return None
+        ids.append(int(part))
+    return ids
+
+async def _bulk_decide(message: Message, approve: bool, selected: bool) -> None:
+    if not has_role(message.from_user.id, "approver"):
+        await message.answer("Only approver can approve or reject requests.")
+        return
+    args = _parse_bulk_args(message.text)
+    cmd = ("approve" if approve else "reject") + ("_selected" if selected else "_all")
+    if args is None or (selected and not args) or (not selected and len(args) > 1):
+        usage = "<staged id> [<staged id> ...]" if selected else "[initiator_id]"
+        await message.answer(f"Usage: /{cmd} {usage}")
+        return
+    if selected:
+        entries = pop_staged_many(temp_ids=args)
+    else:
+        entries = pop_staged_many(initiator_id=args[0] if args else None)
+    if not entries:
+        await message.answer("Nothing staged to process.")
+        return
+    try:
+        if approve:
+            done = await asyncio.to_thread(create_approved_payments_bulk, entries, approver_id=message.from_user.id)
+        else:
+            claimed = await asyncio.to_thread(claim_staged_bulk, [sid for sid, _ in entries], "REJECT", message.from_user.id)
+            done = {sid: None for sid in claimed}
+    except Exception:
+        for sid, st in entries:
+            put_staged(sid, st)
+        raise
+    await message.answer(
+        f"{'Approved ✅' if approve else 'Discarded ❌'}: {len(done)} of {len(entries)} staged requests. Updating group messages…"
+    )
+    staged_by_id = dict(entries)
+    if approve:
+        receipt_store.notify()
+        payments = await asyncio.to_thread(get_payments, list(done.values()))
+        try:
+            log_approvals_to_sheet(payments)  # only queues the rows for the sheet writer thread
+        except Exception:
+            pass
+        by_pid = {p["id"]: p for p in payments}
+        jobs = [_edit_staged_preview(message.bot, staged_by_id[sid], render_card(by_pid[pid])) for sid, pid in done.items()]
+    else:
+        jobs = [_edit_staged_preview(message.bot, staged_by_id[sid], render_staged_rejected(sid, staged_by_id[sid], message.from_user.id)) for sid in done]
+    results = await asyncio.gather(*jobs)
+    failed = len(results) - sum(1 for r in results if r)
+    if failed:
+        await message.answer(f"⚠️ {failed} group message(s) could not be updated.")
+
+@router.message(Command("approve_all"))
+async def cmd_approve_all(message: Message) -> None:
+    """
+    Использование: /approve_all [initiator_id]
+    Согласует все ожидающие заявки (или только заявки указанного инициатора) одной транзакцией.
+    """
+    await _bulk_decide(message, approve=True, selected=False)
+
+@router.message(Command("approve_selected"))
+async def cmd_approve_selected(message: Message) -> None:
+    """Использование: /approve_selected <staged id> [<staged id> ...]"""
+    await _bulk_decide(message, approve=True, selected=True)
+
+@router.message(Command("reject_all"))
+async def cmd_reject_all(message: Message) -> None:
+    """Использование: /reject_all [initiator_id]"""
+    await _bulk_decide(message, approve=False, selected=False)
+
+@router.message(Command("reject_selected"))
+async def cmd_reject_selected(message: Message) -> None:
+    """Использование: /reject_selected <staged id> [<staged id> ...]"""
+    await _bulk_decide(message, approve=False, selected=True)
+
 @router.callback_query(F.data == "nav:back")
 async def cb_nav_back(call: CallbackQuery, state: FSMContext) -> None:
     cur = await state.get_state()
     data = await state.get_data()
-    if cur == PaymentForm.method_select.state:
+    if cur == PaymentForm.category_select.state:
+        await state.set_state(PaymentForm.currency_select)
+        await call.message.edit_text("Select currency:", reply_markup=currency_kb())
+    elif cur == PaymentForm.method_select.state:
         # back to category
         await state.set_state(PaymentForm.category_select)
         await call.message.edit_text("Select expense category:", reply_markup=category_kb())
@@ -592,6 +1023,6 @@ async def any_message(message: Message) -> None:
         return
     # В личке показываем подсказку
     await message.answer(
-        "Use /ping or /newpay. Lists: /pending, /my, /pay <id>. Export: /export_csv. "
+        "Use /ping or /newpay. Lists: /pending, /my, /pay <id>, /approved. Export: /export_csv, /export [format] [from] [to]. "
         "Setup: /setup_here, /set_all_me, /set_initiator <id>, /set_approver <id>, /set_viewer <id>, /roles, /ver"
     )
\ No newline at end of file
@@ -0,0 +1,143 @@
+"""Local /healthz and /readyz endpoints for the container healthcheck.
+
+Served by aiohttp (already installed with aiogram). Reports event-loop lag measured by a
+ticker task, the time of the last processed update, DB writability, Sheets readiness and
+the number of staged requests, without spending Telegram API calls."""
+
+import asyncio
+import logging
+import os
+import time
+
+from aiohttp import web
+
+import api
+import memory_store
+import sheet_logger
+from generators import check_db_writable
+
+LAG_INTERVAL = 0.5                                     # ticker period, seconds
+MAX_LAG = float(os.getenv("HEALTH_MAX_LAG", "2.0"))    # lag above this is unhealthy
+
+_state = {
+    "started_at": time.time(),
+    "polling": False,
+    "lag": 0.0,
+    "max_lag": 0.0,
+    "last_update_at": None,
+    "updates": 0,
+}
+# worst lag since each probe last looked: a stall between two probes is not forgotten after
+# the next tick, and /healthz and /readyz do not reset each other's window
+_window_lag = {"healthz": 0.0, "readyz": 0.0}
+_ticker: asyncio.Task | None = None
+_extra: dict = {}  # name -> callable returning a JSON-able dict (see add_stats)
+
+
+def add_stats(name: str, fn) -> None:
+    """Include fn() under `name` in the /healthz and /readyz payload."""
+    _extra[name] = fn
+
+
+async def lag_ticker(interval: float = LAG_INTERVAL) -> None:
+    """Sleep `interval` in a loop; any extra delay is time the loop was blocked."""
+    loop = asyncio.get_running_loop()
+    while True:
+        t0 = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - t0 - interval)
+        _state["lag"] = lag
+        _state["max_lag"] = max(_state["max_lag"], lag)
+        for probe, worst in _window_lag.items():
+            _window_lag[probe] = max(worst, lag)
+        if lag > MAX_LAG:
+            logging.warning(f"Event loop lag {lag:.2f}s")
+
+
+async def update_tracker(handler, event, data):
+    """Outer update middleware: records when the last update finished processing."""
+    try:
+        return await handler(event, data)
+    finally:
+        _state["last_update_at"] = time.time()
+        _state["updates"] += 1
+
+
+def idle_seconds():
+    """Seconds since the last processed update (None if there was none yet)."""
+    last = _state["last_update_at"]
+    return time.time() - last if last else None
+
+
+async def on_startup() -> None:
+    _state["polling"] = True
+
+
+async def on_shutdown() -> None:
+    _state["polling"] = False
+
+
+def take_window_lag(probe: str) -> float:
+    """Worst lag since the previous call for `probe` (at least the current one); resets it."""
+    worst = max(_window_lag[probe], _state["lag"])
+    _window_lag[probe] = 0.0
+    return worst
+
+
+async def snapshot(probe: str | None = None) -> dict:
+    now = time.time()
+    last = _state["last_update_at"]
+    sheets = sheet_logger.get_status()
+    data = {
+        "uptime_s": round(now - _state["started_at"], 1),
+        "polling": _state["polling"],
+        "loop_lag_s": round(_state["lag"], 4),
+        "loop_lag_max_s": round(_state["max_lag"], 4),
+        "loop_lag_window_s": round(take_window_lag(probe) if probe else _state["lag"], 4),
+        "last_update_at": last,
+        "last_update_age_s": round(now - last, 1) if last else None,
+        "updates": _state["updates"],
+        "db_writable": await asyncio.to_thread(check_db_writable),
+        "sheets": sheets.get("state"),
+        "staged": len(memory_store.list_staged_ids()),
+    }
+    for name, fn in _extra.items():
+        data[name] = fn()
+    return data
+
+
+async def healthz(request: web.Request) -> web.Response:
+    """Liveness: the loop answers and is not badly blocked."""
+    data = await snapshot("healthz")
+    ok = data["loop_lag_window_s"] <= MAX_LAG
+    return web.json_response(dict(data, ok=ok), status=200 if ok else 503)
+
+
+async def readyz(request: web.Request) -> web.Response:
+    """Readiness: polling is running and the DB accepts writes."""
+    data = await snapshot("readyz")
+    ok = data["polling"] and data["db_writable"] and data["loop_lag_window_s"] <= MAX_LAG
+    return web.json_response(dict(data, ok=ok), status=200 if ok else 503)
+
+
+def build_app() -> web.Application:
+    app = web.Application()
+    app.router.add_get("/healthz", healthz)
+    app.router.add_get("/readyz", readyz)
+    api.setup(app)  # read-only /payments, /totals
+    return app
+
+
+async def start_server(host: str | None = None, port: int | None = None):
+    """Start the lag ticker and the HTTP server. Returns the runner (or None if disabled)."""
+    host = host or os.getenv("HEALTH_HOST", "127.0.0.1")
+    port = int(port if port is not None else os.getenv("HEALTH_PORT", "8080"))
+    if not port:
+        return None
+    global _ticker
+    _ticker = asyncio.create_task(lag_ticker())
+    runner = web.AppRunner(build_app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info(f"Health endpoint on http://{host}:{port}/healthz")
+    return runner
@@ -0,0 +1,223 @@
+"""Bulk import of historical (already approved) payments from CSV or XLSX.
+
+The file is streamed row by row, validated against the methods whitelist and the
+expense categories, and inserted in chunks (one transaction per chunk, with audit rows).
+Invalid rows are reported with their line number and skipped.
+
+Columns (header row, case-insensitive):
+    amount, method, description            - required
+    category                               - label or code, default "Operating Expenses (Other)"
+    currency                               - one of CURRENCIES, default BASE_CURRENCY
+    created_at, approved_at                - YYYY-MM-DD[ HH:MM[:SS]], default now
+    initiator_id, approver_id              - default: the importing user
+
+FX rates file (CSV): date (YYYY-MM-DD), currency, rate (BASE_CURRENCY per 1 unit).
+
+CLI:
+    python importer.py payments FILE.csv|FILE.xlsx --actor USER_ID [--chunk 5000]
+    python importer.py fx RATES.csv
+"""
+
+import argparse
+import csv
+import io
+import os
+import sys
+from datetime import datetime
+
+from generators import (
+    init_db, list_methods, insert_imported_payments, optimize_db, set_fx_rates,
+    CATEGORIES, get_category_label_by_code, BASE_CURRENCY, CURRENCIES,
+)
+
+IMPORT_CHUNK = 5000
+MAX_REPORTED_ERRORS = 1000
+
+
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.inserted = 0
+        self.errors = []  # (line number, message), at most MAX_REPORTED_ERRORS
+        self.error_count = 0
+
+    def add_error(self, line: int, msg: str) -> None:
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, msg))
+
+    def summary(self) -> str:
+        return f"rows={self.rows} inserted={self.inserted} errors={self.error_count}"
+
+
+def _iter_csv(fileobj):
+    reader = csv.reader(fileobj)
+    header = next(reader, None)
+    if header is None:
+        return
+    header = [(h or "").strip().lower() for h in header]
+    for line, values in enumerate(reader, start=2):
+        if any(v.strip() for v in values):
+            yield line, dict(zip(header, values))
+
+
+def _iter_xlsx(fileobj):
+    import openpyxl  # optional dependency, only for .xlsx
+    wb = openpyxl.load_workbook(fileobj, read_only=True, data_only=True)
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        header = [str(h or "").strip().lower() for h in header]
+        for line, values in enumerate(rows, start=2):
+            if any(v not in (None, "") for v in values):
+                yield line, dict(zip(header, values))
+    finally:
+        wb.close()
+
+
+def iter_rows(source, fmt: str | None = None):
+    """Yield (line number, {column: value}) from a path or a binary file object."""
+    if fmt is None:
+        name = source if isinstance(source, str) else getattr(source, "name", "")
+        fmt = "xlsx" if str(name).lower().endswith(".xlsx") else "csv"
+    if isinstance(source, str):
+        source = open(source, "rb")
+        close = True
+    else:
+        close = False
+    try:
+        if fmt == "xlsx":
+            yield from _iter_xlsx(source)
+        else:
+            yield from _iter_csv(io.TextIOWrapper(source, encoding="utf-8-sig", newline=""))
+    finally:
+        if close:
+            source.close()
+
+
+def _ts(value, default: str) -> str:
+    if value in (None, ""):
+        return default
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    return datetime.fromisoformat(str(value).strip()).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _int(value, default: int) -> int:
+    if value in (None, ""):
+        return default
+    return int(str(value).strip())
+
+
+class RowValidator:
+    """Turns raw rows into insert tuples; lookups are built once per import."""
+
+    def __init__(self, actor_id: int):
+        self.actor_id = actor_id
+        self.methods = {name.lower(): name for _mid, name in list_methods()}
+        self.categories = {}
+        for label, code in CATEGORIES:
+            self.categories[code] = label
+            self.categories[label.lower()] = label
+            self.categories[label.split(" ", 1)[-1].lower()] = label  # label without emoji
+        self.now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    def __call__(self, row: dict) -> tuple:
+        raw_amount = str(row.get("amount") or "").replace(" ", "").replace(",", ".")
+        try:
+            amount = float(raw_amount)
+        except ValueError:
+            raise ValueError(f"bad amount {row.get('amount')!r}")
+        if amount <= 0:
+            raise ValueError("amount must be positive")
+        method = self.methods.get(str(row.get("method") or "").strip().lower())
+        if not method:
+            raise ValueError(f"unknown method {row.get('method')!r}")
+        description = str(row.get("description") or "").strip()
+        if not description:
+            raise ValueError("description is empty")
+        cat_raw = str(row.get("category") or "").strip()
+        category = self.categories.get(cat_raw.lower()) if cat_raw else get_category_label_by_code("operating")
+        if not category:
+            raise ValueError(f"unknown category {cat_raw!r}")
+        currency = str(row.get("currency") or BASE_CURRENCY).strip().upper()
+        if currency not in CURRENCIES:
+            raise ValueError(f"unknown currency {currency!r}")
+        created_at = _ts(row.get("created_at"), self.now)
+        approved_at = _ts(row.get("approved_at"), created_at)
+        initiator_id = _int(row.get("initiator_id"), self.actor_id)
+        approver_id = _int(row.get("approver_id"), self.actor_id)
+        return (created_at, initiator_id, amount, currency, method, description, approver_id, approved_at, category)
+
+
+def import_payments(source, actor_id: int, fmt: str | None = None, chunk_size: int = IMPORT_CHUNK) -> ImportReport:
+    """Validate and insert rows from `source` (path or binary file object)."""
+    report = ImportReport()
+    validate = RowValidator(actor_id)
+    chunk = []
+    for line, row in iter_rows(source, fmt):
+        report.rows += 1
+        try:
+            chunk.append(validate(row))
+        except ValueError as e:
+            report.add_error(line, str(e))
+            continue
+        if len(chunk) >= chunk_size:
+            report.inserted += len(insert_imported_payments(chunk, actor_id))
+            chunk = []
+    if chunk:
+        report.inserted += len(insert_imported_payments(chunk, actor_id))
+    if report.inserted:
+        optimize_db()
+    return report
+
+
+def import_fx_rates(source) -> ImportReport:
+    """Load date,currency,rate rows (path or binary file object) into fx_rates."""
+    report = ImportReport()
+    rows = []
+    for line, row in iter_rows(source, "csv"):
+        report.rows += 1
+        try:
+            day = datetime.fromisoformat(str(row.get("date") or "").strip()).date().isoformat()
+            currency = str(row.get("currency") or "").strip().upper()
+            rate = float(str(row.get("rate") or "").replace(",", "."))
+            if not currency or rate <= 0:
+                raise ValueError("currency and a positive rate are required")
+        except ValueError as e:
+            report.add_error(line, str(e))
+            continue
+        rows.append((day, currency, rate))
+    report.inserted = set_fx_rates(rows) if rows else 0
+    return report
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Import historical payments")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("payments", help="import approved payments from CSV/XLSX")
+    p.add_argument("file")
+    p.add_argument("--actor", type=int, required=True, help="user id recorded in the audit log")
+    p.add_argument("--chunk", type=int, default=IMPORT_CHUNK)
+    f = sub.add_parser("fx", help="import FX rates (date,currency,rate) from CSV")
+    f.add_argument("file")
+    args = parser.parse_args(argv)
+
+    init_db()
+    if not os.path.isfile(args.file):
+        print(f"File not found: {args.file}", file=sys.stderr)
+        return 2
+    if args.cmd == "fx":
+        report = import_fx_rates(args.file)
+    else:
+        report = import_payments(args.file, actor_id=args.actor, chunk_size=args.chunk)
+    for line, msg in report.errors:
+        print(f"line {line}: {msg}", file=sys.stderr)
+    print(report.summary())
+    return 0 if not report.error_count else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
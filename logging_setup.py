@@ -0,0 +1,143 @@
+"""Non-blocking structured logging.
+
+Log calls only put the record on a queue (QueueHandler); a QueueListener thread formats
+records as JSON lines and writes them to stdout and to a rotating file in LOG_DIR
+(default ./logs, mounted as a volume in docker-compose). Records carry update_id, user_id and payment_id from
+context variables set per update, plus latency_ms where measured. Identical errors
+repeated within REPEAT_WINDOW seconds are collapsed into one line with a counter."""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+DEFAULT_LOG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs")
+LOG_FILE_MAX_BYTES = 10 * 1024 * 1024
+LOG_FILE_BACKUPS = 5
+REPEAT_WINDOW = 60.0
+
+update_id_var: ContextVar = ContextVar("update_id", default=None)
+user_id_var: ContextVar = ContextVar("user_id", default=None)
+payment_id_var: ContextVar = ContextVar("payment_id", default=None)
+
+_CONTEXT = (("update_id", update_id_var), ("user_id", user_id_var), ("payment_id", payment_id_var))
+
+
+@contextmanager
+def log_context(**values):
+    """Set update_id / user_id / payment_id for log records emitted inside the block."""
+    tokens = [(var, var.set(values[name])) for name, var in _CONTEXT if name in values]
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """Copies the context variables onto the record (runs in the emitting task)."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        for name, var in _CONTEXT:
+            if getattr(record, name, None) is None:
+                setattr(record, name, var.get())
+        return True
+
+
+class RepeatFilter(logging.Filter):
+    """Drops WARNING+ records identical (level, logger, message) to one seen within `window`
+    seconds; the next record after the window reports how many were suppressed."""
+
+    def __init__(self, window: float = REPEAT_WINDOW, max_keys: int = 1024):
+        super().__init__()
+        self.window = window
+        self.max_keys = max_keys
+        self._seen = {}  # key -> [first_ts, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING:
+            return True
+        key = (record.levelno, record.name, record.getMessage())
+        now = time.monotonic()
+        with self._lock:
+            entry = self._seen.get(key)
+            if entry and now - entry[0] < self.window:
+                entry[1] += 1
+                return False
+            if entry and entry[1]:
+                record.suppressed = entry[1]
+            if len(self._seen) >= self.max_keys:
+                self._seen = {k: v for k, v in self._seen.items() if now - v[0] < self.window}
+            self._seen[key] = [now, 0]
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    FIELDS = ("update_id", "user_id", "payment_id", "latency_ms", "suppressed")
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for name in self.FIELDS:
+            value = getattr(record, name, None)
+            if value is not None:
+                data[name] = value
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+_listener: logging.handlers.QueueListener | None = None
+
+
+def setup_logging(level: int = logging.INFO, log_dir: str | None = None) -> logging.handlers.QueueListener:
+    """Route all logging through a queue to stdout and a rotating JSON file.
+    log_dir defaults to env LOG_DIR or ./logs; LOG_DIR="" disables file output."""
+    global _listener
+    if log_dir is None:
+        log_dir = os.getenv("LOG_DIR", DEFAULT_LOG_DIR)
+    if _listener is not None:
+        return _listener
+    formatter = JsonFormatter()
+    targets = []
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(formatter)
+    targets.append(stream)
+    if log_dir:
+        try:
+            os.makedirs(log_dir, exist_ok=True)
+            rotating = logging.handlers.RotatingFileHandler(
+                os.path.join(log_dir, "bot.log"), maxBytes=LOG_FILE_MAX_BYTES,
+                backupCount=LOG_FILE_BACKUPS, encoding="utf-8",
+            )
+            rotating.setFormatter(formatter)
+            targets.append(rotating)
+        except OSError as e:
+            print(f"[logging] file output disabled: {e}", file=sys.stderr)
+
+    q: queue.Queue = queue.Queue(-1)
+    qh = logging.handlers.QueueHandler(q)
+    qh.addFilter(ContextFilter())
+    qh.addFilter(RepeatFilter())
+    root = logging.getLogger()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    root.addHandler(qh)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(q, *targets, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return _listener
@@ -0,0 +1,159 @@
+"""Periodic SQLite upkeep for botdata.db, run in-process during quiet periods.
+
+A run does, within MAINTENANCE_BUDGET_MS:
+  - PRAGMA wal_checkpoint(TRUNCATE): copy the WAL into the DB and shrink the -wal file;
+  - PRAGMA optimize: ANALYZE the tables whose statistics are stale (all of them on the
+    first run of the process);
+  - PRAGMA incremental_vacuum(N): return free pages to the filesystem, a few at a time;
+  - PRAGMA quick_check: at most once per MAINTENANCE_CHECK_HOURS.
+Steps that do not fit the budget are skipped (or interrupted) and come again next run.
+
+A DB created before auto_vacuum=INCREMENTAL (set by init_db for new files) needs one full
+VACUUM to switch; it is done in a quiet window when the file is below VACUUM_MAX_MB.
+
+The scheduler waits until no update has been handled for MAINTENANCE_IDLE_S and the last
+run is MAINTENANCE_INTERVAL_H old. Every run logs what it reclaimed and how long it took."""
+
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+
+import generators
+
+INTERVAL_H = float(os.getenv("MAINTENANCE_INTERVAL_H", "6"))
+IDLE_S = float(os.getenv("MAINTENANCE_IDLE_S", "120"))
+BUDGET_MS = float(os.getenv("MAINTENANCE_BUDGET_MS", "2000"))
+CHECK_HOURS = float(os.getenv("MAINTENANCE_CHECK_HOURS", "24"))
+VACUUM_MAX_MB = float(os.getenv("VACUUM_MAX_MB", "200"))
+VACUUM_STEP = 256          # pages per incremental_vacuum call
+POLL_S = 60                # how often the scheduler looks for a quiet window
+
+_stats = {"runs": 0, "last_run_at": None, "last": None}
+_analyzed = False          # first optimize of the process analyzes every table
+_checked_at = 0.0
+
+
+def _connect(timeout: float):
+    con = sqlite3.connect(generators.DB_PATH, timeout=timeout, uri=generators._DB_URI, isolation_level=None)
+    con.execute("PRAGMA synchronous=NORMAL")
+    return con
+
+
+def _pragma(con, sql: str):
+    return con.execute(f"PRAGMA {sql}").fetchone()
+
+
+class _Budget:
+    """Deadline shared by the steps; also interrupts a long statement via the progress handler."""
+
+    def __init__(self, ms: float):
+        self.deadline = time.perf_counter() + ms / 1000
+
+    def left(self) -> float:
+        return self.deadline - time.perf_counter()
+
+    def guard(self, con) -> None:
+        con.set_progress_handler(lambda: 1 if self.left() <= 0 else 0, 10000)
+
+
+def run_maintenance(budget_ms: float = BUDGET_MS, check: bool | None = None) -> dict:
+    """One maintenance pass (blocking; call from a worker thread). Returns the report that
+    is also logged. check=None runs quick_check only when it is due."""
+    started = time.perf_counter()
+    budget = _Budget(budget_ms)
+    report = {"steps": {}, "skipped": []}
+    con = _connect(timeout=max(0.1, budget.left()))
+    try:
+        page_size = _pragma(con, "page_size")[0]
+        free_before = _pragma(con, "freelist_count")[0]
+        pages_before = _pragma(con, "page_count")[0]
+        budget.guard(con)
+
+        def step(name, fn):
+            if budget.left() <= 0:
+                report["skipped"].append(name)
+                return
+            t0 = time.perf_counter()
+            try:
+                report["steps"][name] = fn()
+            except sqlite3.OperationalError as e:  # "interrupted" (budget) or "database is locked"
+                report["steps"][name] = f"error: {e}"
+            report["steps"][f"{name}_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+
+        if not generators._DB_URI:
+            def checkpoint():
+                busy, wal_pages, moved = _pragma(con, "wal_checkpoint(TRUNCATE)")
+                return {"busy": busy, "wal_pages": wal_pages, "checkpointed": moved}
+            step("checkpoint", checkpoint)
+
+        def optimize():
+            global _analyzed
+            con.execute("PRAGMA optimize" if _analyzed else "PRAGMA optimize=0x10002")
+            _analyzed = True
+            return "ok"
+        step("optimize", optimize)
+
+        def vacuum():
+            mode = _pragma(con, "auto_vacuum")[0]
+            if mode != 2:  # 0 = none, 1 = full: switching needs a one-time VACUUM
+                if pages_before * page_size > VACUUM_MAX_MB * 1024 * 1024:
+                    return f"auto_vacuum={mode}; database too large for VACUUM in a window"
+                con.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                con.execute("VACUUM")
+                return "switched to auto_vacuum=INCREMENTAL"
+            while budget.left() > 0 and _pragma(con, "freelist_count")[0]:
+                con.execute(f"PRAGMA incremental_vacuum({VACUUM_STEP})").fetchall()
+            return "ok"
+        step("vacuum", vacuum)
+
+        if check or (check is None and time.time() - _checked_at >= CHECK_HOURS * 3600):
+            def quick_check():
+                global _checked_at
+                result = [r[0] for r in con.execute("PRAGMA quick_check(10)").fetchall()]
+                _checked_at = time.time()
+                if result != ["ok"]:
+                    logging.error(f"DB quick_check failed: {result}")
+                return result[0] if result == ["ok"] else result
+            step("quick_check", quick_check)
+
+        con.set_progress_handler(None, 0)
+        free_after = _pragma(con, "freelist_count")[0]
+        pages_after = _pragma(con, "page_count")[0]
+        report.update(
+            reclaimed_bytes=(pages_before - pages_after) * page_size,
+            free_pages=[free_before, free_after],
+            size_bytes=pages_after * page_size,
+        )
+    finally:
+        con.close()
+    report["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    _stats["runs"] += 1
+    _stats["last_run_at"] = time.time()
+    _stats["last"] = report
+    logging.info(
+        f"DB maintenance: reclaimed {report['reclaimed_bytes']} bytes, free pages "
+        f"{report['free_pages'][0]}->{report['free_pages'][1]}, {report['duration_ms']} ms, "
+        f"steps={report['steps']}" + (f", skipped={report['skipped']}" if report["skipped"] else "")
+    )
+    return report
+
+
+async def run_scheduler(idle_seconds, interval_h: float = INTERVAL_H, idle_s: float = IDLE_S) -> None:
+    """Background loop. idle_seconds() -> seconds since the last handled update (None: none yet)."""
+    last = time.monotonic()  # nothing right at startup
+    while True:
+        await asyncio.sleep(POLL_S)
+        idle = idle_seconds()
+        if time.monotonic() - last < interval_h * 3600 or (idle is not None and idle < idle_s):
+            continue
+        last = time.monotonic()
+        try:
+            await asyncio.to_thread(run_maintenance)
+        except Exception as e:
+            logging.warning(f"DB maintenance failed: {e}")
+
+
+def stats() -> dict:
+    return dict(_stats)
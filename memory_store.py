@@ -1,14 +1,27 @@
 """In-memory staging storage for payment requests before approval.
 
 Only approved payments are persisted in DB. New payment requests are staged here
-until approver confirms. If the bot restarts, staged requests are lost (acceptable
-per current requirements)."""
+until approver confirms. On a graceful shutdown the entries are written to a snapshot
+file and restored by the next process (see drain.py); a crash still loses them.
 
+Approve/reject must take the entry with pop_staged() (pop-if-present) and then
+claim the staged id in DB, so a double tap or a second worker cannot process it twice."""
+
+import time
 from typing import Dict, Any
 from threading import RLock
 
 _lock = RLock()
 _store: Dict[int, Dict[str, Any]] = {}
+_last_id = 0
+
+def next_staged_id() -> int:
+    """Millisecond-based id, strictly increasing within the process.
+    Staged ids are recorded in DB claims, so they must not repeat after a restart."""
+    global _last_id
+    with _lock:
+        _last_id = max(int(time.time() * 1000), _last_id + 1)
+        return _last_id
 
 def put_staged(temp_id: int, data: Dict[str, Any]) -> None:
     with _lock:
@@ -26,3 +39,50 @@ def list_staged_ids() -> list[int]:
     with _lock:
         return list(_store.keys())
 
+
+def update_staged(temp_id: int, **fields: Any) -> bool:
+    """Update fields of a staged entry only if it is still present."""
+    with _lock:
+        data = _store.get(int(temp_id))
+        if data is None:
+            return False
+        data.update(fields)
+        return True
+
+def pop_staged_many(temp_ids=None, initiator_id: int | None = None) -> list[tuple[int, Dict[str, Any]]]:
+    """Atomically take several staged entries: the given ids, or all entries
+    (optionally only those of one initiator). Returns (temp_id, data) in id order."""
+    with _lock:
+        if temp_ids is None:
+            ids = sorted(_store.keys())
+        else:
+            ids = sorted({int(t) for t in temp_ids})
+        out = []
+        for tid in ids:
+            data = _store.get(tid)
+            if data is None:
+                continue
+            if initiator_id is not None and data.get("initiator_id") != initiator_id:
+                continue
+            out.append((tid, _store.pop(tid)))
+        return out
+
+
+def dump_staged() -> dict[int, Dict[str, Any]]:
+    """Copy of all staged entries (for the shutdown snapshot)."""
+    with _lock:
+        return {tid: dict(data) for tid, data in _store.items()}
+
+
+def restore_staged(entries: dict) -> int:
+    """Put entries from a snapshot back (existing ids are kept). Returns how many were added."""
+    global _last_id
+    added = 0
+    with _lock:
+        for tid, data in entries.items():
+            tid = int(tid)
+            if tid not in _store:
+                _store[tid] = dict(data)
+                added += 1
+            _last_id = max(_last_id, tid)
+    return added
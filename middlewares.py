@@ -0,0 +1,223 @@
+"""Dispatcher middlewares.
+
+PerChatOrderingMiddleware: updates from one chat/user pair are handled one at a time and in
+arrival order (so FSM reads and writes never interleave), while updates from different
+chats run in parallel, bounded by a global semaphore.
+
+LogContextMiddleware: sets update_id / user_id for every log record emitted while the
+update is handled and logs the handler latency.
+
+ThrottlingMiddleware: per-user token bucket for every update plus stricter per-user buckets
+for expensive commands; an identical expensive command that is still queued or running is
+dropped instead of being run twice."""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+from logging_setup import log_context
+from throttle import TokenBuckets
+
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "64"))
+SLOW_UPDATE_MS = float(os.getenv("SLOW_UPDATE_MS", "1000"))
+THROTTLE_RATE = float(os.getenv("THROTTLE_RATE", "2"))          # updates per second per user
+THROTTLE_BURST = float(os.getenv("THROTTLE_BURST", "20"))
+EXPENSIVE_PER_MIN = float(os.getenv("THROTTLE_EXPENSIVE_PER_MIN", "6"))
+# DB scans, file builds and uploads: (rate per second, burst) per user and command
+EXPENSIVE_COMMANDS = {
+    name: (EXPENSIVE_PER_MIN / 60, 3)
+    for name in ("export_csv", "export", "export_receipts", "import", "totals", "approved",
+                 "pending", "history", "actor", "profile")
+}
+
+
+def update_key(update: Update):
+    """(chat_id, user_id) the update belongs to; matches the FSM storage key."""
+    event = update.event
+    user = getattr(event, "from_user", None)
+    chat = getattr(event, "chat", None)
+    if chat is None:
+        msg = getattr(event, "message", None)  # callback queries
+        chat = getattr(msg, "chat", None)
+    return (chat.id if chat else None, user.id if user else None)
+
+
+class _KeyLock:
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()  # asyncio.Lock wakes waiters in FIFO order
+        self.users = 0
+
+
+class PerChatOrderingMiddleware(BaseMiddleware):
+    """Outer update middleware: per-key FIFO lock plus a global concurrency limit.
+
+    stats() reports queue wait (time from arrival until the handler starts)."""
+
+    def __init__(self, max_concurrency: int = MAX_CONCURRENT_UPDATES):
+        self._locks: Dict[Any, _KeyLock] = {}
+        self._sem = asyncio.Semaphore(max_concurrency)
+        self.max_concurrency = max_concurrency
+        self.processed = 0
+        self.waiting = 0
+        self.active = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        key = update_key(event)
+        if key == (None, None):
+            return await handler(event, data)
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = _KeyLock()
+        entry.users += 1
+        arrived = time.perf_counter()
+        self.waiting += 1
+        started = False
+        try:
+            async with entry.lock:
+                async with self._sem:
+                    waited = time.perf_counter() - arrived
+                    started = True
+                    self.waiting -= 1
+                    self.active += 1
+                    self.wait_total += waited
+                    self.wait_max = max(self.wait_max, waited)
+                    try:
+                        return await handler(event, data)
+                    finally:
+                        self.active -= 1
+                        self.processed += 1
+        finally:
+            if not started:  # cancelled while queued
+                self.waiting -= 1
+            entry.users -= 1
+            if entry.users == 0:
+                self._locks.pop(key, None)
+
+    def stats(self) -> dict:
+        return {
+            "processed": self.processed,
+            "active": self.active,
+            "waiting": self.waiting,
+            "keys": len(self._locks),
+            "max_concurrency": self.max_concurrency,
+            "wait_avg_ms": round(self.wait_total / self.processed * 1000, 2) if self.processed else 0.0,
+            "wait_max_ms": round(self.wait_max * 1000, 2),
+        }
+
+
+class LogContextMiddleware(BaseMiddleware):
+    """Outer update middleware: log context per update plus latency (WARNING above slow_ms)."""
+
+    def __init__(self, slow_ms: float = SLOW_UPDATE_MS):
+        self.slow_ms = slow_ms
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        _chat_id, user_id = update_key(event)
+        with log_context(update_id=event.update_id, user_id=user_id, payment_id=None):
+            started = time.perf_counter()
+            try:
+                return await handler(event, data)
+            finally:
+                latency_ms = round((time.perf_counter() - started) * 1000, 1)
+                level = logging.WARNING if latency_ms >= self.slow_ms else logging.INFO
+                logging.log(level, f"Update {event.event_type} handled", extra={"latency_ms": latency_ms})
+
+
+def _command_text(update: Update):
+    """Message text, or the caption of a document/photo (/import is sent as a captioned file)."""
+    message = update.message
+    if message is None:
+        return None
+    return message.text or message.caption
+
+
+def update_command(update: Update):
+    """'export' for a '/export@bot 2025-01-01' message (or caption), else None."""
+    text = _command_text(update)
+    if not text or not text.startswith("/"):
+        return None
+    return text.split(maxsplit=1)[0][1:].split("@", 1)[0].lower() or None
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Outer update middleware, registered before the ordering one so that a flood is
+    refused before it queues. A refused user is told once until tokens are back."""
+
+    def __init__(self, rate: float = THROTTLE_RATE, burst: float = THROTTLE_BURST,
+                 commands: dict = EXPENSIVE_COMMANDS):
+        self.users = TokenBuckets(rate, burst)
+        self.commands = {name: TokenBuckets(r, b) for name, (r, b) in commands.items()}
+        self._inflight = set()  # (user_id, command text, document id) of expensive commands not finished yet
+        self.throttled = 0
+        self.coalesced = 0
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        _chat_id, user_id = update_key(event)
+        if user_id is None:
+            return await handler(event, data)
+        wait, notify = self.users.take(user_id)
+        command = update_command(event)
+        buckets = self.commands.get(command)
+        if not wait and buckets is not None:
+            wait, notify = buckets.take(user_id)
+        if wait:
+            self.throttled += 1
+            await self._refuse(event, f"⏳ Too many requests, try again in {max(1, round(wait))} s." if notify else None)
+            return None
+        if buckets is None:
+            return await handler(event, data)
+        document = event.message.document
+        key = (user_id, _command_text(event).strip(), document.file_unique_id if document else None)
+        if key in self._inflight:
+            self.coalesced += 1  # the first one answers
+            return None
+        self._inflight.add(key)
+        try:
+            return await handler(event, data)
+        finally:
+            self._inflight.discard(key)
+
+    @staticmethod
+    async def _refuse(event: Update, text: str | None) -> None:
+        """Tell the user `text` (None: already told). A refused callback is always answered,
+        or the client keeps its spinner until it times out."""
+        try:
+            if event.callback_query:
+                await event.callback_query.answer(text)
+            elif text and event.message and event.message.chat.type == "private":
+                await event.message.answer(text)
+        except Exception as e:
+            logging.debug(f"Throttle notice failed: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "throttled": self.throttled,
+            "coalesced": self.coalesced,
+            "user_buckets": len(self.users),
+            "command_buckets": sum(len(b) for b in self.commands.values()),
+            "inflight": len(self._inflight),
+        }
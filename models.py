@@ -0,0 +1,69 @@
+"""Payment record returned by the payment readers in generators.py.
+
+A `__slots__` object instead of a dict per row: no per-row hash table, attribute access in
+the renderers and sheet_logger. Rows are built straight from the cursor by payment_row
+(set as cursor.row_factory). Columns a query did not select read as None. Records are
+shared through payment_cache and must not be modified. `p["id"]` and `p.get("id")` still
+work for older call sites; as_dict() gives a plain dict (JSON)."""
+
+# all columns of `payments` (tests check this against the schema)
+PAYMENT_FIELDS = (
+    "id", "created_at", "initiator_id", "amount", "currency", "method", "description", "status",
+    "approved_by", "approved_at", "rejected_by", "rejected_at", "group_chat_id", "group_msg_id",
+    "category", "amount_base", "version", "created_ts", "approved_ts", "rejected_ts",
+)
+_FIELDS = frozenset(PAYMENT_FIELDS)
+
+
+class Payment:
+    __slots__ = PAYMENT_FIELDS
+
+    def __init__(self, **fields):
+        for name, value in fields.items():
+            setattr(self, name, value)
+
+    def __getattr__(self, name):
+        # only called for slots that were never set (column not selected)
+        if name in _FIELDS:
+            return None
+        raise AttributeError(name)
+
+    def __getitem__(self, key):
+        if key not in _FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in _FIELDS and _is_set(self, key) else default
+
+    def keys(self) -> list:
+        return [name for name in PAYMENT_FIELDS if _is_set(self, name)]
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.keys()}
+
+    def __eq__(self, other):
+        if isinstance(other, Payment):
+            return self.as_dict() == other.as_dict()
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"Payment(id={self.id!r}, status={self.status!r}, version={self.version!r})"
+
+
+def _is_set(p: Payment, name: str) -> bool:
+    try:
+        object.__getattribute__(p, name)
+    except AttributeError:
+        return False
+    return True
+
+
+def payment_row(cursor, row) -> Payment:
+    """sqlite3 row factory for SELECTs on `payments`."""
+    p = Payment.__new__(Payment)
+    for column, value in zip(cursor.description, row):
+        setattr(p, column[0], value)
+    return p
@@ -0,0 +1,102 @@
+"""Bounded in-process LRU of payment rows and their rendered cards.
+
+Entries are keyed by payment id and carry the row `version`. Writers bump the version in
+the same transaction and call invalidate() after commit, which leaves a tombstone with the
+new version: a row read before the write (older version) is never put back. A rendered
+card is reused only for the exact (id, version) it was rendered from. Rows are read-only
+models.Payment records, so they are stored and handed out without copying.
+
+invalidate() only reaches this process. Writes by other workers on the same DB file are
+caught by generators.get_payment(s), which compare the cached version with the DB before
+serving a row."""
+
+import os
+import threading
+from collections import OrderedDict
+
+PAYMENT_CACHE_SIZE = int(os.getenv("PAYMENT_CACHE_SIZE", "1024"))
+
+
+class PaymentCache:
+    def __init__(self, maxsize: int = PAYMENT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data: OrderedDict = OrderedDict()  # id -> [version, row or None, card or None]
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _store(self, pid: int, entry: list) -> None:
+        self._data[pid] = entry
+        self._data.move_to_end(pid)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def get(self, pid: int):
+        """The cached row, or None."""
+        with self._lock:
+            entry = self._data.get(pid)
+            if entry is None or entry[1] is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(pid)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, row) -> None:
+        """Cache a row read from the DB unless a newer version is already known."""
+        if not row or row.get("version") is None:
+            return
+        pid, version = row["id"], row["version"]
+        with self._lock:
+            entry = self._data.get(pid)
+            if entry is not None and entry[0] is not None and entry[0] > version:
+                return
+            if entry is not None and entry[0] == version and entry[1] is not None:
+                self._data.move_to_end(pid)
+                return
+            self._store(pid, [version, row, None])
+
+    def invalidate(self, pid: int, version: int | None = None) -> None:
+        """Drop the entry; with `version` (the committed one) keep a tombstone so that
+        older rows still in flight are not cached again."""
+        with self._lock:
+            if version is None:
+                self._data.pop(pid, None)
+            else:
+                self._store(pid, [version, None, None])
+
+    def card(self, row, render) -> str:
+        """render(row), reused while the row version is unchanged."""
+        pid, version = row.get("id"), row.get("version")
+        if version is None:
+            return render(row)
+        with self._lock:
+            entry = self._data.get(pid)
+            if entry is not None and entry[0] == version and entry[2] is not None:
+                self._data.move_to_end(pid)
+                self.hits += 1
+                return entry[2]
+        text = render(row)
+        with self._lock:
+            entry = self._data.get(pid)
+            if entry is not None and entry[0] == version and entry[1] is not None:
+                entry[2] = text
+        return text
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+_cache = PaymentCache()
+
+get = _cache.get
+put = _cache.put
+invalidate = _cache.invalidate
+card = _cache.card
+clear = _cache.clear
+stats = _cache.stats
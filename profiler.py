@@ -0,0 +1,85 @@
+"""On-demand in-process profiling for /profile <seconds>.
+
+For the given window two things run together:
+  - cProfile on the event-loop thread (handlers, middlewares, aiogram itself);
+  - a sampling thread that reads sys._current_frames() every SAMPLE_INTERVAL_MS and counts
+    the stacks of all threads, including the asyncio.to_thread workers cProfile cannot see.
+The result is a top-N table by cumulative time and a collapsed-stack text
+("thread;outer (file:line);...;inner (file:line) <count>" per line) that flamegraph.pl,
+speedscope or inferno read directly. Nothing is installed outside a session."""
+
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_MS", "5"))
+MAX_SECONDS = 120
+TOP = 25
+
+_active = threading.Lock()  # one session at a time
+
+
+class ProfileBusy(RuntimeError):
+    pass
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def _sample(stop: threading.Event, interval: float, stacks: Counter) -> None:
+    me = threading.get_ident()
+    names = {}
+    while not stop.wait(interval):
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            parts = []
+            while frame is not None:
+                parts.append(_frame_name(frame))
+                frame = frame.f_back
+            if ident not in names:
+                names = {t.ident: t.name for t in threading.enumerate()}
+            parts.append(names.get(ident, str(ident)))
+            stacks[";".join(reversed(parts))] += 1
+
+
+def collapsed(stacks: Counter) -> str:
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+async def profile(seconds: float, interval_ms: float = SAMPLE_INTERVAL_MS, top: int = TOP) -> tuple[str, str]:
+    """Profile the process for `seconds`. Returns (top functions table, collapsed stacks).
+    Raises ProfileBusy while another session runs."""
+    seconds = max(0.1, min(float(seconds), MAX_SECONDS))
+    if not _active.acquire(blocking=False):
+        raise ProfileBusy("a profiling session is already running")
+    try:
+        stacks: Counter = Counter()
+        stop = threading.Event()
+        sampler = threading.Thread(target=_sample, args=(stop, interval_ms / 1000, stacks), name="profiler", daemon=True)
+        prof = cProfile.Profile()
+        started = time.perf_counter()
+        sampler.start()
+        prof.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            prof.disable()
+            stop.set()
+            await asyncio.to_thread(sampler.join)
+        elapsed = time.perf_counter() - started
+        out = io.StringIO()
+        stats = pstats.Stats(prof, stream=out)
+        stats.sort_stats("cumulative").print_stats(top)
+        header = f"Profiled {elapsed:.1f}s: {sum(stacks.values())} samples every {interval_ms:g} ms\n"
+        return header + out.getvalue(), collapsed(stacks)
+    finally:
+        _active.release()
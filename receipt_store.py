@@ -0,0 +1,108 @@
+"""Local content-addressed copies of payment receipts.
+
+Receipts are attached in Telegram and referenced by file_id in the `receipts` table.
+A background task downloads each file once and stores it as <RECEIPTS_DIR>/<sha[:2]>/<sha>;
+identical files (same Telegram file_unique_id or same content) are kept only once.
+Exports read the local copies, so nothing is downloaded from Telegram again."""
+
+import asyncio
+import hashlib
+import io
+import logging
+import os
+import zipfile
+
+import generators
+from generators import (
+    list_receipts_to_fetch, find_stored_receipt, mark_receipt_stored,
+    mark_receipt_failed, list_receipts_between,
+)
+
+DOWNLOAD_INTERVAL = 60  # seconds between sweeps when nobody calls notify()
+_wakeup: asyncio.Event | None = None
+
+
+def receipts_dir() -> str:
+    default = os.path.join(generators.data_dir(), "receipts")
+    return os.getenv("RECEIPTS_DIR", default)
+
+
+def blob_path(sha256: str) -> str:
+    return os.path.join(receipts_dir(), sha256[:2], sha256)
+
+
+def store_bytes(data: bytes) -> tuple[str, int]:
+    """Write data under its sha256 (no-op if already present). Returns (sha256, size)."""
+    sha = hashlib.sha256(data).hexdigest()
+    path = blob_path(sha)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.tmp{os.getpid()}"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    return sha, len(data)
+
+
+def notify() -> None:
+    """Wake the downloader (call after new receipts were inserted)."""
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+async def download_pending(bot, limit: int = 20) -> int:
+    """Fetch receipts that have no local copy yet. Returns how many were stored."""
+    stored = 0
+    for r in await asyncio.to_thread(list_receipts_to_fetch, limit):
+        try:
+            known = await asyncio.to_thread(find_stored_receipt, r["file_unique_id"])
+            if known and os.path.exists(blob_path(known[0])):
+                sha, size = known
+            else:
+                buf = await bot.download(r["file_id"], destination=io.BytesIO())
+                sha, size = await asyncio.to_thread(store_bytes, buf.getvalue())
+            await asyncio.to_thread(mark_receipt_stored, r["id"], sha, size)
+            stored += 1
+        except Exception as e:
+            logging.warning(f"Receipt {r['id']} (payment {r['payment_id']}) download failed: {e}")
+            await asyncio.to_thread(mark_receipt_failed, r["id"])
+    return stored
+
+
+async def run_downloader(bot, interval: float = DOWNLOAD_INTERVAL) -> None:
+    """Background loop: sweep pending receipts on notify() or every `interval` seconds."""
+    global _wakeup
+    _wakeup = asyncio.Event()
+    while True:
+        try:
+            while await download_pending(bot):
+                pass
+        except Exception as e:
+            logging.warning(f"Receipt downloader sweep failed: {e}")
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+
+
+def _arcname(r: dict) -> str:
+    ext = os.path.splitext(r.get("file_name") or "")[1]
+    if not ext and r.get("kind") == "photo":
+        ext = ".jpg"
+    return f"PAY-{r['payment_id']}_{r['id']}{ext}"
+
+
+def export_receipts_zip(path: str, since: str | None = None, until: str | None = None) -> tuple[int, int]:
+    """Bundle locally stored receipts of payments approved in [since, until] into a zip.
+    Files are streamed from the store into the archive. Returns (added, missing)."""
+    added = missing = 0
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_STORED) as zf:
+        for r in list_receipts_between(since, until):
+            src = blob_path(r["sha256"]) if r["sha256"] else None
+            if not src or not os.path.exists(src):
+                missing += 1
+                continue
+            zf.write(src, _arcname(r))
+            added += 1
+    return added, missing
@@ -1,16 +1,27 @@
-import asyncio
-import logging
+import time
+_T_START = time.perf_counter()
+
+import asyncio  # noqa: E402
+import logging  # noqa: E402
 from aiogram import Bot, Dispatcher
 from aiogram.fsm.storage.memory import MemoryStorage
 from handlers import router
 from generators import init_db, seed_approver_if_empty
-from sheet_logger import configure_from_env
+from sheet_logger import configure_in_background
+from receipt_store import run_downloader
+import health
+import payment_cache
+import maintenance
+import drain
+from committer import committer
+from middlewares import PerChatOrderingMiddleware, LogContextMiddleware, ThrottlingMiddleware
+from logging_setup import setup_logging
 
 # === ВАЖНО ===
 # Пока токен остаётся в коде (как и было). Позже вынесем в .env.
 import os
 from dotenv import load_dotenv  # new
-from generators import set_group_id, get_group_id, set_initiator, get_roles
+from generators import set_group_id, add_role, seed_secondary_initiator_if_empty
 
 # Загрузим переменные окружения из .env (если файл есть рядом с приложением)
 load_dotenv()  # new
@@ -28,16 +39,13 @@ DEFAULT_VIEWER_ID = 5874817910
 # Дополнительный инициатор (второй)
 DEFAULT_SECONDARY_INITIATOR_ID = 8461014384
 
-# импортируем утилиты конфигурации
-from generators import get_config, set_config  # noqa: E402
-
 def bootstrap_env_roles():
     gid = os.getenv("GROUP_ID")
     if gid:
         try:
             set_group_id(int(gid))
         except ValueError:
-            print(f"[WARN] Bad GROUP_ID: {gid}")
+            logging.warning(f"Bad GROUP_ID: {gid}")
     inits = os.getenv("INITIATORS")
     if inits:
         for raw in inits.split(","):
@@ -45,49 +53,107 @@ def bootstrap_env_roles():
             if not raw:
                 continue
             try:
-                uid = int(raw)
-                # Назначаем как initiator если ещё не в списке
-                roles = get_roles(uid)
-                if "initiator" not in roles:
-                    set_initiator(uid)
+                # Назначаем как initiator (повторный вызов ничего не меняет)
+                add_role(int(raw), "initiator")
             except ValueError:
-                print(f"[WARN] Bad INITIATOR id: {raw}")
+                logging.warning(f"Bad INITIATOR id: {raw}")
+
+class StartupTimer:
+    """Collects the duration of each startup phase for a single log line."""
+
+    def __init__(self, started: float):
+        self.started = self.last = started
+        self.phases = []
+
+    def mark(self, name: str) -> None:
+        now = time.perf_counter()
+        self.phases.append((name, now - self.last))
+        self.last = now
+
+    def summary(self) -> str:
+        parts = [f"{name}={dt * 1000:.0f}ms" for name, dt in self.phases]
+        parts.append(f"total={(self.last - self.started) * 1000:.0f}ms")
+        return " ".join(parts)
+
 
 async def main():
-    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
+    # JSON-логи через очередь: stdout + ротация в ./logs (LOG_DIR)
+    setup_logging(level=getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper(), logging.INFO))
+    timer = StartupTimer(_T_START)
+    timer.mark("imports")
 
     # Инициализация БД + авто-миграции
     init_db()
-    # Настройка Google Sheets (если переменные заданы)
-    try:
-        configure_from_env()
-    except Exception as e:
-        logging.warning(f"Sheets logger not configured: {e}")
+    timer.mark("db")
+    storage = MemoryStorage()
+    # Staged-заявки, FSM и строки для Sheets от предыдущего процесса (graceful shutdown)
+    await drain.restore(storage)
+    # Настройка Google Sheets (если переменные заданы) — в фоне, не задерживает polling
+    sheets_init = asyncio.create_task(configure_in_background())  # noqa: F841 (keep a reference)
 
     # Если approver ещё не задан — проставим дефолтный
     seed_approver_if_empty(DEFAULT_APPROVER_ID, DEFAULT_VIEWER_ID)
 
     # Если второй инициатор не задан — установим дефолтный
     try:
-        sec = get_config("secondary_initiator_id", None, int)
-        if sec is None and DEFAULT_SECONDARY_INITIATOR_ID:
-            set_config("secondary_initiator_id", DEFAULT_SECONDARY_INITIATOR_ID)
-            logging.info(f"Seeded secondary_initiator_id={DEFAULT_SECONDARY_INITIATOR_ID}")
+        if DEFAULT_SECONDARY_INITIATOR_ID:
+            seed_secondary_initiator_if_empty(DEFAULT_SECONDARY_INITIATOR_ID)
     except Exception as e:
         logging.warning(f"Cannot seed secondary initiator: {e}")
 
     # Bootstrap roles from environment variables
     bootstrap_env_roles()
+    timer.mark("roles")
 
     bot = Bot(token=BOT_TOKEN)
     me = await bot.get_me()
+    timer.mark("get_me")
     logging.info(f"✅ Bot started as @{me.username} (id={me.id})")
 
-    dp = Dispatcher(storage=MemoryStorage())
+    dp = Dispatcher(storage=storage)
+    dp.update.outer_middleware(health.update_tracker)
+    # Считаем апдейты в обработке: при остановке дожидаемся их (drain.shutdown)
+    inflight = drain.InFlightTracker()
+    dp.update.outer_middleware(inflight)
+    # Лимит запросов на пользователя (и отдельно на тяжёлые команды) — до очереди чата
+    throttling = ThrottlingMiddleware()
+    dp.update.outer_middleware(throttling)
+    health.add_stats("throttling", throttling.stats)
+    # Апдейты одного чата — строго по очереди, разных чатов — параллельно
+    ordering = PerChatOrderingMiddleware()
+    dp.update.outer_middleware(ordering)
+    health.add_stats("update_queue", ordering.stats)
+    health.add_stats("payment_cache", payment_cache.stats)
+    health.add_stats("committer", committer.stats)
+    health.add_stats("maintenance", maintenance.stats)
+    # update_id / user_id / latency в каждой записи лога
+    dp.update.outer_middleware(LogContextMiddleware())
+    dp.startup.register(health.on_startup)
+    dp.shutdown.register(health.on_shutdown)
     dp.include_router(router)
 
+    # Локальный /healthz и /readyz для healthcheck контейнера
+    try:
+        await health.start_server()
+    except OSError as e:
+        logging.warning(f"Health endpoint not started: {e}")
+
+    # Фоновая загрузка чеков в локальное хранилище
+    downloader = asyncio.create_task(run_downloader(bot))  # noqa: F841 (keep a reference)
+    # Групповой коммит согласований
+    commits = asyncio.create_task(committer.run())  # noqa: F841 (keep a reference)
+    # Обслуживание БД (checkpoint, optimize, incremental_vacuum, quick_check) в тихие периоды
+    upkeep = asyncio.create_task(maintenance.run_scheduler(health.idle_seconds))  # noqa: F841 (keep a reference)
+
+    timer.mark("dispatcher")
+    logging.info(f"Startup timings: {timer.summary()} (Sheets init runs in background)")
     logging.info("🚀 Start polling…")
-    await dp.start_polling(bot)
+    # SIGTERM/SIGINT останавливают polling; сессию бота закрываем сами, после drain
+    try:
+        await dp.start_polling(bot, handle_as_tasks=True, close_bot_session=False)
+    finally:
+        await drain.shutdown(inflight, storage, commits)
+        await bot.session.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -6,6 +6,8 @@ BACKUP_DIR=${BACKUP_DIR:-/app/backups}
 mkdir -p "$BACKUP_DIR"
 # Files to backup (adjust if paths differ)
 cp /app/data/botdata.db "$BACKUP_DIR/botdata-$DATE.db"
+# WAL mode: recent commits may still be in the -wal file
+[ -f /app/data/botdata.db-wal ] && cp /app/data/botdata.db-wal "$BACKUP_DIR/botdata-$DATE.db-wal" || true
 cp /app/credentials.json "$BACKUP_DIR/credentials-$DATE.json"
 # Compress older plain DBs weekly via cron if desired
 # Keep only last 30 backups
@@ -1,13 +1,56 @@
 import os
 import json
+import time
+import asyncio
 import logging
-from typing import Optional
+import queue
+import random
+import threading
+from datetime import datetime
 
-import gspread
-from google.oauth2.service_account import Credentials
+from models import Payment
 
-_client: Optional[gspread.Client] = None
-_ws = None
+# gspread / google-auth are imported lazily in _google_client(): they are slow to
+# import and not needed at all when Sheets logging is not configured.
+_client = None  # gspread.Client
+_sh = None      # gspread.Spreadsheet
+_ws = None      # current target worksheet (None: logging disabled)
+
+# Rollover (GSHEET_ROLLOVER): "month" (default) writes to one tab per month, "<tab> YYYY-MM";
+# "rows:N" starts a new tab "<tab> 001", "<tab> 002"... every N rows; "none" keeps a single tab.
+# The next tab is created ahead of time, and "<tab> Index" lists period -> tab.
+_tabs: dict = {}       # title -> worksheet
+_tab_rows: dict = {}   # title -> data rows written (rows:N mode)
+_tab_no = 1            # current numbered tab (rows:N mode)
+_route_lock = threading.RLock()
+TAB_ROWS = 1000        # initial grid size of a new tab (append grows it)
+
+# Worksheet backend: None = Google (gspread), else a factory returning a gspread-compatible
+# client, see use_backend() and sheets_fake.py.
+_backend = None
+
+# Google answers 429 when the per-minute quota is used up and 503 when busy. A 429 was not
+# applied and is retried with exponential backoff (plus jitter). A 503 may still have been
+# applied, so it is retried only for idempotent calls: a retried append_rows could duplicate rows.
+RETRIES = 4
+RETRY_BACKOFF = 1.0    # seconds before the first retry
+RETRY_STATUSES = (429, 503)
+APPEND_RETRY_STATUSES = (429,)
+_stats = {"requests": 0, "retries": 0, "failures": 0}
+
+# Writes go through one writer thread: the handlers only queue rows, so Google latency,
+# tab creation and retry backoff never block the event loop. Rows queued meanwhile are
+# appended together.
+WRITE_BATCH = 500
+_queue: queue.Queue = queue.Queue()
+_writer = None
+_writer_lock = threading.Lock()
+
+# Readiness: "idle" -> "initializing" -> "ready" | "disabled" | "failed".
+# Rows logged while initializing are buffered and appended once the sheet is ready.
+_state = "idle"
+_pending_rows: list = []
+_pending_lock = threading.Lock()
 
 HEADER = [
     "Payment ID",
@@ -18,50 +61,289 @@ HEADER = [
     "Description",
     "Approved At",
 ]
+INDEX_HEADER = ["Period", "Tab", "Created At"]
+
+
+def _rollover() -> tuple:
+    """("month", None) | ("rows", N) | ("none", None) from GSHEET_ROLLOVER."""
+    raw = os.getenv("GSHEET_ROLLOVER", "month").strip().lower()
+    if raw.startswith("rows:"):
+        try:
+            return "rows", max(1, int(raw[5:]))
+        except ValueError:
+            logging.warning(f"Bad GSHEET_ROLLOVER={raw}; using monthly tabs")
+            return "month", None
+    if raw in ("none", "off", ""):
+        return "none", None
+    return "month", None
+
+
+def _base_tab() -> str:
+    return os.getenv("GSHEET_TAB", "Approvals")
+
+
+def _next_month(period: str) -> str:
+    y, m = (int(x) for x in period.split("-"))
+    return f"{y + m // 12}-{m % 12 + 1:02d}"
+
+
+def _status_code(e: Exception):
+    code = getattr(getattr(e, "response", None), "status_code", None)
+    return code if code is not None else getattr(e, "code", None)
+
+
+def _call(fn, *args, statuses: tuple = RETRY_STATUSES, **kwargs):
+    """fn(*args, **kwargs) with retries on the given HTTP statuses (quota / unavailable)."""
+    for attempt in range(RETRIES + 1):
+        _stats["requests"] += 1
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if attempt == RETRIES or _status_code(e) not in statuses:
+                _stats["failures"] += 1
+                raise
+            _stats["retries"] += 1
+            delay = RETRY_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.0)
+            logging.warning(f"Google Sheets {_status_code(e)}; retrying {getattr(fn, '__name__', 'request')}")
+            time.sleep(delay)
+
+
+def _ensure_tab(title: str, period: str, header: list = HEADER, index: bool = True):
+    """Worksheet `title`, created with the header row (and an index entry) if missing."""
+    ws = _tabs.get(title)
+    if ws is not None:
+        return ws
+    try:
+        ws = _call(_sh.add_worksheet, title=title, rows=TAB_ROWS, cols=len(header) + 5)
+        used = 0
+    except Exception as e:
+        if "already exists" not in str(e):
+            raise
+        # left by an earlier attempt whose header append failed (or made by another worker)
+        ws = _call(_sh.worksheet, title)
+        used = len(_call(ws.col_values, 1))
+        if used:
+            _tabs[title] = ws
+            _tab_rows[title] = used - 1
+            return ws
+    _call(ws.append_row, header, value_input_option="USER_ENTERED", statuses=APPEND_RETRY_STATUSES)
+    _tabs[title] = ws
+    _tab_rows[title] = 0
+    if index:
+        idx = _ensure_tab(f"{_base_tab()} Index", "", INDEX_HEADER, index=False)
+        _call(idx.append_row, [period, title, datetime.now().strftime("%Y-%m-%d %H:%M:%S")], value_input_option="USER_ENTERED", statuses=APPEND_RETRY_STATUSES)
+    logging.info(f"Created worksheet '{title}'")
+    return ws
+
+
+def _month_tab(period: str):
+    ws = _ensure_tab(f"{_base_tab()} {period}", period)
+    nxt = _next_month(period)
+    if f"{_base_tab()} {nxt}" not in _tabs:
+        try:
+            _ensure_tab(f"{_base_tab()} {nxt}", nxt)  # ahead of time: the first append of a month stays cheap
+        except Exception as e:
+            logging.warning(f"Cannot pre-create worksheet for {nxt}: {e}")
+    return ws
+
+
+def _numbered_tab(n: int):
+    return _ensure_tab(f"{_base_tab()} {n:03d}", f"#{n}")
+
+
+def _resume_numbered(limit: int) -> int:
+    """Number of the tab to continue in after a restart: the last one, unless it is the
+    empty pre-created one and the tab before it still has room."""
+    prefix = f"{_base_tab()} "
+    numbers = sorted(int(t[len(prefix):]) for t in _tabs if t.startswith(prefix) and t[len(prefix):].isdigit())
+    for n in reversed(numbers[-2:]):
+        ws = _tabs[f"{prefix}{n:03d}"]
+        used = _tab_rows[ws.title] = max(0, len(_call(ws.col_values, 1)) - 1)
+        if 0 < used < limit or n == numbers[0]:
+            return n
+    return numbers[-1] if numbers else 1
+
+
+def _targets(rows: list) -> list:
+    """[(worksheet, rows)] for rows in the order given, following the rollover mode."""
+    global _ws
+    mode, limit = _rollover()
+    if mode == "none":
+        return [(_ws, rows)]
+    out = []
+    if mode == "month":
+        for row in rows:
+            period = str(row[6] or "")[:7] or datetime.now().strftime("%Y-%m")
+            ws = _month_tab(period)
+            if out and out[-1][0] is ws:
+                out[-1][1].append(row)
+            else:
+                out.append((ws, [row]))
+        _ws = out[-1][0]
+        return out
+    global _tab_no
+    n = _tab_no
+    ws = _numbered_tab(n)
+    used = _tab_rows.get(ws.title, 0)
+    rows = list(rows)
+    while rows:
+        if used >= limit:
+            n += 1
+            ws, used = _numbered_tab(n), 0
+            continue
+        out.append((ws, rows[:limit - used]))
+        used += len(out[-1][1])
+        rows = rows[len(out[-1][1]):]
+    if f"{_base_tab()} {n + 1:03d}" not in _tabs:
+        try:
+            _numbered_tab(n + 1)
+        except Exception as e:
+            logging.warning(f"Cannot pre-create worksheet #{n + 1}: {e}")
+    _ws, _tab_no = ws, n
+    return out
+
+
+def _write(rows: list) -> None:
+    """Append rows to their target worksheet(s), one append_rows request per worksheet."""
+    with _route_lock:
+        for ws, chunk in _targets(rows):
+            _call(ws.append_rows, chunk, value_input_option="USER_ENTERED", statuses=APPEND_RETRY_STATUSES)
+            _tab_rows[ws.title] = _tab_rows.get(ws.title, 0) + len(chunk)
+
+
+def _writer_loop() -> None:
+    while True:
+        rows = _queue.get()
+        taken = 1
+        while len(rows) < WRITE_BATCH:
+            try:
+                rows = rows + _queue.get_nowait()
+            except queue.Empty:
+                break
+            taken += 1
+        try:
+            _write(rows)
+        except Exception as e:
+            logging.exception(f"Failed to append {len(rows)} rows to Google Sheet: {e}")
+        finally:
+            for _ in range(taken):
+                _queue.task_done()
+
+
+def _submit(rows: list) -> None:
+    """Queue rows for the writer thread (started on first use)."""
+    global _writer
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = threading.Thread(target=_writer_loop, name="sheet-writer", daemon=True)
+            _writer.start()
+    _queue.put(rows)
+
+
+def flush(timeout: float | None = None) -> bool:
+    """Wait until queued rows are written (or failed). False if `timeout` ran out first."""
+    if timeout is None:
+        _queue.join()
+        return True
+    deadline = time.monotonic() + timeout
+    while _queue.unfinished_tasks:
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def take_unwritten() -> list:
+    """Remove and return rows not handed to Google yet (buffered or still queued), e.g. for
+    the shutdown snapshot after flush() ran out of time."""
+    with _pending_lock:
+        rows, _pending_rows[:] = list(_pending_rows), []
+    while True:
+        try:
+            rows += _queue.get_nowait()
+        except queue.Empty:
+            return rows
+        _queue.task_done()
+
+
+def requeue(rows: list) -> None:
+    """Write rows left over by a previous process: now if the sheet is ready, otherwise
+    buffered until configure_from_env() finishes."""
+    with _pending_lock:
+        if _state != "ready":
+            _pending_rows.extend(rows)
+            return
+    _submit(rows)
 
 
 def configure_from_env():
+    """Configure Sheets logging (blocking; see configure_in_background) and record readiness."""
+    global _state
+    _state = "initializing"
+    try:
+        _configure_from_env()
+    except Exception:
+        _state = "failed"
+        raise
+    _state = "ready" if _ws else "disabled"
+    _flush_pending()
+
+
+async def configure_in_background() -> None:
+    """Run configure_from_env() in a worker thread so Google latency never delays polling."""
+    global _state
+    _state = "initializing"
+    started = time.perf_counter()
+    try:
+        await asyncio.to_thread(configure_from_env)
+    except Exception as e:
+        logging.warning(f"Sheets logger not configured: {e}")
+    logging.info(f"Sheets init finished in {(time.perf_counter() - started) * 1000:.0f} ms: state={_state}")
+
+
+def is_ready() -> bool:
+    return _state == "ready"
+
+
+def _flush_pending() -> None:
+    with _pending_lock:
+        rows, _pending_rows[:] = list(_pending_rows), []
+    if rows and _ws:
+        _submit(rows)
+
+
+def _append(rows: list) -> bool:
+    """Buffer rows while the sheet is initializing. Returns False if they were buffered."""
+    if _state != "initializing":
+        return True
+    with _pending_lock:
+        if _state == "initializing":
+            _pending_rows.extend(rows)
+            return False
+    return True
+
+
+def _configure_from_env():
     """Configure gspread client and target worksheet from env vars.
     Expected env:
       - GSHEET_ID: spreadsheet id (preferred)
       - GSHEET_TITLE or GSHEET_NAME: spreadsheet title (used to auto-create if GSHEET_ID is absent)
       - GSHEET_TAB: worksheet name (default 'Approvals')
       - GOOGLE_CREDENTIALS_JSON: inline JSON cred OR GOOGLE_APPLICATION_CREDENTIALS: path
+      - GSHEET_BACKEND=fake: local fake instead of Google (see sheets_fake.py)
     If not configured, logging is silently disabled.
     """
     sid = os.getenv("GSHEET_ID")
     title_env = os.getenv("GSHEET_TITLE") or os.getenv("GSHEET_NAME")
     tab = os.getenv("GSHEET_TAB", "Approvals")
 
-    creds = None
-    cj = os.getenv("GOOGLE_CREDENTIALS_JSON")
-    caf = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
-    try:
-        scopes = [
-            "https://www.googleapis.com/auth/spreadsheets",
-            "https://www.googleapis.com/auth/drive",
-        ]
-        if cj:
-            info = json.loads(cj)
-            creds = Credentials.from_service_account_info(info, scopes=scopes)
-        else:
-            # Prefer explicit file path, else fallback to credentials.json in project dir
-            if not caf or not os.path.isfile(caf):
-                default_path = os.path.join(os.path.dirname(__file__), "credentials.json")
-                if os.path.isfile(default_path):
-                    caf = default_path
-            if caf and os.path.isfile(caf):
-                creds = Credentials.from_service_account_file(caf, scopes=scopes)
-            else:
-                logging.warning("No Google credentials provided; set GOOGLE_CREDENTIALS_JSON or GOOGLE_APPLICATION_CREDENTIALS or place credentials.json in project root")
-                return
-    except Exception as e:
-        logging.exception(f"Failed to build Google credentials: {e}")
+    client = _open_client()
+    if client is None:
         return
 
-    global _client, _ws
+    global _client, _ws, _sh, _tab_no
     try:
-        _client = gspread.authorize(creds)
+        _client = client
         sh = None
         if sid:
             try:
@@ -92,91 +374,167 @@ def configure_from_env():
                 logging.info(f"Shared spreadsheet with {share_email}")
             except Exception as e:
                 logging.warning(f"Failed to share spreadsheet with {share_email}: {e}")
-        # Ensure worksheet/tab
-        try:
-            _ws = sh.worksheet(tab)
-        except gspread.WorksheetNotFound:
-            try:
-                # Try to reuse default first worksheet if exists
-                try:
-                    first_ws = sh.get_worksheet(0)
-                except Exception:
-                    first_ws = None
-                if first_ws and (first_ws.title == "Sheet1" or not first_ws.row_count):
-                    first_ws.update_title(tab)
-                    _ws = first_ws
-                else:
-                    _ws = sh.add_worksheet(title=tab, rows=1000, cols=len(HEADER) + 5)
-                _ws.append_row(HEADER, value_input_option="USER_ENTERED")
-            except Exception as e:
-                logging.exception(f"Failed to create worksheet '{tab}': {e}")
-                _ws = None
-        # Ensure header
+        _sh = sh
+        _tabs.clear()
+        _tab_rows.clear()
+        _tabs.update((w.title, w) for w in _call(sh.worksheets))
+        mode, _limit = _rollover()
+        if mode == "month":
+            _ws = _month_tab(datetime.now().strftime("%Y-%m"))
+            tab = _ws.title
+        elif mode == "rows":
+            _tab_no = _resume_numbered(_limit)
+            _ws = _numbered_tab(_tab_no)
+            tab = _ws.title
+        else:
+            _ws = _single_tab(sh, tab)
         if _ws:
-            try:
-                first_row = _ws.row_values(1)
-                if first_row != HEADER:
-                    _ws.delete_rows(1)
-                    _ws.insert_row(HEADER, 1, value_input_option="USER_ENTERED")
-            except Exception:
-                pass
-            logging.info(f"Google Sheets logging enabled: id={sid}, tab={tab}")
+            logging.info(f"Google Sheets logging enabled: id={sid}, tab={tab}, rollover={mode}")
     except Exception as e:
         logging.exception(f"Failed to init gspread: {e}")
         _client = None
         _ws = None
 
 
-def log_approval_to_sheet(p: dict):
-    """Append approval row to the sheet if configured.
+def _single_tab(sh, tab: str):
+    """The single worksheet used with GSHEET_ROLLOVER=none (created, header ensured)."""
+    ws = _tabs.get(tab)
+    if ws is None:
+        try:
+            # Try to reuse default first worksheet if exists
+            first_ws = next(iter(_tabs.values()), None)
+            if first_ws and (first_ws.title == "Sheet1" or not first_ws.row_count):
+                first_ws.update_title(tab)
+                ws = first_ws
+            else:
+                ws = sh.add_worksheet(title=tab, rows=TAB_ROWS, cols=len(HEADER) + 5)
+            ws.append_row(HEADER, value_input_option="USER_ENTERED")
+        except Exception as e:
+            logging.exception(f"Failed to create worksheet '{tab}': {e}")
+            return None
+    # Ensure header
+    try:
+        first_row = ws.row_values(1)
+        if first_row != HEADER:
+            ws.delete_rows(1)
+            ws.insert_row(HEADER, 1, value_input_option="USER_ENTERED")
+    except Exception:
+        pass
+    return ws
+
+
+def use_backend(factory) -> None:
+    """Replace the Google client with factory() (e.g. sheets_fake.FakeClient); None restores it."""
+    global _backend
+    _backend = factory
+
+
+def _open_client():
+    """gspread-compatible client: an injected backend, GSHEET_BACKEND=fake, or Google."""
+    if _backend is not None:
+        return _backend()
+    if os.getenv("GSHEET_BACKEND", "google").lower() == "fake":
+        import sheets_fake
+        return sheets_fake.FakeClient.from_env()
+    return _google_client()
+
+
+def _google_client():
+    creds = None
+    cj = os.getenv("GOOGLE_CREDENTIALS_JSON")
+    caf = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
+    default_path = os.path.join(os.path.dirname(__file__), "credentials.json")
+    if not cj and not (caf and os.path.isfile(caf)) and not os.path.isfile(default_path):
+        logging.warning("No Google credentials provided; set GOOGLE_CREDENTIALS_JSON or GOOGLE_APPLICATION_CREDENTIALS or place credentials.json in project root")
+        return None
+    import gspread
+    from google.oauth2.service_account import Credentials
+
+    try:
+        scopes = [
+            "https://www.googleapis.com/auth/spreadsheets",
+            "https://www.googleapis.com/auth/drive",
+        ]
+        if cj:
+            info = json.loads(cj)
+            creds = Credentials.from_service_account_info(info, scopes=scopes)
+        else:
+            # Prefer explicit file path, else fallback to credentials.json in project dir
+            if not caf or not os.path.isfile(caf):
+                if os.path.isfile(default_path):
+                    caf = default_path
+            if caf and os.path.isfile(caf):
+                creds = Credentials.from_service_account_file(caf, scopes=scopes)
+            else:
+                logging.warning("No Google credentials provided; set GOOGLE_CREDENTIALS_JSON or GOOGLE_APPLICATION_CREDENTIALS or place credentials.json in project root")
+                return None
+    except Exception as e:
+        logging.exception(f"Failed to build Google credentials: {e}")
+        return None
+
+    return gspread.authorize(creds)
+
+
+def _approval_row(p: Payment) -> list:
+    return [
+        p.id,
+        float(p.amount or 0),
+        p.currency,
+        p.method,
+        p.category,
+        p.description,
+        p.approved_at or p.created_at,
+    ]
+
+
+def log_approval_to_sheet(p: Payment):
+    """Queue an approval row for the sheet if configured (written by the writer thread).
     Fields (agreed): Payment ID, Amount, Currency, Method, Category, Description, Approved At
     """
-    if not _ws:
+    row = _approval_row(p)
+    if _append([row]) and _ws:
+        _submit([row])
+
+
+def log_approvals_to_sheet(payments: list):
+    """Append approval rows for many payments with a single append_rows request."""
+    if not payments:
         return
-    row = [
-        p.get("id"),
-        float(p.get("amount") or 0),
-        p.get("currency"),
-        p.get("method"),
-        p.get("category"),
-        p.get("description"),
-        p.get("approved_at") or p.get("created_at"),
-    ]
-    try:
-        _ws.append_row(row, value_input_option="USER_ENTERED")
-    except Exception as e:
-        logging.exception(f"Failed to append row to Google Sheet: {e}")
+    rows = [_approval_row(p) for p in payments]
+    if _append(rows) and _ws:
+        _submit(rows)
 
 
-def log_reject_to_sheet(p: dict):
+def log_reject_to_sheet(p: Payment):
     """(Optional) log a rejection event with same structure; Approved At column reused to store rejected_at."""
-    if not _ws:
-        return
     row = [
-        p.get("id"),
-        float(p.get("amount") or 0),
-        p.get("currency"),
-        p.get("method"),
-        p.get("category"),
-        f"REJECTED: {p.get('description')}",
-        p.get("rejected_at") or p.get("created_at"),
+        p.id,
+        float(p.amount or 0),
+        p.currency,
+        p.method,
+        p.category,
+        f"REJECTED: {p.description}",
+        p.rejected_at or p.created_at,
     ]
-    try:
-        _ws.append_row(row, value_input_option="USER_ENTERED")
-    except Exception as e:
-        logging.exception(f"Failed to append reject row: {e}")
+    if _append([row]) and _ws:
+        _submit([row])
 
 
 def get_status():
     """Return dict with current sheet logging status."""
     if not _ws:
-        return {"enabled": False}
+        return {"enabled": False, "state": _state, "buffered": len(_pending_rows), "queued": _queue.unfinished_tasks}
     try:
         sid = _ws.spreadsheet.id
     except Exception:
         sid = None
     return {
         "enabled": True,
+        "state": _state,
         "spreadsheet_id": sid,
         "worksheet_title": getattr(_ws, 'title', None),
+        "rollover": _rollover()[0],
+        "tabs": len(_tabs),
+        "queued": _queue.unfinished_tasks,
+        **_stats,
     }
@@ -0,0 +1,280 @@
+"""Local stand-in for the gspread client, for tests and benchmarks of sheet_logger.
+
+Implements the subset sheet_logger uses: client.open_by_key/create, spreadsheet
+worksheets/worksheet/get_worksheet/add_worksheet/share, and worksheet append_row(s),
+row_values, col_values, insert_row, delete_rows, update_title. Cells live in memory, or in
+SQLite when `db_path` is given (they survive a restart, like a real spreadsheet).
+
+Every call counts as one API request. `latency` (seconds) is slept per request, and quota
+errors can be injected: every `fail_every`-th request, or with probability `fail_rate`,
+raises QuotaExceeded (status 429, shaped like gspread's APIError) without applying anything.
+
+    GSHEET_BACKEND=fake               use it from the bot (sheet_logger)
+    GSHEET_FAKE_DB=path               SQLite file for the cells (default: memory)
+    GSHEET_FAKE_LATENCY_MS=300        simulated Google latency
+    GSHEET_FAKE_429_RATE=0.05         share of requests answered with 429
+
+Benchmark (single appends vs batched, under latency and 429s):
+    python sheets_fake.py bench [--rows 200] [--latency-ms 50] [--fail-rate 0.05]
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+
+
+class WorksheetNotFound(Exception):
+    pass
+
+
+class _Response:
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+
+
+class QuotaExceeded(Exception):
+    """Like gspread.exceptions.APIError for HTTP 429."""
+
+    def __init__(self, msg: str = "Quota exceeded for quota metric 'Write requests'"):
+        super().__init__(msg)
+        self.response = _Response(429)
+        self.code = 429
+
+
+class FakeClient:
+    def __init__(self, latency: float = 0.0, fail_every: int = 0, fail_rate: float = 0.0,
+                 db_path: str | None = None, seed: int | None = None):
+        self.latency = latency
+        self.fail_every = fail_every
+        self.fail_rate = fail_rate
+        self.requests = 0
+        self.failures = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._spreadsheets: dict = {}
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS cells (sheet TEXT, tab TEXT, pos INTEGER, row_json TEXT, PRIMARY KEY (sheet, tab, pos))"
+            )
+            self._db.execute("CREATE TABLE IF NOT EXISTS tabs (sheet TEXT, tab TEXT, ord INTEGER, PRIMARY KEY (sheet, tab))")
+            self._db.commit()
+
+    @classmethod
+    def from_env(cls) -> "FakeClient":
+        return cls(
+            latency=float(os.getenv("GSHEET_FAKE_LATENCY_MS", "0")) / 1000,
+            fail_rate=float(os.getenv("GSHEET_FAKE_429_RATE", "0")),
+            db_path=os.getenv("GSHEET_FAKE_DB") or None,
+        )
+
+    def _request(self) -> None:
+        """One simulated API round trip; raises QuotaExceeded when a failure is injected."""
+        with self._lock:
+            self.requests += 1
+            fail = (self.fail_every and self.requests % self.fail_every == 0) or \
+                (self.fail_rate and self._random.random() < self.fail_rate)
+            if fail:
+                self.failures += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if fail:
+            raise QuotaExceeded()
+
+    def open_by_key(self, key: str) -> "FakeSpreadsheet":
+        self._request()
+        return self._open(key, key)
+
+    def create(self, title: str) -> "FakeSpreadsheet":
+        self._request()
+        sh = self._open(uuid.uuid4().hex, title)
+        sh._add("Sheet1")
+        return sh
+
+    def _open(self, key: str, title: str) -> "FakeSpreadsheet":
+        with self._lock:
+            sh = self._spreadsheets.get(key)
+        if sh is not None:
+            return sh
+        sh = FakeSpreadsheet(self, key, title)  # loads from SQLite, which takes the lock itself
+        with self._lock:
+            return self._spreadsheets.setdefault(key, sh)
+
+    # --- SQLite persistence (no-ops in memory mode) ---
+
+    def _load(self, sh: "FakeSpreadsheet") -> None:
+        if self._db is None:
+            return
+        with self._lock:
+            tabs = self._db.execute("SELECT tab FROM tabs WHERE sheet=? ORDER BY ord", (sh.id,)).fetchall()
+            for (tab,) in tabs:
+                rows = self._db.execute("SELECT row_json FROM cells WHERE sheet=? AND tab=? ORDER BY pos", (sh.id, tab)).fetchall()
+                sh._sheets[tab] = FakeWorksheet(sh, tab, [json.loads(r[0]) for r in rows])
+
+    def _save(self, ws: "FakeWorksheet", old_title: str | None = None) -> None:
+        if self._db is None:
+            return
+        sid = ws.spreadsheet.id
+        with self._lock, self._db:
+            if old_title:
+                self._db.execute("UPDATE tabs SET tab=? WHERE sheet=? AND tab=?", (ws.title, sid, old_title))
+                self._db.execute("UPDATE cells SET tab=? WHERE sheet=? AND tab=?", (ws.title, sid, old_title))
+            self._db.execute(
+                "INSERT OR IGNORE INTO tabs (sheet, tab, ord) VALUES (?, ?, (SELECT COUNT(*) FROM tabs WHERE sheet=?))",
+                (sid, ws.title, sid),
+            )
+            self._db.execute("DELETE FROM cells WHERE sheet=? AND tab=?", (sid, ws.title))
+            self._db.executemany(
+                "INSERT INTO cells (sheet, tab, pos, row_json) VALUES (?, ?, ?, ?)",
+                [(sid, ws.title, i, json.dumps(r, ensure_ascii=False)) for i, r in enumerate(ws._rows)],
+            )
+
+
+class FakeSpreadsheet:
+    def __init__(self, client: FakeClient, key: str, title: str):
+        self.client = client
+        self.id = key
+        self.title = title
+        self._sheets: dict = {}
+        client._load(self)
+
+    def _add(self, title: str) -> "FakeWorksheet":
+        ws = self._sheets[title] = FakeWorksheet(self, title, [])
+        self.client._save(ws)
+        return ws
+
+    def worksheets(self) -> list:
+        self.client._request()
+        return list(self._sheets.values())
+
+    def worksheet(self, title: str) -> "FakeWorksheet":
+        self.client._request()
+        if title not in self._sheets:
+            raise WorksheetNotFound(title)
+        return self._sheets[title]
+
+    def get_worksheet(self, index: int):
+        self.client._request()
+        sheets = list(self._sheets.values())
+        return sheets[index] if index < len(sheets) else None
+
+    def add_worksheet(self, title: str, rows: int = 1000, cols: int = 26) -> "FakeWorksheet":
+        self.client._request()
+        if title in self._sheets:
+            raise ValueError(f'A sheet with the name "{title}" already exists')
+        return self._add(title)
+
+    def share(self, email: str, perm_type: str = "user", role: str = "writer", notify: bool = True) -> None:
+        self.client._request()
+
+
+class FakeWorksheet:
+    def __init__(self, spreadsheet: FakeSpreadsheet, title: str, rows: list):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self._rows = rows
+
+    @property
+    def row_count(self) -> int:
+        return len(self._rows)
+
+    def _changed(self, old_title: str | None = None) -> None:
+        self.spreadsheet.client._save(self, old_title)
+
+    def append_row(self, values: list, value_input_option: str = "RAW") -> None:
+        self.append_rows([values], value_input_option)
+
+    def append_rows(self, values: list, value_input_option: str = "RAW") -> None:
+        self.spreadsheet.client._request()
+        self._rows.extend(list(r) for r in values)
+        self._changed()
+
+    def insert_row(self, values: list, index: int = 1, value_input_option: str = "RAW") -> None:
+        self.spreadsheet.client._request()
+        self._rows.insert(index - 1, list(values))
+        self._changed()
+
+    def delete_rows(self, start_index: int, end_index: int | None = None) -> None:
+        self.spreadsheet.client._request()
+        del self._rows[start_index - 1:(end_index or start_index)]
+        self._changed()
+
+    def row_values(self, row: int) -> list:
+        self.spreadsheet.client._request()
+        return list(self._rows[row - 1]) if row <= len(self._rows) else []
+
+    def col_values(self, col: int) -> list:
+        self.spreadsheet.client._request()
+        return [r[col - 1] for r in self._rows if len(r) >= col]
+
+    def get_all_values(self) -> list:
+        self.spreadsheet.client._request()
+        return [list(r) for r in self._rows]
+
+    def update_title(self, title: str) -> None:
+        self.spreadsheet.client._request()
+        old, self.title = self.title, title
+        sheets = self.spreadsheet._sheets
+        sheets[title] = sheets.pop(old)
+        self._changed(old)
+
+
+def bench(rows: int = 200, latency_ms: float = 50, fail_rate: float = 0.05) -> dict:
+    """Time writing `rows` approvals one by one vs in one batch through sheet_logger
+    (synchronously, bypassing the writer queue)."""
+    import sheet_logger
+    from models import Payment
+
+    payments = [
+        Payment(id=i, amount=100 + i, currency="THB", method="Bank", category="c",
+                description=f"bench {i}", approved_at=time.strftime("%Y-%m-%d %H:%M:%S"))
+        for i in range(rows)
+    ]
+    prev_backoff, sheet_logger.RETRY_BACKOFF = sheet_logger.RETRY_BACKOFF, latency_ms / 1000
+    os.environ.setdefault("GSHEET_ID", "bench")
+    results = {}
+    try:
+        for mode in ("single", "batch"):
+            client = FakeClient(latency=latency_ms / 1000, fail_rate=fail_rate, seed=1)
+            sheet_logger.use_backend(lambda: client)
+            sheet_logger.configure_from_env()
+            start_requests, start_failures = client.requests, client.failures
+            started = time.perf_counter()
+            rows = [sheet_logger._approval_row(p) for p in payments]
+            if mode == "single":
+                for row in rows:
+                    sheet_logger._write([row])
+            else:
+                sheet_logger._write(rows)
+            results[mode] = {
+                "seconds": round(time.perf_counter() - started, 3),
+                "requests": client.requests - start_requests,
+                "quota_errors": client.failures - start_failures,
+            }
+    finally:
+        sheet_logger.use_backend(None)
+        sheet_logger.RETRY_BACKOFF = prev_backoff
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Fake Google Sheets backend")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("bench", help="single vs batched appends under simulated latency and 429s")
+    b.add_argument("--rows", type=int, default=200)
+    b.add_argument("--latency-ms", type=float, default=50)
+    b.add_argument("--fail-rate", type=float, default=0.05)
+    args = parser.parse_args(argv)
+    for mode, r in bench(args.rows, args.latency_ms, args.fail_rate).items():
+        print(f"{mode:>6}: {r['seconds']}s, {r['requests']} requests, {r['quota_errors']} quota errors")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,23 @@
+"""Base TestCase giving every test its own database, so test modules can run in parallel
+(e.g. `python -m pytest -n auto` with pytest-xdist) and leave nothing in the repo."""
+
+import unittest
+
+import generators
+
+
+class DBTestCase(unittest.TestCase):
+    # ":memory:" (shared-cache in-memory DB) or None (temp file; needed for multi-connection concurrency)
+    DB = ":memory:"
+
+    def setUp(self):
+        self.db_path = self.enterContext(generators.database(self.DB))
+
+    def query(self, sql, *args):
+        con = generators._conn()
+        try:
+            rows = con.execute(sql, args).fetchall()
+            con.commit()
+            return rows
+        finally:
+            con.close()
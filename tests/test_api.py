@@ -0,0 +1,70 @@
+import importlib.util
+import os
+import unittest
+from unittest import mock
+
+import generators
+from generators import create_approved_payment
+
+HAS_AIOHTTP = importlib.util.find_spec("aiohttp") is not None
+
+PAYMENT = dict(initiator_id=1, approver_id=2, amount=100, currency='THB', method='Bank', description='d', category='c')
+
+
+@unittest.skipUnless(HAS_AIOHTTP, "aiohttp is not installed")
+class TestApi(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        from aiohttp import web
+        from aiohttp.test_utils import TestClient, TestServer
+        import api
+
+        self.enterContext(generators.database(None))
+        self.enterContext(mock.patch.dict(os.environ, {"API_TOKEN": "secret"}))
+        self.pid = create_approved_payment(**PAYMENT)
+        create_approved_payment(**PAYMENT)
+        app = web.Application()
+        api.setup(app)
+        self.client = TestClient(TestServer(app))
+        await self.client.start_server()
+        self.addAsyncCleanup(self.client.close)
+
+    async def get(self, path, **headers):
+        headers.setdefault("Authorization", "Bearer secret")
+        return await self.client.get(path, headers=headers)
+
+    async def test_unauthorized(self):
+        self.assertEqual((await self.get("/payments", Authorization="Bearer nope")).status, 401)
+        self.assertEqual((await self.client.get("/totals")).status, 401)
+
+    async def test_limit_is_validated_and_clamped(self):
+        self.assertEqual((await self.get("/payments?limit=abc")).status, 400)
+        for limit in ("0", "-1"):
+            resp = await self.get(f"/payments?limit={limit}")
+            self.assertEqual(resp.status, 200)
+            body = await resp.json()
+            self.assertEqual(len(body["items"]), 1)  # clamped to 1
+            self.assertIsNotNone(body["next_cursor"])
+        body = await (await self.get("/payments?limit=5000")).json()
+        self.assertEqual(len(body["items"]), 2)
+
+    async def test_payment_and_not_found(self):
+        resp = await self.get(f"/payments/{self.pid}")
+        self.assertEqual((await resp.json())["id"], self.pid)
+        self.assertEqual((await self.get("/payments/999")).status, 404)
+        self.assertEqual((await self.get("/payments/x")).status, 400)
+
+    async def test_etag_revalidation(self):
+        resp = await self.get("/payments")
+        etag = resp.headers["ETag"]
+        self.assertEqual((await self.get("/payments", **{"If-None-Match": etag})).status, 304)
+        # the tag belongs to this URL only
+        self.assertEqual((await self.get("/payments?limit=1", **{"If-None-Match": etag})).status, 200)
+        self.assertEqual((await self.get("/totals", **{"If-None-Match": etag})).status, 200)
+        create_approved_payment(**PAYMENT)
+        resp = await self.get("/payments", **{"If-None-Match": etag})
+        self.assertEqual(resp.status, 200)
+        self.assertEqual(len((await resp.json())["items"]), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+
+import generators
+from dbcase import DBTestCase
+from generators import (
+    create_payment, approve_payment, set_group_message, get_payment_history, list_actor_actions,
+)
+
+
+class TestAuditLog(DBTestCase):
+    def test_history_has_json_payloads(self):
+        pid = create_payment(111, 1000, 'THB', 'Cash', 'Rent', 'it')
+        set_group_message(pid, -100, 7)
+        approve_payment(pid, 222)
+        history = get_payment_history(pid)
+        self.assertEqual([r['action'] for r in history], ['CREATE', 'POSTED', 'APPROVE'])
+        self.assertEqual(history[0]['payload'], {'amount': 1000, 'currency': 'THB', 'method': 'Cash', 'category': 'it'})
+        self.assertEqual(history[1]['payload'], {'chat_id': -100, 'msg_id': 7})
+        self.assertEqual(tuple(self.query("SELECT p_amount, p_currency FROM audit_log WHERE action='CREATE'")[0]), (1000, 'THB'))
+
+    def test_actor_actions_newest_first(self):
+        first = create_payment(111, 10, 'THB', 'Cash', 'a', 'it')
+        second = create_payment(111, 20, 'THB', 'Cash', 'b', 'it')
+        approve_payment(second, 222)
+        self.assertEqual([r['payment_id'] for r in list_actor_actions(111)], [second, first])
+        self.assertEqual([r['action'] for r in list_actor_actions(222)], ['APPROVE'])
+        self.assertEqual(len(list_actor_actions(111, limit=1)), 1)
+
+    def test_queries_use_indexes(self):
+        for sql in ("SELECT * FROM audit_log WHERE payment_id=? ORDER BY ts, id",
+                    "SELECT * FROM audit_log WHERE actor_id=? ORDER BY ts DESC, id DESC"):
+            plan = " ".join(r[3] for r in self.query("EXPLAIN QUERY PLAN " + sql, 1))
+            self.assertIn("USING INDEX", plan)
+            self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_legacy_payloads_are_migrated_once(self):
+        pid = create_payment(111, 10, 'THB', 'Cash', 'a', 'it')
+        self.query("INSERT INTO audit_log (payment_id, actor_id, action, ts, payload) VALUES (?, 111, 'CREATE', '2024-01-01 00:00:00', '1000.0 THB Bank Transfer | Rent')", pid)
+        self.query("INSERT INTO audit_log (payment_id, actor_id, action, ts, payload) VALUES (?, 0, 'POSTED', '2024-01-01 00:00:00', 'chat_id=-100, msg_id=5')", pid)
+        self.query("DELETE FROM config WHERE key='audit_json'")
+        generators.init_db()
+        payloads = [r['payload'] for r in get_payment_history(pid) if r['ts'] == '2024-01-01 00:00:00']
+        self.assertEqual(payloads, [
+            {'amount': 1000.0, 'currency': 'THB', 'method': 'Bank Transfer', 'category': 'Rent'},
+            {'chat_id': -100, 'msg_id': 5},
+        ])
+        self.assertEqual(self.query("SELECT COUNT(*) FROM audit_log WHERE NOT json_valid(payload)")[0][0], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import asyncio
+import importlib.util
+import time
+import unittest
+from datetime import datetime
+
+from committer import ApprovalCommitter
+from dbcase import DBTestCase
+from generators import create_approved_payment, get_payment
+
+HAS_AIOGRAM = importlib.util.find_spec("aiogram") is not None
+
+STAGED = dict(initiator_id=111, amount=1000, currency='THB', method='Cash', description='Rent', category='Cat')
+
+
+class TestApprovalCommit(DBTestCase):
+    DB = None  # file DB: WAL mode applies
+
+    def test_file_db_uses_wal(self):
+        self.assertEqual(self.query("PRAGMA journal_mode")[0][0], 'wal')
+
+    def test_single_transaction_with_location(self):
+        pid = create_approved_payment(approver_id=222, staged_id=1, group_chat_id=-100, group_msg_id=7, **STAGED)
+        p = get_payment(pid)
+        self.assertEqual((p['group_chat_id'], p['group_msg_id']), (-100, 7))
+        stamps = {r[0] for r in self.query("SELECT ts FROM audit_log WHERE payment_id=?", pid)}
+        stamps |= {r[0] for r in self.query("SELECT ts FROM staged_claims WHERE staged_id=1")}
+        self.assertEqual(stamps, {p['created_at']})
+        actions = [r[0] for r in self.query("SELECT action FROM audit_log WHERE payment_id=? ORDER BY id", pid)]
+        self.assertEqual(actions, ['CREATE_APPROVED', 'APPROVE', 'POSTED'])
+
+    def test_concurrent_approvals_are_group_committed(self):
+        async def scenario():
+            committer = ApprovalCommitter(window_ms=20)
+            task = asyncio.create_task(committer.run())
+            await asyncio.sleep(0)
+            calls = [committer.approve(sid, dict(STAGED, group_chat_id=-100, group_msg_id=sid), 222) for sid in range(1, 41)]
+            calls.append(committer.approve(1, STAGED, 222))  # second tap on the same request
+            results = await asyncio.gather(*calls)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            return committer, results
+
+        committer, results = asyncio.run(scenario())
+        pids = [r for r in results if r is not None]
+        self.assertEqual(len(pids), 40)
+        self.assertEqual(len(set(pids)), 40)
+        self.assertLess(committer.batches, 40)
+        self.assertEqual(self.query("SELECT COUNT(*) FROM audit_log WHERE action='POSTED'")[0][0], 40)
+
+    def test_lone_approval_does_not_wait_for_the_window(self):
+        async def scenario():
+            committer = ApprovalCommitter(window_ms=2000)
+            task = asyncio.create_task(committer.run())
+            await asyncio.sleep(0)
+            started = time.perf_counter()
+            pid = await committer.approve(1, STAGED, 222)
+            elapsed = time.perf_counter() - started
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            return committer, pid, elapsed
+
+        committer, pid, elapsed = asyncio.run(scenario())
+        self.assertIsNotNone(pid)
+        self.assertLess(elapsed, 1.0)
+        self.assertEqual(committer.stats()["immediate"], 1)
+
+    @unittest.skipUnless(HAS_AIOGRAM, "aiogram is not installed")
+    def test_taps_through_ordering_middleware(self):
+        from aiogram.types import Chat, Message, Update, User
+        from middlewares import PerChatOrderingMiddleware
+
+        def tap(uid, sid):
+            return Update(update_id=sid, message=Message(
+                message_id=sid, date=datetime.now(), chat=Chat(id=-100, type="group"),
+                from_user=User(id=uid, is_bot=False, first_name="u"), text="approve"))
+
+        async def scenario():
+            committer = ApprovalCommitter(window_ms=300)
+            ordering = PerChatOrderingMiddleware()
+            task = asyncio.create_task(committer.run())
+            await asyncio.sleep(0)
+
+            async def handler(event, data):
+                return await committer.approve(event.update_id, STAGED, event.message.from_user.id)
+
+            # one approver taps 5 requests (serialized by the middleware), 10 others tap one each
+            updates = [tap(1, sid) for sid in range(1, 6)] + [tap(uid, 100 + uid) for uid in range(2, 12)]
+            started = time.perf_counter()
+            results = await asyncio.gather(*(ordering(handler, u, {}) for u in updates))
+            elapsed = time.perf_counter() - started
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            return committer, results, elapsed
+
+        committer, results, elapsed = asyncio.run(scenario())
+        self.assertEqual(len(set(results)), 15)
+        self.assertLess(committer.batches, 15)  # different approvers share a batch
+        self.assertGreaterEqual(committer.immediate, 1)  # the approver's later taps commit at once
+        self.assertLess(elapsed, 0.9)  # not one 300 ms window per serialized tap
+
+    def test_without_running_loop_falls_back_to_single_insert(self):
+        committer = ApprovalCommitter()
+        pid = asyncio.run(committer.approve(5, STAGED, 222))
+        self.assertEqual(get_payment(pid)['approved_by'], 222)
+        self.assertIsNone(asyncio.run(committer.approve(5, STAGED, 222)))
+
+
+if __name__ == '__main__':
+    unittest.main()
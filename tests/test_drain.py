@@ -0,0 +1,90 @@
+import asyncio
+import importlib.util
+import os
+import tempfile
+import unittest
+
+import memory_store
+import sheet_logger
+from dbcase import DBTestCase
+
+HAS_AIOGRAM = importlib.util.find_spec("aiogram") is not None
+
+
+class TestStagedSnapshot(unittest.TestCase):
+    def tearDown(self):
+        memory_store.pop_staged_many()
+
+    def test_dump_and_restore(self):
+        sid = memory_store.next_staged_id()
+        memory_store.put_staged(sid, {"amount": 10})
+        dumped = memory_store.dump_staged()
+        memory_store.pop_staged_many()
+        self.assertEqual(memory_store.restore_staged({str(k): v for k, v in dumped.items()}), 1)
+        self.assertEqual(memory_store.get_staged(sid), {"amount": 10})
+        self.assertGreater(memory_store.next_staged_id(), sid)
+
+    def test_unwritten_sheet_rows_are_taken(self):
+        sheet_logger.requeue([[1, 10.0]])  # not ready: buffered
+        self.assertEqual(sheet_logger.take_unwritten(), [[1, 10.0]])
+        self.assertEqual(sheet_logger.take_unwritten(), [])
+
+
+@unittest.skipUnless(HAS_AIOGRAM, "aiogram is not installed")
+class TestDrain(DBTestCase):
+    def setUp(self):
+        super().setUp()
+        tmp = self.enterContext(tempfile.TemporaryDirectory())
+        self.path = os.path.join(tmp, "state_snapshot.json")
+
+    def tearDown(self):
+        memory_store.pop_staged_many()
+        sheet_logger.take_unwritten()
+
+    def test_tracker_waits_for_running_handlers(self):
+        import drain
+
+        async def scenario():
+            tracker = drain.InFlightTracker()
+
+            async def handler(event, data):
+                await asyncio.sleep(0.05)
+
+            task = asyncio.create_task(tracker(handler, None, {}))
+            await asyncio.sleep(0)
+            self.assertEqual(tracker.active, 1)
+            self.assertFalse(await tracker.wait(0.01))
+            self.assertTrue(await tracker.wait(1))
+            await task
+
+        asyncio.run(scenario())
+
+    def test_snapshot_round_trip(self):
+        import drain
+        from aiogram.fsm.storage.base import StorageKey
+        from aiogram.fsm.storage.memory import MemoryStorage
+
+        async def scenario():
+            key = StorageKey(bot_id=1, chat_id=2, user_id=3)
+            old = MemoryStorage()
+            await old.set_state(key, "NewPay:amount")
+            await old.set_data(key, {"amount": 100})
+            memory_store.put_staged(77, {"amount": 5})
+            drain.write_snapshot(old, [[9, 1.0]], self.path)
+            memory_store.pop_staged_many()
+
+            new = MemoryStorage()
+            restored = await drain.restore(new, self.path)
+            self.assertEqual(restored, {"staged": 1, "fsm": 1, "sheet_rows": 1})
+            self.assertEqual(await new.get_state(key), "NewPay:amount")
+            self.assertEqual(await new.get_data(key), {"amount": 100})
+            self.assertEqual(memory_store.get_staged(77), {"amount": 5})
+            self.assertEqual(sheet_logger.take_unwritten(), [[9, 1.0]])
+            self.assertFalse(os.path.exists(self.path))
+            self.assertEqual(await drain.restore(new, self.path), {})
+
+        asyncio.run(scenario())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+
+import generators
+from dbcase import DBTestCase
+from generators import (
+    payment_fingerprint, register_fingerprint, create_approved_payment, claim_staged,
+)
+
+STAGED = dict(initiator_id=111, amount=1000, currency='THB', method='Cash', description='Rent March', category='Cat')
+
+
+class TestFingerprints(DBTestCase):
+    def _fp(self, **changes):
+        st = dict(STAGED, **changes)
+        return payment_fingerprint(st['amount'], st['currency'], st['method'], st['category'], st['description'])
+
+    def test_normalization(self):
+        self.assertEqual(self._fp(), self._fp(description='  rent,  MARCH! '))
+        self.assertEqual(self._fp(), self._fp(amount=1000.0))
+        self.assertNotEqual(self._fp(), self._fp(amount=1001))
+        self.assertNotEqual(self._fp(), self._fp(currency='USD'))
+        self.assertNotEqual(self._fp(), self._fp(method='Bank'))
+
+    def test_staged_then_approved_duplicate_is_found(self):
+        fp = self._fp()
+        self.assertEqual(register_fingerprint(fp, 1, 111), [])
+        self.assertEqual([f['staged_id'] for f in register_fingerprint(fp, 2, 111)], [1])
+        pid = create_approved_payment(approver_id=222, staged_id=1, **STAGED)
+        found = register_fingerprint(fp, 3, 111)
+        self.assertEqual({(f['staged_id'], f['payment_id']) for f in found}, {(1, pid), (2, None)})
+        self.assertEqual(self.query("SELECT COUNT(*) FROM fingerprints")[0][0], 3)
+
+    def test_rejected_request_is_forgotten(self):
+        fp = self._fp()
+        register_fingerprint(fp, 1, 111)
+        claim_staged(1, "REJECT", 222)
+        self.assertEqual(register_fingerprint(fp, 2, 111), [])
+
+    def test_old_entries_are_outside_the_window(self):
+        fp = self._fp()
+        register_fingerprint(fp, 1, 111)
+        self.query("UPDATE fingerprints SET created_ts = created_ts - 40 * 86400")
+        self.assertEqual(register_fingerprint(fp, 2, 111, window_days=30), [])
+
+    def test_lookup_uses_index(self):
+        plan = " ".join(r[3] for r in self.query(
+            "EXPLAIN QUERY PLAN SELECT * FROM fingerprints WHERE fp=? AND created_ts >= ? ORDER BY created_ts DESC", 'x', 0))
+        self.assertIn("idx_fingerprints_fp", plan)
+
+    def test_recent_payments_are_seeded_on_migration(self):
+        pid = create_approved_payment(approver_id=222, **STAGED)
+        self.query("DROP TABLE fingerprints")
+        generators.init_db()
+        self.assertEqual([f['payment_id'] for f in register_fingerprint(self._fp(), 9, 111)], [pid])
+
+
+if __name__ == '__main__':
+    unittest.main()
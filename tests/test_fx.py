@@ -0,0 +1,60 @@
+import io
+import unittest
+
+from dbcase import DBTestCase
+from generators import (
+    create_approved_payment, create_payment, approve_payment, get_payment,
+    set_fx_rates, get_fx_rate, sum_approved_base, backfill_amount_base, BASE_CURRENCY
+)
+from importer import import_fx_rates, import_payments
+
+PAYMENT = dict(initiator_id=1, approver_id=2, method='Bank', description='d', category='c')
+
+
+class TestFx(DBTestCase):
+
+    def test_rate_lookup_uses_latest_on_or_before(self):
+        set_fx_rates([('2025-01-01', 'usd', 35.0), ('2025-02-01', 'USD', 34.0)])
+        self.assertEqual(get_fx_rate('USD', '2025-01-15'), 35.0)
+        self.assertEqual(get_fx_rate('USD', '2025-03-01'), 34.0)
+        self.assertIsNone(get_fx_rate('USD', '2024-12-31'))
+        self.assertEqual(get_fx_rate(BASE_CURRENCY, '2000-01-01'), 1.0)
+
+    def test_amount_base_stored_at_approval(self):
+        set_fx_rates([('2000-01-01', 'USD', 36.5)])
+        pid = create_approved_payment(amount=100, currency='USD', **PAYMENT)
+        self.assertEqual(get_payment(pid)['amount_base'], 3650.0)
+        pending = create_payment(initiator_id=1, amount=10, currency='USD', method='Bank', description='d', category='c')
+        self.assertIsNone(get_payment(pending)['amount_base'])
+        approve_payment(pending, approver_id=2)
+        self.assertEqual(get_payment(pending)['amount_base'], 365.0)
+        create_approved_payment(amount=500, currency=BASE_CURRENCY, **PAYMENT)
+        self.assertEqual(sum_approved_base(), {'count': 3, 'total': 4515.0, 'currency': BASE_CURRENCY, 'unconverted': 0})
+
+    def test_missing_rate_backfilled_on_import(self):
+        pid = create_approved_payment(amount=10, currency='USDT', **PAYMENT)
+        self.assertIsNone(get_payment(pid)['amount_base'])
+        self.assertEqual(sum_approved_base()['unconverted'], 1)
+        report = import_fx_rates(io.BytesIO(b"date,currency,rate\n2000-01-01,USDT,35\nbad,USDT,1\n"))
+        self.assertEqual((report.inserted, report.error_count), (1, 1))
+        self.assertEqual(get_payment(pid)['amount_base'], 350.0)
+
+    def test_backfill_skips_rows_without_rate(self):
+        usdt = create_approved_payment(amount=10, currency='USDT', **PAYMENT)
+        usd = create_approved_payment(amount=10, currency='USD', **PAYMENT)
+        self.assertEqual(backfill_amount_base(), 0)
+        self.assertEqual(self.query("SELECT version FROM payments WHERE id=?", usdt)[0][0], 1)
+        set_fx_rates([('2000-01-01', 'USD', 35.0)])  # backfills the USD row only
+        self.assertEqual(self.query("SELECT version FROM payments WHERE id=?", usdt)[0][0], 1)
+        self.assertEqual(get_payment(usd)['amount_base'], 350.0)
+
+    def test_import_converts_by_approval_date(self):
+        set_fx_rates([('2025-01-01', 'USD', 30.0), ('2025-06-01', 'USD', 40.0)])
+        data = io.BytesIO(b"amount,method,description,currency,approved_at\n1,Bank,a,USD,2025-02-01\n1,Bank,b,USD,2025-07-01\n1,Bank,c,EUR,\n")
+        report = import_payments(data, actor_id=1, fmt='csv')
+        self.assertEqual(report.inserted, 2)
+        self.assertEqual(sum_approved_base()['total'], 70.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import asyncio
+import importlib.util
+import time
+import unittest
+from unittest import mock
+
+import generators
+
+HAS_AIOHTTP = importlib.util.find_spec("aiohttp") is not None
+
+
+@unittest.skipUnless(HAS_AIOHTTP, "aiohttp is not installed")
+class TestHealth(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        from aiohttp.test_utils import TestClient, TestServer
+        import health
+
+        self.health = health
+        self.enterContext(generators.database(None))
+        self.enterContext(mock.patch.dict(health._state, polling=False, lag=0.0, max_lag=0.0,
+                                          last_update_at=None, updates=0))
+        self.enterContext(mock.patch.dict(health._window_lag, healthz=0.0, readyz=0.0))
+        self.client = TestClient(TestServer(health.build_app()))
+        await self.client.start_server()
+        self.addAsyncCleanup(self.client.close)
+
+    async def status(self, path):
+        resp = await self.client.get(path)
+        return resp.status, (await resp.json())["ok"]
+
+    async def test_ready_only_after_startup(self):
+        self.assertEqual(await self.status("/readyz"), (503, False))
+        self.assertEqual(await self.status("/healthz"), (200, True))
+        await self.health.on_startup()
+        self.assertEqual(await self.status("/readyz"), (200, True))
+        await self.health.on_shutdown()
+        self.assertEqual(await self.status("/readyz"), (503, False))
+
+    async def test_unwritable_db_is_not_ready(self):
+        await self.health.on_startup()
+        with mock.patch.object(self.health, "check_db_writable", return_value=False):
+            self.assertEqual(await self.status("/readyz"), (503, False))
+            self.assertEqual(await self.status("/healthz"), (200, True))  # still alive
+
+    async def test_stall_between_probes_fails_both(self):
+        await self.health.on_startup()
+        ticker = asyncio.create_task(self.health.lag_ticker(0.01))
+        self.addCleanup(ticker.cancel)
+        await asyncio.sleep(0.02)
+        with mock.patch.object(self.health, "MAX_LAG", 0.05):
+            time.sleep(0.1)  # block the loop
+            await asyncio.sleep(0.05)  # several normal ticks overwrite the current lag
+            self.assertLess(self.health._state["lag"], 0.05)
+            self.assertEqual(await self.status("/healthz"), (503, False))
+            self.assertEqual(await self.status("/readyz"), (503, False))
+            # the window was read and reset by each probe
+            self.assertEqual(await self.status("/healthz"), (200, True))
+            self.assertEqual(await self.status("/readyz"), (200, True))
+
+    async def test_update_tracker(self):
+        async def handler(event, data):
+            return "done"
+
+        self.assertIsNone(self.health.idle_seconds())
+        self.assertEqual(await self.health.update_tracker(handler, None, {}), "done")
+        self.assertEqual(self.health._state["updates"], 1)
+        self.assertLess(self.health.idle_seconds(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import io
+import time
+import unittest
+
+from dbcase import DBTestCase
+from importer import import_payments
+
+
+def _csv(lines):
+    return io.BytesIO(("\n".join(lines) + "\n").encode("utf-8"))
+
+
+class TestImporter(DBTestCase):
+
+    def test_validates_and_reports_errors(self):
+        data = _csv([
+            "amount,method,category,description,created_at,initiator_id",
+            "1000,cash,rent,Office rent,2025-03-01,7",
+            "12.5,Bank,IT & Services,Hosting,2025-03-02 10:00,",
+            "abc,Cash,rent,Bad amount,,",
+            "10,Paypal,rent,Bad method,,",
+            "10,Cash,food,Bad category,,",
+            "10,Cash,rent,,,",
+            "10,Cash,rent,Bad date,2025-13-01,",
+        ])
+        report = import_payments(data, actor_id=99, fmt="csv")
+        self.assertEqual(report.rows, 7)
+        self.assertEqual(report.inserted, 2)
+        self.assertEqual([line for line, _ in report.errors], [4, 5, 6, 7, 8])
+        rows = self.query("SELECT method, category, initiator_id, approved_by, created_at, status FROM payments ORDER BY id")
+        audit = self.query("SELECT COUNT(*) FROM audit_log WHERE action='IMPORT' AND actor_id=99")[0][0]
+        self.assertEqual(tuple(rows[0]), ('Cash', '📮 Rent & Utilities', 7, 99, '2025-03-01 00:00:00', 'APPROVED'))
+        self.assertEqual(rows[1][1], '👨🏽‍💻 IT & Services')
+        self.assertEqual(rows[1][2], 99)
+        self.assertEqual(audit, 2)
+
+    def test_large_import_in_chunks(self):
+        lines = ["amount,method,description"] + [f"{i + 1},USDT,row {i}" for i in range(20000)]
+        started = time.perf_counter()
+        report = import_payments(_csv(lines), actor_id=1, fmt="csv", chunk_size=5000)
+        self.assertEqual(report.inserted, 20000)
+        self.assertLess(time.perf_counter() - started, 10)
+        self.assertEqual(tuple(self.query("SELECT COUNT(*), MAX(id) FROM payments")[0]), (20000, 20000))
+
+
+if __name__ == '__main__':
+    unittest.main()
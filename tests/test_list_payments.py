@@ -0,0 +1,107 @@
+import io
+import unittest
+from datetime import datetime
+
+import generators
+from dbcase import DBTestCase
+from generators import (
+    create_approved_payment, create_payment, get_payment, init_db, list_payments, reject_payment,
+    get_category_label_by_code, reader, sum_approved_base
+)
+from importer import import_payments
+
+
+def _epoch(text):
+    return int(datetime.fromisoformat(text).timestamp())
+
+
+class TestListPayments(DBTestCase):
+    def setUp(self):
+        super().setUp()
+        rows = ["amount,method,description,category,approved_at"]
+        for month in (1, 2, 3):
+            for day in range(1, 11):
+                rows.append(f"{day},{'Bank' if day % 2 else 'Cash'},m{month}d{day},{'it' if day <= 3 else 'operating'},2025-{month:02d}-{day:02d} 12:00")
+        import_payments(io.BytesIO("\n".join(rows).encode()), actor_id=1, fmt='csv')
+
+    def test_writers_fill_epoch_columns(self):
+        pid = create_approved_payment(initiator_id=1, approver_id=2, amount=1, currency='THB', method='Bank', description='d', category='c')
+        p = get_payment(pid)
+        self.assertEqual(p['created_ts'], _epoch(p['created_at']))
+        self.assertEqual(p['approved_ts'], _epoch(p['approved_at']))
+        other = create_payment(initiator_id=1, amount=1, currency='THB', method='Bank', description='x', category='c')
+        reject_payment(other, approver_id=2)
+        p = get_payment(other)
+        self.assertEqual(p['rejected_ts'], _epoch(p['rejected_at']))
+
+    def test_migration_backfills_old_rows(self):
+        self.query("UPDATE payments SET created_ts=NULL, approved_ts=NULL")
+        init_db()
+        row = self.query("SELECT approved_at, approved_ts FROM payments ORDER BY id LIMIT 1")[0]
+        self.assertEqual(row[1], _epoch(row[0]))
+
+    def _plan(self, sql, args):
+        return " ".join(r[3] for r in self.query("EXPLAIN QUERY PLAN " + sql, *args))
+
+    def test_one_index_serves_totals_and_pages(self):
+        cond, args = generators._approved_range('2025-01-01', '2025-01-31')
+        plan = self._plan("SELECT COUNT(*), SUM(amount_base) FROM payments WHERE status='APPROVED'" + cond, args)
+        self.assertIn("COVERING INDEX idx_payments_approved_ts", plan)
+        plan = self._plan(*generators._page_query("*", '2025-01-01', None, None, None, "1735700000:5", 100))
+        self.assertIn("idx_payments_approved_ts", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_old_indexes_are_replaced(self):
+        self.query("DROP INDEX idx_payments_approved_ts")
+        self.query("CREATE INDEX idx_payments_approved_ts ON payments(status, approved_ts)")
+        self.query("CREATE INDEX idx_payments_status_approved_base ON payments(status, approved_at, amount_base)")
+        init_db()
+        self.assertEqual([r[2] for r in self.query("PRAGMA index_info(idx_payments_approved_ts)")],
+                         ['status', 'approved_ts', 'id', 'amount_base'])
+        self.assertEqual(self.query("SELECT COUNT(*) FROM sqlite_master WHERE name='idx_payments_status_approved_base'")[0][0], 0)
+
+    def test_month_filter_and_pagination(self):
+        seen, cursor = [], None
+        while True:
+            rows, cursor = list_payments('2025-02-01', '2025-02-28', cursor=cursor, limit=3)
+            seen += [r['description'] for r in rows]
+            if cursor is None:
+                break
+        self.assertEqual(seen, [f"m2d{d}" for d in range(1, 11)])
+
+    def test_category_and_method_filters(self):
+        rows, cursor = list_payments(category=get_category_label_by_code('it'), method='Bank')
+        self.assertIsNone(cursor)
+        self.assertEqual([r['description'] for r in rows], ['m1d1', 'm1d3', 'm2d1', 'm2d3', 'm3d1', 'm3d3'])
+
+    def test_bad_cursor(self):
+        with self.assertRaises(ValueError):
+            list_payments(cursor='nope')
+
+    def test_bad_limit(self):
+        for limit in (0, -1):
+            with self.assertRaises(ValueError):
+                list_payments(limit=limit)
+
+
+class TestReader(DBTestCase):
+    def test_data_version_changes_on_commit(self):
+        with reader() as (con, v1):
+            pass
+        with reader() as (con, v2):
+            self.assertEqual(list_payments(con=con), ([], None))
+        self.assertEqual(v1, v2)
+        create_approved_payment(initiator_id=1, approver_id=2, amount=5, currency='THB', method='Bank', description='d', category='c')
+        with reader() as (con, v3):
+            self.assertEqual(sum_approved_base(con=con)['count'], 1)
+        self.assertNotEqual(v2, v3)
+
+    def test_reader_is_read_only(self):
+        import sqlite3
+        with reader() as (con, _):
+            with self.assertRaises(sqlite3.OperationalError):
+                con.execute("DELETE FROM payments")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import json
+import logging
+import time
+import unittest
+
+from logging_setup import ContextFilter, JsonFormatter, RepeatFilter, log_context
+
+
+def _record(msg, level=logging.ERROR, **extra):
+    record = logging.LogRecord("bot", level, __file__, 1, msg, None, None)
+    record.__dict__.update(extra)
+    return record
+
+
+class TestLoggingSetup(unittest.TestCase):
+    def test_json_record_carries_context(self):
+        with log_context(update_id=10, user_id=20, payment_id=30):
+            record = _record("approved", level=logging.INFO, latency_ms=12.5)
+            ContextFilter().filter(record)
+        data = json.loads(JsonFormatter().format(record))
+        self.assertEqual((data["update_id"], data["user_id"], data["payment_id"]), (10, 20, 30))
+        self.assertEqual(data["latency_ms"], 12.5)
+        self.assertEqual(data["msg"], "approved")
+
+    def test_context_is_reset(self):
+        with log_context(update_id=1):
+            pass
+        record = _record("x")
+        ContextFilter().filter(record)
+        self.assertIsNone(record.update_id)
+
+    def test_repeated_errors_are_suppressed(self):
+        f = RepeatFilter(window=0.05)
+        passed = [f.filter(_record("boom")) for _ in range(100)]
+        self.assertEqual(passed.count(True), 1)
+        self.assertTrue(f.filter(_record("other")))
+        self.assertTrue(f.filter(_record("info", level=logging.INFO)))
+        self.assertTrue(f.filter(_record("info", level=logging.INFO)))
+        time.sleep(0.06)
+        record = _record("boom")
+        self.assertTrue(f.filter(record))
+        self.assertEqual(record.suppressed, 99)
+
+
+if __name__ == '__main__':
+    unittest.main()
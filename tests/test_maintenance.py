@@ -0,0 +1,49 @@
+import sqlite3
+import unittest
+
+import maintenance
+from dbcase import DBTestCase
+from generators import create_payment
+
+
+class TestMaintenance(DBTestCase):
+    DB = None  # file DB: WAL checkpoint and vacuum apply
+
+    def _fill_and_delete(self):
+        for i in range(300):
+            create_payment(111, i, 'THB', 'Cash', 'x' * 500, 'it')
+        self.query("DELETE FROM audit_log")
+        self.query("DELETE FROM payments")
+
+    def test_new_db_uses_incremental_vacuum(self):
+        self.assertEqual(self.query("PRAGMA auto_vacuum")[0][0], 2)
+
+    def test_run_reclaims_free_pages(self):
+        self._fill_and_delete()
+        report = maintenance.run_maintenance(budget_ms=5000, check=True)
+        self.assertEqual(report["skipped"], [])
+        self.assertEqual(report["steps"]["checkpoint"]["busy"], 0)
+        self.assertEqual(report["steps"]["quick_check"], "ok")
+        self.assertGreater(report["reclaimed_bytes"], 0)
+        self.assertEqual(report["free_pages"][1], 0)
+        self.assertEqual(maintenance.stats()["last"], report)
+
+    def test_switches_old_database_to_incremental(self):
+        con = sqlite3.connect(self.db_path, isolation_level=None)
+        con.execute("PRAGMA auto_vacuum=NONE")
+        con.execute("VACUUM")
+        con.close()
+        self.assertEqual(self.query("PRAGMA auto_vacuum")[0][0], 0)
+        report = maintenance.run_maintenance(budget_ms=5000, check=False)
+        self.assertIn("switched", report["steps"]["vacuum"])
+        self.assertNotIn("quick_check", report["steps"])
+        self.assertEqual(self.query("PRAGMA auto_vacuum")[0][0], 2)
+
+    def test_spent_budget_skips_steps(self):
+        report = maintenance.run_maintenance(budget_ms=0, check=True)
+        self.assertEqual(report["steps"], {})
+        self.assertEqual(report["skipped"], ["checkpoint", "optimize", "vacuum", "quick_check"])
+
+
+if __name__ == '__main__':
+    unittest.main()
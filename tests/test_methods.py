@@ -1,20 +1,10 @@
-import os
 import unittest
-from generators import init_db, list_methods, add_method, delete_method, create_payment
-
-DB_FILE = os.path.join(os.path.dirname(__file__), '..', 'botdata.db')
+from dbcase import DBTestCase
+from generators import list_methods, add_method, delete_method, create_payment
 
 SYSTEM_METHODS = {"Bank", "USDT", "Cash"}
 
-class TestMethodDeletion(unittest.TestCase):
-    def setUp(self):
-        # SQLite: remove file to start fresh
-        if os.path.exists(DB_FILE):
-            try:
-                os.remove(DB_FILE)
-            except Exception:
-                pass
-        init_db()
+class TestMethodDeletion(DBTestCase):
 
     def test_system_methods_seeded(self):
         names = {name for _id, name in list_methods()}
@@ -0,0 +1,69 @@
+import asyncio
+import importlib.util
+import unittest
+from datetime import datetime
+
+HAS_AIOGRAM = importlib.util.find_spec("aiogram") is not None
+
+
+def _update(uid, update_id, chat_id=-100):
+    from aiogram.types import Chat, Message, Update, User
+    return Update(update_id=update_id, message=Message(
+        message_id=update_id, date=datetime.now(), chat=Chat(id=chat_id, type="group"),
+        from_user=User(id=uid, is_bot=False, first_name="u"), text="x"))
+
+
+@unittest.skipUnless(HAS_AIOGRAM, "aiogram is not installed")
+class TestPerChatOrderingMiddleware(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.events = []
+        self.running = 0
+        self.peak = 0
+
+    async def handler(self, event, data):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        self.events.append(("start", event.update_id))
+        await asyncio.sleep(0.02)
+        self.events.append(("end", event.update_id))
+        self.running -= 1
+        return event.update_id
+
+    async def test_same_key_runs_in_arrival_order(self):
+        from middlewares import PerChatOrderingMiddleware
+        mw = PerChatOrderingMiddleware()
+        results = await asyncio.gather(*(mw(self.handler, _update(1, i), {}) for i in range(1, 6)))
+        self.assertEqual(results, [1, 2, 3, 4, 5])
+        self.assertEqual(self.events, [(kind, i) for i in range(1, 6) for kind in ("start", "end")])
+        self.assertEqual(self.peak, 1)
+        self.assertEqual(mw.stats()["keys"], 0)  # idle keys are dropped
+
+    async def test_different_keys_overlap(self):
+        from middlewares import PerChatOrderingMiddleware
+        mw = PerChatOrderingMiddleware()
+        await asyncio.gather(mw(self.handler, _update(1, 1), {}), mw(self.handler, _update(2, 2), {}),
+                             mw(self.handler, _update(1, 3, chat_id=-200), {}))
+        self.assertEqual(self.peak, 3)
+        self.assertEqual([e for e in self.events[:3]], [("start", 1), ("start", 2), ("start", 3)])
+
+    async def test_semaphore_bounds_concurrency(self):
+        from middlewares import PerChatOrderingMiddleware
+        mw = PerChatOrderingMiddleware(max_concurrency=2)
+        await asyncio.gather(*(mw(self.handler, _update(uid, uid), {}) for uid in range(1, 7)))
+        self.assertEqual(self.peak, 2)
+        self.assertEqual(len(self.events), 12)
+
+    async def test_stats_report_queue_wait(self):
+        from middlewares import PerChatOrderingMiddleware
+        mw = PerChatOrderingMiddleware()
+        await asyncio.gather(*(mw(self.handler, _update(1, i), {}) for i in range(1, 4)))
+        stats = mw.stats()
+        self.assertEqual((stats["processed"], stats["active"], stats["waiting"]), (3, 0, 0))
+        # the third update waited for two handlers of ~20 ms each
+        self.assertGreaterEqual(stats["wait_max_ms"], 30)
+        self.assertGreater(stats["wait_avg_ms"], 0)
+        self.assertLess(stats["wait_avg_ms"], stats["wait_max_ms"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+
+from dbcase import DBTestCase
+from generators import (
+    create_approved_payment, create_payment, get_payment, get_payments, list_pending, list_user_payments,
+    list_payments,
+)
+from models import PAYMENT_FIELDS, Payment
+
+PAYMENT = dict(initiator_id=1, amount=100, currency='THB', method='Bank', description='d', category='c')
+
+
+class TestPayment(unittest.TestCase):
+    def test_mapping_compatibility(self):
+        p = Payment(id=1, amount=5.0, category=None)
+        self.assertEqual((p.id, p['amount'], p.get('id')), (1, 5.0, 1))
+        self.assertIsNone(p.status)  # not selected reads as None
+        self.assertEqual(p.get('status', 'x'), 'x')
+        self.assertIsNone(p.get('category', 'x'))
+        self.assertEqual(p.as_dict(), {'id': 1, 'amount': 5.0, 'category': None})
+        self.assertEqual(dict(p), p.as_dict())
+        with self.assertRaises(KeyError):
+            p['nope']
+        with self.assertRaises(AttributeError):
+            p.nope
+        self.assertFalse(hasattr(p, '__dict__'))
+
+
+class TestPaymentReaders(DBTestCase):
+    def test_fields_match_schema(self):
+        columns = [r[1] for r in self.query("PRAGMA table_xinfo(payments)")]
+        self.assertEqual(sorted(columns), sorted(PAYMENT_FIELDS))
+
+    def test_readers_return_records(self):
+        approved = create_approved_payment(approver_id=2, **PAYMENT)
+        pending = create_payment(**PAYMENT)
+        p = get_payment(approved)
+        self.assertIsInstance(p, Payment)
+        self.assertEqual((p.status, p.approved_by, p.version), ('APPROVED', 2, 1))
+        self.assertIs(get_payment(approved), p)  # cached record, no copy
+        self.assertEqual([x.id for x in get_payments([pending, approved])], [approved, pending])
+        self.assertEqual([x.id for x in list_pending()], [pending])
+        mine = list_user_payments(1)
+        self.assertTrue(all(isinstance(x, Payment) for x in mine))
+        self.assertIsNone(mine[0].approved_ts)  # not in the list columns
+        rows, cursor = list_payments()
+        self.assertEqual(([x.id for x in rows], cursor), ([approved], None))
+        self.assertEqual(rows[0].as_dict()['amount'], 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
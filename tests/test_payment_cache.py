@@ -0,0 +1,76 @@
+import unittest
+
+import payment_cache
+from dbcase import DBTestCase
+from generators import (
+    create_approved_payment, create_payment, get_payment, get_payments, approve_payment,
+    reject_payment, set_group_message
+)
+from payment_cache import PaymentCache
+
+PAYMENT = dict(initiator_id=1, approver_id=2, amount=100, currency='THB', method='Bank', description='d', category='c')
+
+
+class TestPaymentCache(DBTestCase):
+    def test_insert_populates_cache(self):
+        pid = create_approved_payment(**PAYMENT)
+        self.query("UPDATE payments SET description='changed behind the cache' WHERE id=?", pid)
+        self.assertEqual(get_payment(pid)['description'], 'd')
+
+    def test_write_by_another_worker_is_seen(self):
+        pid = create_approved_payment(**PAYMENT)
+        cached = get_payment(pid)
+        # another process: bumps the version but cannot invalidate this cache
+        self.query("UPDATE payments SET description='edited', version=version+1 WHERE id=?", pid)
+        self.assertEqual((get_payment(pid)['description'], get_payment(pid)['version']), ('edited', 2))
+        self.query("UPDATE payments SET description='again', version=version+1 WHERE id=?", pid)
+        self.assertEqual([p['description'] for p in get_payments([pid])], ['again'])
+        self.assertIsNot(get_payment(pid), cached)
+
+    def test_writers_invalidate(self):
+        pid = create_approved_payment(**PAYMENT)
+        set_group_message(pid, -100, 5)
+        p = get_payment(pid)
+        self.assertEqual((p['group_msg_id'], p['version']), (5, 2))
+        pending = create_payment(initiator_id=1, amount=1, currency='THB', method='Bank', description='x', category='c')
+        self.assertEqual(get_payment(pending)['status'], 'PENDING')
+        approve_payment(pending, approver_id=2)
+        self.assertEqual(get_payment(pending)['status'], 'APPROVED')
+        other = create_payment(initiator_id=1, amount=1, currency='THB', method='Bank', description='x', category='c')
+        reject_payment(other, approver_id=2)
+        self.assertEqual(get_payment(other)['status'], 'REJECTED')
+
+    def test_card_reused_per_version(self):
+        calls = []
+
+        def render(p):
+            calls.append(p['version'])
+            return f"{p['id']}:{p['version']}"
+
+        pid = create_approved_payment(**PAYMENT)
+        self.assertEqual(payment_cache.card(get_payment(pid), render), f"{pid}:1")
+        payment_cache.card(get_payment(pid), render)
+        set_group_message(pid, -100, 5)
+        self.assertEqual(payment_cache.card(get_payment(pid), render), f"{pid}:2")
+        self.assertEqual(calls, [1, 2])
+
+
+class TestPaymentCacheUnit(unittest.TestCase):
+    def test_stale_row_not_cached_after_invalidate(self):
+        cache = PaymentCache(maxsize=10)
+        cache.invalidate(1, version=3)
+        cache.put({'id': 1, 'version': 2})
+        self.assertIsNone(cache.get(1))
+        cache.put({'id': 1, 'version': 3})
+        self.assertEqual(cache.get(1)['version'], 3)
+
+    def test_lru_bound(self):
+        cache = PaymentCache(maxsize=2)
+        for pid in (1, 2, 3):
+            cache.put({'id': pid, 'version': 1})
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(cache.stats()['size'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,20 +1,17 @@
 import os
+import tempfile
 import unittest
 
+from dbcase import DBTestCase
 from generators import (
-    init_db, create_payment, create_approved_payment, get_payment,
+    create_payment, create_approved_payment, get_payment,
     approve_payment, reject_payment, list_pending, set_approver, set_viewer,
-    set_initiator, get_roles, export_payments_csv
+    set_initiator, get_roles, export_payments_csv, export_payments
 )
 
-DB_FILE = os.path.join(os.path.dirname(__file__), '..', 'botdata.db')
-
-class TestPaymentsFlow(unittest.TestCase):
+class TestPaymentsFlow(DBTestCase):
     def setUp(self):
-        # Fresh DB
-        if os.path.exists(DB_FILE):
-            os.remove(DB_FILE)
-        init_db()
+        super().setUp()
         # Set roles
         set_initiator(111)
         set_approver(222)
@@ -62,9 +59,7 @@ class TestPaymentsFlow(unittest.TestCase):
         pid_p = create_payment(initiator_id=111, amount=456, currency='THB', method='USDT', description='P', category='CatP')
         pid_r = create_payment(initiator_id=111, amount=789, currency='THB', method='Cash', description='R', category='CatR')
         reject_payment(pid_r, approver_id=222)
-        export_path = os.path.join(os.path.dirname(__file__), '..', 'payments_export.csv')
-        if os.path.exists(export_path):
-            os.remove(export_path)
+        export_path = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), 'payments_export.csv')
         export_payments_csv(export_path)
         import csv
         with open(export_path, 'r', encoding='utf-8') as f:
@@ -76,5 +71,25 @@ class TestPaymentsFlow(unittest.TestCase):
         self.assertNotIn(pid_p, exported_ids)
         self.assertNotIn(pid_r, exported_ids)
 
+    def test_export_jsonl_typed(self):
+        import gzip
+        import json
+        pid = create_approved_payment(initiator_id=111, approver_id=222, amount=12.5, currency='THB', method='Cash', description='Ж', category='CatA')
+        create_payment(initiator_id=111, amount=1, currency='THB', method='Cash', description='P', category='CatP')
+        with tempfile.TemporaryDirectory() as tmp:
+            plain = export_payments(os.path.join(tmp, 'p.jsonl'), 'jsonl')
+            packed = export_payments(os.path.join(tmp, 'p.jsonl.gz'), 'jsonl.gz')
+            with open(plain, encoding='utf-8') as f:
+                rows = [json.loads(line) for line in f]
+            with gzip.open(packed, 'rt', encoding='utf-8') as f:
+                self.assertEqual([json.loads(line) for line in f], rows)
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['id'], pid)
+        self.assertEqual(rows[0]['amount'], 12.5)
+        self.assertEqual(rows[0]['description'], 'Ж')
+        self.assertIsNone(rows[0]['rejected_by'])
+        with self.assertRaises(ValueError):
+            export_payments('unused', 'xml')
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,58 @@
+import asyncio
+import sys
+import threading
+import time
+import unittest
+
+import profiler
+
+
+def busy_worker(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+class TestProfiler(unittest.TestCase):
+    def test_profile_collects_table_and_stacks(self):
+        async def scenario():
+            stop = threading.Event()
+            worker = threading.Thread(target=busy_worker, args=(stop,), name="busy")
+            worker.start()
+
+            async def ticker():
+                while not stop.is_set():
+                    time.sleep(0.001)  # loop-thread work seen by cProfile
+                    await asyncio.sleep(0.005)
+
+            tick = asyncio.create_task(ticker())
+            try:
+                table, stacks = await profiler.profile(0.3, interval_ms=2)
+            finally:
+                stop.set()
+                await tick
+                worker.join()
+            return table, stacks
+
+        table, stacks = asyncio.run(scenario())
+        self.assertIn("cumulative", table)
+        self.assertIn("ticker", table)
+        lines = stacks.splitlines()
+        self.assertTrue(lines)
+        stack, count = lines[0].rsplit(" ", 1)
+        self.assertGreater(int(count), 0)
+        self.assertTrue(any(line.startswith("busy;") and "busy_worker" in line for line in lines))
+        self.assertIsNone(sys.getprofile())  # nothing left installed
+
+    def test_one_session_at_a_time(self):
+        async def scenario():
+            first = asyncio.create_task(profiler.profile(0.2))
+            await asyncio.sleep(0.05)
+            with self.assertRaises(profiler.ProfileBusy):
+                await profiler.profile(0.1)
+            await first
+
+        asyncio.run(scenario())
+
+
+if __name__ == '__main__':
+    unittest.main()
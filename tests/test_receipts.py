@@ -0,0 +1,65 @@
+import asyncio
+import io
+import os
+import tempfile
+import unittest
+import zipfile
+
+import receipt_store
+from dbcase import DBTestCase
+from generators import (
+    create_approved_payment, list_payment_receipts, list_receipts_to_fetch
+)
+
+PAYMENT = dict(initiator_id=111, approver_id=222, amount=10, currency='THB', method='Cash', description='d', category='c')
+
+
+class FakeBot:
+    def __init__(self, files):
+        self.files = files
+        self.calls = []
+
+    async def download(self, file_id, destination=None):
+        self.calls.append(file_id)
+        return io.BytesIO(self.files[file_id])
+
+
+class TestReceipts(DBTestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.environ['RECEIPTS_DIR'] = self.tmp.name
+
+    def tearDown(self):
+        del os.environ['RECEIPTS_DIR']
+        self.tmp.cleanup()
+
+    def test_receipt_persisted_with_payment(self):
+        pid = create_approved_payment(receipt_file='F1', receipt_kind='photo', receipt_unique_id='U1', **PAYMENT)
+        rows = list_payment_receipts(pid)
+        self.assertEqual([(r['file_id'], r['kind']) for r in rows], [('F1', 'photo')])
+        self.assertEqual(list_payment_receipts(create_approved_payment(**PAYMENT)), [])
+
+    def test_download_once_and_export_zip(self):
+        p1 = create_approved_payment(receipt_file='F1', receipt_kind='photo', receipt_unique_id='U1', **PAYMENT)
+        p2 = create_approved_payment(receipt_file='F2', receipt_kind='photo', receipt_unique_id='U1', **PAYMENT)
+        p3 = create_approved_payment(receipt_file='F3', receipt_kind='document', receipt_unique_id='U3', receipt_name='inv.pdf', **PAYMENT)
+        bot = FakeBot({'F1': b'same', 'F2': b'same', 'F3': b'other'})
+        self.assertEqual(asyncio.run(receipt_store.download_pending(bot)), 3)
+        self.assertEqual(sorted(bot.calls), ['F1', 'F3'])  # F2 is the same Telegram file as F1
+        self.assertEqual(list_receipts_to_fetch(), [])
+        blobs = [f for _, _, files in os.walk(self.tmp.name) for f in files]
+        self.assertEqual(len(blobs), 2)
+
+        out = os.path.join(self.tmp.name, 'out.zip')
+        added, missing = receipt_store.export_receipts_zip(out)
+        self.assertEqual((added, missing), (3, 0))
+        with zipfile.ZipFile(out) as zf:
+            self.assertIn(f'PAY-{p3}_3.pdf', zf.namelist())
+            self.assertEqual(zf.read(f'PAY-{p1}_1.jpg'), b'same')
+            self.assertEqual(zf.read(f'PAY-{p2}_2.jpg'), b'same')
+        self.assertEqual(receipt_store.export_receipts_zip(out, since='2000-01-01', until='2000-12-31'), (0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
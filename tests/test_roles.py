@@ -0,0 +1,60 @@
+import unittest
+
+from dbcase import DBTestCase
+from generators import (
+    init_db, set_initiator, set_approver, set_config, set_secondary_initiator,
+    add_role, remove_role, has_role, role_members, get_initiators, get_roles
+)
+
+
+class TestRoles(DBTestCase):
+
+    def test_migrates_legacy_config(self):
+        set_config('initiator_id', 1)
+        set_config('secondary_initiator_id', 2)
+        set_config('initiators', '3, 4;x')
+        set_config('approver_id', 5)
+        self.query("DELETE FROM user_roles")
+        self.query("DELETE FROM config WHERE key='roles_migrated'")  # a database from before user_roles
+        init_db()
+        self.assertEqual(get_initiators(), [1, 2, 3, 4])
+        self.assertTrue(has_role(5, 'approver'))
+        self.assertFalse(has_role(5, 'initiator'))
+
+    def test_revoked_roles_are_not_reseeded(self):
+        set_approver(5)
+        self.assertTrue(remove_role(5, 'approver'))
+        init_db()
+        self.assertFalse(has_role(5, 'approver'))
+
+    def test_holder_of_other_primary_key_keeps_role(self):
+        set_initiator(1)
+        set_secondary_initiator(1)
+        set_secondary_initiator(2)
+        self.assertEqual(get_initiators(), [1, 2])
+        set_initiator(3)
+        self.assertEqual(get_initiators(), [2, 3])
+
+    def test_primary_replaced_extra_kept(self):
+        set_approver(10)
+        add_role(11, 'approver')
+        set_approver(12)
+        self.assertEqual(role_members('approver'), {11, 12})
+        self.assertEqual(get_roles()['approver_id'], 12)
+
+    def test_many_approvers_and_revoke(self):
+        set_initiator(1)
+        set_secondary_initiator(2)
+        for uid in range(100, 120):
+            add_role(uid, 'approver')
+        self.assertTrue(has_role(119, 'approver'))
+        self.assertTrue(has_role(2, 'initiator', 'approver'))
+        self.assertTrue(remove_role(119, 'approver'))
+        self.assertFalse(has_role(119, 'approver'))
+        self.assertFalse(remove_role(119, 'approver'))
+        with self.assertRaises(ValueError):
+            add_role(1, 'admin')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime
+from unittest import mock
+
+import sheet_logger
+from models import Payment
+from sheets_fake import FakeClient, QuotaExceeded
+
+
+def _payment(pid, approved_at="2026-03-15 10:00:00"):
+    return Payment(id=pid, amount=100, currency="THB", method="Bank",
+                   category="it", description=f"p{pid}", approved_at=approved_at)
+
+
+class TestSheetLogger(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeClient()
+        sheet_logger.use_backend(lambda: self.client)
+        self._backoff, sheet_logger.RETRY_BACKOFF = sheet_logger.RETRY_BACKOFF, 0
+        self.env = mock.patch.dict(os.environ, {"GSHEET_ID": "test", "GSHEET_TAB": "Approvals", "GSHEET_ROLLOVER": "month"})
+        self.env.start()
+
+    def tearDown(self):
+        self.env.stop()
+        sheet_logger.use_backend(None)
+        sheet_logger.RETRY_BACKOFF = self._backoff
+        sheet_logger._ws = None
+        sheet_logger._state = "idle"
+
+    def _tab(self, title):
+        return self.client.open_by_key("test").worksheet(title).get_all_values()
+
+    def test_configure_from_env(self):
+        sheet_logger.configure_from_env()
+        self.assertTrue(sheet_logger.is_ready())
+        period = datetime.now().strftime("%Y-%m")
+        self.assertEqual(sheet_logger.get_status()["worksheet_title"], f"Approvals {period}")
+        self.assertEqual(self._tab(f"Approvals {period}"), [sheet_logger.HEADER])
+        index = self._tab("Approvals Index")
+        self.assertEqual(index[0], sheet_logger.INDEX_HEADER)
+        self.assertIn(f"Approvals {period}", [r[1] for r in index[1:]])
+
+    def test_disabled_without_spreadsheet(self):
+        with mock.patch.dict(os.environ, {"GSHEET_ID": ""}):
+            sheet_logger.configure_from_env()
+        self.assertEqual(sheet_logger.get_status()["state"], "disabled")
+
+    def test_approval_goes_to_its_month(self):
+        sheet_logger.configure_from_env()
+        sheet_logger.log_approval_to_sheet(_payment(1, "2026-03-15 10:00:00"))
+        sheet_logger.log_approval_to_sheet(_payment(2, "2026-04-01 09:00:00"))
+        sheet_logger.flush()
+        self.assertEqual([r[0] for r in self._tab("Approvals 2026-03")[1:]], [1])
+        self.assertEqual([r[0] for r in self._tab("Approvals 2026-04")[1:]], [2])
+
+    def test_batch_is_one_request_per_tab(self):
+        sheet_logger.configure_from_env()
+        sheet_logger.log_approvals_to_sheet([_payment(1)])  # creates the 2026-03/04 tabs
+        sheet_logger.flush()
+        before = self.client.requests
+        sheet_logger.log_approvals_to_sheet([_payment(i) for i in range(2, 52)])
+        sheet_logger.flush()
+        self.assertEqual(self.client.requests - before, 1)
+        self.assertEqual(len(self._tab("Approvals 2026-03")), 52)
+
+    def test_retry_on_quota_error(self):
+        sheet_logger.configure_from_env()
+        sheet_logger.log_approvals_to_sheet([_payment(1)])
+        sheet_logger.flush()
+        retries = sheet_logger._stats["retries"]
+        self.client.fail_every = self.client.requests + 1  # the next request gets a 429
+        sheet_logger.log_approvals_to_sheet([_payment(2), _payment(3)])
+        sheet_logger.flush()
+        self.client.fail_every = 0
+        self.assertEqual(sheet_logger._stats["retries"], retries + 1)
+        self.assertEqual([r[0] for r in self._tab("Approvals 2026-03")[1:]], [1, 2, 3])
+
+    def test_append_not_retried_on_503(self):
+        sheet_logger.configure_from_env()
+        sheet_logger.log_approvals_to_sheet([_payment(1)])
+        sheet_logger.flush()
+        ws = self.client.open_by_key("test").worksheet("Approvals 2026-03")
+        unavailable = QuotaExceeded("The service is currently unavailable")
+        unavailable.response.status_code = unavailable.code = 503
+        with mock.patch.object(ws, "append_rows", side_effect=unavailable) as append:
+            sheet_logger.log_approvals_to_sheet([_payment(2)])
+            sheet_logger.flush()
+        self.assertEqual(append.call_count, 1)  # a 503 append may have landed: no blind retry
+
+    def test_tab_recovered_after_failed_header(self):
+        sheet_logger.configure_from_env()
+        sh = self.client.open_by_key("test")
+        add_worksheet = sh.add_worksheet
+        unavailable = QuotaExceeded("The service is currently unavailable")
+        unavailable.response.status_code = unavailable.code = 503
+
+        def add_broken(title, **kwargs):
+            ws = add_worksheet(title, **kwargs)
+            if title == "Approvals 2026-05":
+                ws.append_row = mock.Mock(side_effect=unavailable)  # header append fails once
+            return ws
+
+        with mock.patch.object(sh, "add_worksheet", side_effect=add_broken):
+            sheet_logger.log_approval_to_sheet(_payment(1, "2026-05-02 10:00:00"))
+            sheet_logger.flush()
+        del sh.worksheet("Approvals 2026-05").append_row
+        sheet_logger.log_approval_to_sheet(_payment(2, "2026-05-03 10:00:00"))
+        sheet_logger.flush()
+        self.assertEqual(self._tab("Approvals 2026-05"), [sheet_logger.HEADER, [2, 100.0, "THB", "Bank", "it", "p2", "2026-05-03 10:00:00"]])
+
+    def test_rows_rollover(self):
+        with mock.patch.dict(os.environ, {"GSHEET_ROLLOVER": "rows:3"}):
+            sheet_logger.configure_from_env()
+            sheet_logger.log_approvals_to_sheet([_payment(i) for i in range(1, 8)])
+            sheet_logger.flush()
+            self.assertEqual([r[0] for r in self._tab("Approvals 001")[1:]], [1, 2, 3])
+            self.assertEqual([r[0] for r in self._tab("Approvals 002")[1:]], [4, 5, 6])
+            self.assertEqual([r[0] for r in self._tab("Approvals 003")[1:]], [7])
+            # a restart continues in the partly filled tab, not in the pre-created one
+            sheet_logger.configure_from_env()
+            sheet_logger.log_approval_to_sheet(_payment(8))
+            sheet_logger.flush()
+            self.assertEqual([r[0] for r in self._tab("Approvals 003")[1:]], [7, 8])
+
+    def test_rows_buffered_while_initializing(self):
+        sheet_logger._state = "initializing"
+        sheet_logger.log_approval_to_sheet(_payment(1))
+        self.assertEqual(sheet_logger.get_status()["buffered"], 1)
+        sheet_logger.configure_from_env()
+        sheet_logger.flush()
+        self.assertEqual([r[0] for r in self._tab("Approvals 2026-03")[1:]], [1])
+
+    def test_fake_persists_to_sqlite(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "sheets.db")
+            self.client = FakeClient(db_path=path)
+            sheet_logger.configure_from_env()
+            sheet_logger.log_approval_to_sheet(_payment(1))
+            sheet_logger.flush()
+            self.client = FakeClient(db_path=path)
+            self.assertEqual([r[0] for r in self._tab("Approvals 2026-03")[1:]], [1])
+            self.client._db.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from dbcase import DBTestCase
+from generators import (
+    create_approved_payment, claim_staged, get_staged_claim,
+    create_approved_payments_bulk, claim_staged_bulk, get_payments
+)
+from memory_store import put_staged, pop_staged_many
+
+STAGED = dict(initiator_id=111, amount=1000, currency='THB', method='Cash', description='Rent', category='Cat')
+
+
+class TestStagedClaims(DBTestCase):
+    DB = None  # real file: every call opens its own connection, like separate bot workers
+
+    def _count(self, sql):
+        return self.query(sql)[0][0]
+
+    def test_repeated_approve_is_idempotent(self):
+        pid = create_approved_payment(approver_id=222, staged_id=42, **STAGED)
+        self.assertIsInstance(pid, int)
+        self.assertIsNone(create_approved_payment(approver_id=222, staged_id=42, **STAGED))
+        self.assertEqual(get_staged_claim(42)['payment_id'], pid)
+        self.assertEqual(self._count("SELECT COUNT(*) FROM payments"), 1)
+
+    def test_reject_after_approve_fails(self):
+        create_approved_payment(approver_id=222, staged_id=7, **STAGED)
+        self.assertFalse(claim_staged(7, 'REJECT', 222))
+        self.assertTrue(claim_staged(8, 'REJECT', 222))
+        self.assertFalse(claim_staged(8, 'REJECT', 222))
+
+    def test_parallel_approvals_insert_once(self):
+        def approve(i):
+            return create_approved_payment(approver_id=222, staged_id=1000 + i % 3, **STAGED)
+
+        with ThreadPoolExecutor(max_workers=32) as pool:
+            results = list(pool.map(approve, range(300)))
+        pids = [r for r in results if r is not None]
+        self.assertEqual(len(pids), 3)
+        self.assertEqual(len(set(pids)), 3)
+        self.assertEqual(self._count("SELECT COUNT(*) FROM payments"), 3)
+        self.assertEqual(self._count("SELECT COUNT(*) FROM audit_log WHERE action='APPROVE'"), 3)
+
+    def test_parallel_approve_and_reject_race(self):
+        def act(i):
+            if i % 2:
+                return 'A' if create_approved_payment(approver_id=222, staged_id=5, **STAGED) else None
+            return 'R' if claim_staged(5, 'REJECT', 222) else None
+
+        with ThreadPoolExecutor(max_workers=32) as pool:
+            winners = [r for r in pool.map(act, range(200)) if r]
+        self.assertEqual(len(winners), 1)
+        expected = 1 if winners[0] == 'A' else 0
+        self.assertEqual(self._count("SELECT COUNT(*) FROM payments"), expected)
+
+
+class TestBulkDecisions(DBTestCase):
+    def _count(self, sql):
+        return self.query(sql)[0][0]
+
+    def test_bulk_approve_single_transaction(self):
+        create_approved_payment(approver_id=222, staged_id=1, **STAGED)  # already handled
+        items = [(i, dict(STAGED, description=f'd{i}', group_chat_id=-100, group_msg_id=i)) for i in range(1, 51)]
+        done = create_approved_payments_bulk(items, approver_id=222)
+        self.assertEqual(sorted(done), list(range(2, 51)))
+        payments = get_payments(done.values())
+        self.assertEqual([p['id'] for p in payments], sorted(done.values()))
+        self.assertTrue(all(p['status'] == 'APPROVED' and p['group_chat_id'] == -100 for p in payments))
+        self.assertEqual(self._count("SELECT COUNT(*) FROM audit_log WHERE action='POSTED'"), 49)
+        self.assertEqual(create_approved_payments_bulk(items, approver_id=222), {})
+        # AUTOINCREMENT keeps counting after explicit ids
+        pid = create_approved_payment(approver_id=222, **STAGED)
+        self.assertEqual(pid, max(done.values()) + 1)
+
+    def test_bulk_reject(self):
+        claim_staged(3, 'REJECT', 222)
+        self.assertEqual(claim_staged_bulk([1, 2, 3], 'REJECT', 222), [1, 2])
+
+    def test_pop_staged_many_by_initiator(self):
+        put_staged(9001, dict(STAGED, initiator_id=1))
+        put_staged(9002, dict(STAGED, initiator_id=2))
+        taken = pop_staged_many(initiator_id=2)
+        self.assertEqual([sid for sid, _ in taken], [9002])
+        self.assertEqual([sid for sid, _ in pop_staged_many(temp_ids=[9001, 9002])], [9001])
+
+
+if __name__ == '__main__':
+    unittest.main()
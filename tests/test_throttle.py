@@ -0,0 +1,140 @@
+import asyncio
+import importlib.util
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from throttle import TokenBuckets
+
+HAS_AIOGRAM = importlib.util.find_spec("aiogram") is not None
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTokenBuckets(unittest.TestCase):
+    def test_burst_then_refill(self):
+        clock = Clock()
+        b = TokenBuckets(rate=1, burst=3, clock=clock)
+        self.assertEqual([b.take("u")[0] for _ in range(3)], [0.0, 0.0, 0.0])
+        wait, notify = b.take("u")
+        self.assertAlmostEqual(wait, 1.0)
+        self.assertTrue(notify)
+        self.assertFalse(b.take("u")[1])  # told once
+        clock.now = 1.0
+        self.assertEqual(b.take("u"), (0.0, False))
+        self.assertEqual(b.take("other"), (0.0, False))
+
+    def test_full_buckets_are_evicted(self):
+        clock = Clock()
+        b = TokenBuckets(rate=1, burst=2, evict_every=60, clock=clock)
+        b.take("a")
+        b.take("b")
+        b.take("b")
+        clock.now = 1.5
+        self.assertEqual(b.evict(), 1)  # "a" is full again, "b" is not
+        self.assertEqual(len(b), 1)
+        clock.now = 62
+        b.take("c")  # periodic eviction on use
+        self.assertEqual(len(b), 1)
+
+
+@unittest.skipUnless(HAS_AIOGRAM, "aiogram is not installed")
+class TestThrottlingMiddleware(unittest.TestCase):
+    def _update(self, uid, text, update_id=1):
+        from aiogram.types import Chat, Message, Update, User
+        return Update(update_id=update_id, message=Message(
+            message_id=update_id, date=datetime.now(), chat=Chat(id=-100, type="group"),
+            from_user=User(id=uid, is_bot=False, first_name="u"), text=text))
+
+    def test_limits_and_coalescing(self):
+        from middlewares import ThrottlingMiddleware
+
+        async def scenario():
+            mw = ThrottlingMiddleware(rate=0.001, burst=5, commands={"export": (0.001, 3)})
+            calls = []
+
+            async def handler(event, data):
+                calls.append(event.message.text)
+                await asyncio.sleep(0.02)
+                return True
+
+            # identical expensive commands at once run once
+            results = await asyncio.gather(*(mw(handler, self._update(1, "/export csv"), {}) for _ in range(2)))
+            self.assertEqual(results, [True, None])
+            self.assertEqual(mw.stats()["coalesced"], 1)
+            await mw(handler, self._update(1, "/export csv"), {})
+            # command bucket (3) is spent before the user bucket (5)
+            self.assertIsNone(await mw(handler, self._update(1, "/export jsonl"), {}))
+            self.assertTrue(await mw(handler, self._update(1, "/ping"), {}))
+            self.assertIsNone(await mw(handler, self._update(1, "/ping"), {}))
+            self.assertTrue(await mw(handler, self._update(2, "/ping"), {}))
+            self.assertEqual(mw.stats()["throttled"], 2)
+            self.assertEqual(calls.count("/export csv"), 2)
+
+        asyncio.run(scenario())
+
+
+    def test_import_caption_is_an_expensive_command(self):
+        from aiogram.types import Chat, Document, Message, Update, User
+        from middlewares import ThrottlingMiddleware, update_command
+
+        def upload(update_id, file_id):
+            return Update(update_id=update_id, message=Message(
+                message_id=update_id, date=datetime.now(), chat=Chat(id=1, type="private"),
+                from_user=User(id=1, is_bot=False, first_name="u"), caption="/import",
+                document=Document(file_id=file_id, file_unique_id=file_id)))
+
+        self.assertEqual(update_command(upload(1, "a")), "import")
+
+        async def scenario():
+            mw = ThrottlingMiddleware(rate=0.001, burst=50, commands={"import": (0.001, 3)})
+            calls = []
+
+            async def handler(event, data):
+                calls.append(event.message.document.file_id)
+                await asyncio.sleep(0.02)
+                return True
+
+            # the same file twice at once runs once; another file is not coalesced with it
+            results = await asyncio.gather(mw(handler, upload(1, "a"), {}), mw(handler, upload(2, "a"), {}),
+                                           mw(handler, upload(3, "b"), {}))
+            self.assertEqual(results, [True, None, True])
+            with mock.patch("aiogram.types.Message.answer", new_callable=mock.AsyncMock):
+                self.assertIsNone(await mw(handler, upload(4, "c"), {}))  # import bucket (3, the coalesced one included) spent
+            self.assertEqual(calls, ["a", "b"])
+
+        asyncio.run(scenario())
+
+    def test_refused_callbacks_are_always_answered(self):
+        from aiogram.types import CallbackQuery, Chat, Message, Update, User
+        from middlewares import ThrottlingMiddleware
+
+        def tap(update_id):
+            user = User(id=1, is_bot=False, first_name="u")
+            return Update(update_id=update_id, callback_query=CallbackQuery(
+                id=str(update_id), from_user=user, chat_instance="c", data="x",
+                message=Message(message_id=1, date=datetime.now(), chat=Chat(id=-100, type="group"), text="card")))
+
+        async def handler(event, data):
+            return True
+
+        async def scenario():
+            mw = ThrottlingMiddleware(rate=0.001, burst=1, commands={})
+            with mock.patch("aiogram.types.CallbackQuery.answer", new_callable=mock.AsyncMock) as answer:
+                self.assertTrue(await mw(handler, tap(1), {}))
+                self.assertIsNone(await mw(handler, tap(2), {}))
+                self.assertIsNone(await mw(handler, tap(3), {}))
+            self.assertEqual(answer.await_count, 2)
+            self.assertIn("Too many requests", answer.await_args_list[0].args[0])
+            self.assertIsNone(answer.await_args_list[1].args[0])  # told once, spinner still stopped
+
+        asyncio.run(scenario())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+"""Rate-limited wrapper for outgoing Telegram calls.
+
+Telegram allows roughly 30 messages/s per bot and about 20 messages per minute in one
+group. Flows that touch many messages at once (bulk approve/reject) go through send()
+so they queue up instead of hitting 429 Too Many Requests."""
+
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, TypeVar
+
+from aiogram.exceptions import TelegramRetryAfter
+
+T = TypeVar("T")
+
+GLOBAL_RATE = 25.0          # calls per second for the whole bot
+GROUP_BURST = 20            # per group chat: 20 calls ...
+GROUP_RATE = 20 / 60.0      # ... per minute
+PRIVATE_BURST = 3
+PRIVATE_RATE = 1.0
+MAX_RETRIES = 3
+
+
+class _Bucket:
+    """Token bucket; acquire() sleeps until a token is available."""
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.ts = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.ts) * self.rate)
+                self.ts = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+_global = _Bucket(GLOBAL_RATE, GLOBAL_RATE)
+_chats: Dict[int, _Bucket] = {}
+
+
+def _chat_bucket(chat_id: int) -> _Bucket:
+    b = _chats.get(chat_id)
+    if b is None:
+        if chat_id < 0:  # groups and supergroups
+            b = _Bucket(GROUP_BURST, GROUP_RATE)
+        else:
+            b = _Bucket(PRIVATE_BURST, PRIVATE_RATE)
+        _chats[chat_id] = b
+    return b
+
+
+async def send(chat_id: int, call: Callable[[], Awaitable[T]]) -> T:
+    """Run `call()` (a Bot API request targeting chat_id) within the rate limits.
+    RetryAfter responses are waited out and retried up to MAX_RETRIES times."""
+    attempt = 0
+    while True:
+        await _chat_bucket(chat_id).acquire()
+        await _global.acquire()
+        try:
+            return await call()
+        except TelegramRetryAfter as e:
+            attempt += 1
+            if attempt > MAX_RETRIES:
+                raise
+            logging.warning(f"Telegram flood control for chat {chat_id}: retry in {e.retry_after}s")
+            await asyncio.sleep(e.retry_after)
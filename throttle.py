@@ -0,0 +1,58 @@
+"""In-memory token buckets for inbound rate limiting (see middlewares.ThrottlingMiddleware).
+
+One bucket per key, refilled at `rate` tokens per second up to `burst`. A bucket that has
+refilled completely carries no information, so such buckets are dropped every
+`evict_every` seconds: memory stays proportional to the users active in the last minute."""
+
+import time
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated", "denied")
+
+    def __init__(self, tokens: float, now: float):
+        self.tokens = tokens
+        self.updated = now
+        self.denied = False  # a refusal was already reported since the last granted token
+
+
+class TokenBuckets:
+    def __init__(self, rate: float, burst: float, evict_every: float = 60.0, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.evict_every = evict_every
+        self._clock = clock
+        self._buckets: dict = {}
+        self._evicted_at = clock()
+
+    def take(self, key) -> tuple[float, bool]:
+        """Spend one token of `key`. Returns (0.0, False) if allowed, else (seconds until the
+        next token, True for the first refusal in a row: the caller tells the user once)."""
+        now = self._clock()
+        if now - self._evicted_at >= self.evict_every:
+            self.evict(now)
+        b = self._buckets.get(key)
+        if b is None:
+            b = self._buckets[key] = _Bucket(self.burst, now)
+        else:
+            b.tokens = min(self.burst, b.tokens + (now - b.updated) * self.rate)
+            b.updated = now
+        if b.tokens >= 1:
+            b.tokens -= 1
+            b.denied = False
+            return 0.0, False
+        first = not b.denied
+        b.denied = True
+        return (1 - b.tokens) / self.rate, first
+
+    def evict(self, now: float | None = None) -> int:
+        """Drop buckets that are full again. Returns how many were dropped."""
+        now = self._clock() if now is None else now
+        self._evicted_at = now
+        full = [k for k, b in self._buckets.items() if b.tokens + (now - b.updated) * self.rate >= self.burst]
+        for k in full:
+            del self._buckets[k]
+        return len(full)
+
+    def __len__(self) -> int:
+        return len(self._buckets)
@@ -2,23 +2,18 @@
 set -euo pipefail
 
 SERVICE=bot
-DBSERVICE=db
 COMPOSE_FILE=docker-compose.yml
 
-echo "[update] Stopping containers..."
-docker compose -f "$COMPOSE_FILE" down --remove-orphans || true
-
+# Build while the old container keeps serving; the switch below only costs the graceful
+# drain of the old process (stop_grace_period) plus the startup of the new one.
 echo "[update] Building images (no cache)..."
 docker compose -f "$COMPOSE_FILE" build --no-cache --pull
 
-echo "[update] Starting database..."
-docker compose -f "$COMPOSE_FILE" up -d "$DBSERVICE"
-
-echo "[update] Waiting 25s for DB warm-up..."
-sleep 25
+echo "[update] Recreating bot (old one drains and snapshots its state on SIGTERM)..."
+docker compose -f "$COMPOSE_FILE" up -d --no-deps --remove-orphans "$SERVICE"
 
-echo "[update] Starting bot..."
-docker compose -f "$COMPOSE_FILE" up -d "$SERVICE"
+echo "[update] Starting the other services if needed..."
+docker compose -f "$COMPOSE_FILE" up -d
 
 echo "[update] Showing status:"
 docker compose -f "$COMPOSE_FILE" ps